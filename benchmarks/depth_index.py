@@ -0,0 +1,95 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Micro-benchmark of the Oasis order book walk: the original per-level loop against `DepthIndex`.
+
+Run from the repository root with `python3 -m benchmarks.depth_index`.
+"""
+
+import argparse
+import random
+import time
+
+from simple_arbitrage_keeper.order_book import DepthIndex, WAD
+
+
+def loop_base_for_quote(asks: list, quote_amount: float):
+    """The original `oasis_order_size` walk of the asks, kept as the baseline"""
+    entry_token_amount = 0
+    arb_token_amount = 0
+
+    for order in asks:
+        entry_token_amount = entry_token_amount + order[0] * order[1]
+        arb_token_amount = arb_token_amount + order[1]
+
+        if entry_token_amount >= quote_amount:
+            final_arb_token_amount = arb_token_amount - order[1] + \
+                (quote_amount - (entry_token_amount - order[0] * order[1])) * (1/order[0])
+            return int(final_arb_token_amount*10**18)
+
+
+def synthetic_asks(levels: int, seed: int):
+    generator = random.Random(seed)
+    price = 200.0
+    asks = []
+    for _ in range(levels):
+        price += generator.uniform(0.0, 0.05)
+        asks.append([round(price, 6), round(generator.uniform(0.01, 5.0), 6)])
+
+    return asks
+
+
+def measure(function, sizes: list):
+    started = time.perf_counter()
+    function(sizes)
+    return (time.perf_counter() - started) / len(sizes)
+
+
+def main():
+    parser = argparse.ArgumentParser("depth-index-benchmark")
+    parser.add_argument("--levels", type=int, nargs='+', default=[10, 1000, 50000],
+                        help="Order book depths to benchmark (default: 10 1000 50000)")
+    parser.add_argument("--sizes", type=int, default=500,
+                        help="Number of fill sizes priced per book (default: 500)")
+    parser.add_argument("--seed", type=int, default=1,
+                        help="Seed of the synthetic order books (default: 1)")
+    arguments = parser.parse_args()
+
+    print(f"{'levels':>8} {'build':>12} {'loop/size':>12} {'index/size':>12} {'speedup':>9} {'max diff (wei)':>16}")
+    for levels in arguments.levels:
+        asks = synthetic_asks(levels, arguments.seed)
+        total_quote = sum(price * amount for price, amount in asks)
+        sizes = [total_quote * (i + 1) / (arguments.sizes + 1) for i in range(arguments.sizes)]
+
+        started = time.perf_counter()
+        index = DepthIndex(asks)
+        build = time.perf_counter() - started
+
+        wad_sizes = [int(size * WAD) for size in sizes]
+        loop_results = [loop_base_for_quote(asks, size) for size in sizes]
+        index_results = index.base_for_quotes(wad_sizes)
+        max_diff = max(abs(a - b) for a, b in zip(loop_results, index_results) if a is not None and b is not None)
+
+        loop_time = measure(lambda batch: [loop_base_for_quote(asks, size) for size in batch], sizes)
+        index_time = measure(index.base_for_quotes, wad_sizes)
+
+        print(f"{levels:>8} {build*1000:>10.2f}ms {loop_time*1e6:>10.2f}us {index_time*1e6:>10.2f}us "
+              f"{loop_time/index_time:>8.1f}x {max_diff:>16}")
+
+
+if __name__ == '__main__':
+    main()
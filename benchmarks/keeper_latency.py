@@ -0,0 +1,294 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""End-to-end benchmark of the keeper block processing, against local stand-ins of the Oasis REST API and of a node.
+
+Every synthetic block moves the markets (the Uniswap reserves, and some of the Oasis order books), then goes through
+`SimpleArbitrageKeeper.process_block` as if the lifecycle had just seen it. The next block is only produced once the
+keeper has decided on the previous one. Block-to-decision latency percentiles, JSON-RPC and REST calls per block and
+memory use are reported, and can be saved and compared with a previous run.
+
+Run from the repository root, with pymaker and pyexchange on the path:
+
+    PYTHONPATH=lib/pymaker:lib/pyexchange python3 -m benchmarks.keeper_latency --output after.json --compare before.json
+
+The stand-ins (see `tests.stand_ins`) run in the benchmark process, so the latencies include their overhead: they are meant to compare
+versions of the keeper against each other, not to predict latencies in production. Transactions are never sent, as
+the minimum profit is beyond anything the synthetic markets offer. Any other argument is passed on to the keeper
+(e.g. `--max-route-hops 3` or `--oasis-max-staleness 2`).
+"""
+
+import argparse
+import collections
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from simple_arbitrage_keeper.simple_arbitrage_keeper import SimpleArbitrageKeeper
+from tests.stand_ins import OASIS_ADDRESS, OUR_ADDRESS, TX_MANAGER_ADDRESS, InjectedLatency, OasisHandler, RpcHandler, \
+    StandIn, SyntheticMarkets
+
+
+class DecisionWatch:
+    """ Wraps the evaluation run by the keeper scheduler, to know when the decision on a block has been taken """
+
+    def __init__(self, keeper: SimpleArbitrageKeeper):
+        self.evaluate = keeper.scheduler.evaluate
+        self.done = threading.Event()
+        self.failures = 0
+        keeper.scheduler.evaluate = self._evaluate
+
+    def _evaluate(self, block_number: int):
+        try:
+            self.evaluate(block_number)
+        except Exception:
+            self.failures += 1
+            raise
+        finally:
+            self.done.set()
+
+
+def total_counts(stand_ins: list) -> collections.Counter:
+    counts = collections.Counter()
+    for stand_in in stand_ins:
+        with stand_in.counts_lock:
+            counts.update(stand_in.counts)
+
+    return counts
+
+
+def percentile(ordered: list, percent: float) -> float:
+    return ordered[min(int(len(ordered) * percent / 100), len(ordered) - 1)] if ordered else 0.0
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              check=True).stdout.decode().strip()
+    except Exception:
+        return None
+
+
+def run(arguments, keeper_arguments: list) -> dict:
+    markets = SyntheticMarkets(arguments.pairs, arguments.levels, arguments.book_change_rate, arguments.volatility,
+                               arguments.divergence, arguments.seed)
+
+    def latency(milliseconds: float, seed: int) -> InjectedLatency:
+        return InjectedLatency(milliseconds / 1000, arguments.jitter, arguments.tail_probability, arguments.tail_factor, seed)
+
+    oasis_stand_ins = [StandIn(OasisHandler, markets, latency(arguments.api_latency, arguments.seed + index))
+                       for index in range(arguments.api_endpoints)]
+    rpc_stand_ins = [StandIn(RpcHandler, markets, latency(arguments.rpc_latency, arguments.seed + 100 + index))
+                     for index in range(arguments.rpc_endpoints)]
+
+    config = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+    json.dump({'pairs': markets.pairs}, config)
+    config.close()
+
+    if arguments.trace_memory:
+        tracemalloc.start()
+
+    keeper = None
+    try:
+        keeper = SimpleArbitrageKeeper(['--rpc-host'] + [stand_in.uri for stand_in in rpc_stand_ins] +
+                                       ['--oasis-api-endpoint'] + [stand_in.uri for stand_in in oasis_stand_ins] +
+                                       ['--eth-from', OUR_ADDRESS, '--eth-key',
+                                        '--oasis-address', OASIS_ADDRESS,
+                                        '--tx-manager', TX_MANAGER_ADDRESS,
+                                        '--config', config.name,
+                                        '--min-profit', str(10**12),
+                                        '--max-engagement', str(arguments.max_engagement)] + keeper_arguments)
+        watch = DecisionWatch(keeper)
+
+        started = time.perf_counter()
+        keeper.startup()
+        startup_time = time.perf_counter() - started
+
+        latencies = []
+        first_block = 1000000
+        for block_number in range(first_block, first_block + arguments.warmup + arguments.blocks):
+            if block_number == first_block + arguments.warmup:
+                oasis_counts = total_counts(oasis_stand_ins)
+                rpc_counts = total_counts(rpc_stand_ins)
+                traced_after_warmup = tracemalloc.get_traced_memory()[0] if arguments.trace_memory else None
+
+            markets.advance(block_number)
+            watch.done.clear()
+
+            started = time.perf_counter()
+            keeper.process_block()
+            watch.done.wait()
+            if block_number >= first_block + arguments.warmup:
+                latencies.append(time.perf_counter() - started)
+
+        oasis_counts = total_counts(oasis_stand_ins) - oasis_counts
+        rpc_counts = total_counts(rpc_stand_ins) - rpc_counts
+        traced = tracemalloc.get_traced_memory() if arguments.trace_memory else None
+    finally:
+        if keeper is not None:
+            keeper.shutdown()
+        if arguments.trace_memory:
+            tracemalloc.stop()
+        for stand_in in oasis_stand_ins + rpc_stand_ins:
+            stand_in.stop()
+        os.unlink(config.name)
+
+    ordered = sorted(latencies)
+    blocks = len(latencies)
+
+    return {
+        'benchmark': 'keeper_latency',
+        'commit': git_commit(),
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'parameters': dict(vars(arguments), keeper_arguments=keeper_arguments),
+        'blocks': blocks,
+        'failed_blocks': watch.failures,
+        'startup_s': round(startup_time, 3),
+        'latency_ms': {'p50': round(percentile(ordered, 50) * 1000, 3),
+                       'p95': round(percentile(ordered, 95) * 1000, 3),
+                       'p99': round(percentile(ordered, 99) * 1000, 3),
+                       'max': round(percentile(ordered, 100) * 1000, 3),
+                       'mean': round(sum(ordered) / blocks * 1000, 3)},
+        'per_block': {'rpc_requests': round(rpc_counts['requests'] / blocks, 3),
+                      'rpc_calls': round(rpc_counts['calls'] / blocks, 3),
+                      'rpc_methods': {key: round(count / blocks, 3) for key, count in sorted(rpc_counts.items())
+                                      if key not in ('requests', 'calls')},
+                      'oasis_requests': round(oasis_counts['requests'] / blocks, 3),
+                      'oasis_not_modified': round(oasis_counts['not_modified'] / blocks, 3)},
+        'memory_mb': {'max_rss': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                      'traced_peak': round(traced[1] / 2**20, 1) if traced else None,
+                      'traced_growth': round((traced[0] - traced_after_warmup) / 2**20, 3) if traced else None}
+    }
+
+
+COMPARED = [('latency p50 (ms)', ('latency_ms', 'p50')),
+            ('latency p95 (ms)', ('latency_ms', 'p95')),
+            ('latency p99 (ms)', ('latency_ms', 'p99')),
+            ('rpc requests/block', ('per_block', 'rpc_requests')),
+            ('rpc calls/block', ('per_block', 'rpc_calls')),
+            ('oasis requests/block', ('per_block', 'oasis_requests')),
+            ('max rss (MB)', ('memory_mb', 'max_rss'))]
+
+
+def report(results: dict):
+    latency = results['latency_ms']
+    per_block = results['per_block']
+    memory = results['memory_mb']
+
+    print(f"{results['blocks']} blocks ({results['failed_blocks']} failed) at commit {results['commit']}, "
+          f"startup {results['startup_s']:.2f}s")
+    print(f"block-to-decision: p50 {latency['p50']:.2f}ms, p95 {latency['p95']:.2f}ms, p99 {latency['p99']:.2f}ms, "
+          f"max {latency['max']:.2f}ms, mean {latency['mean']:.2f}ms")
+    print(f"per block: {per_block['rpc_requests']:.2f} JSON-RPC requests carrying {per_block['rpc_calls']:.2f} calls "
+          f"({', '.join(f'{method} {count:.2f}' for method, count in per_block['rpc_methods'].items())}), "
+          f"{per_block['oasis_requests']:.2f} Oasis requests of which {per_block['oasis_not_modified']:.2f} not modified")
+    print(f"memory: max rss {memory['max_rss']:.1f}MB" +
+          (f", traced peak {memory['traced_peak']:.1f}MB, traced growth after warmup {memory['traced_growth']:.3f}MB"
+           if memory['traced_peak'] is not None else ""))
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> list:
+    """ Print the change of every compared metric from `baseline`, returns the names of those which regressed """
+    print(f"{'':<22} {'baseline':>12} {'current':>12} {'change':>9}")
+
+    regressions = []
+    for name, (section, key) in COMPARED:
+        before = baseline[section][key]
+        after = results[section][key]
+        change = (after - before) / before * 100 if before else 0.0
+        regressed = change > max_regression
+
+        print(f"{name:<22} {before:>12.3f} {after:>12.3f} {change:>+8.1f}%" + ("  REGRESSION" if regressed else ""))
+        if regressed:
+            regressions.append(name)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser("keeper-latency-benchmark",
+                                     epilog="Any other argument is passed on to the keeper, e.g. `--max-route-hops 3`")
+    parser.add_argument("--blocks", type=int, default=2000,
+                        help="Number of synthetic blocks measured (default: 2000)")
+    parser.add_argument("--warmup", type=int, default=50,
+                        help="Number of synthetic blocks processed before measuring (default: 50)")
+    parser.add_argument("--pairs", type=int, default=3,
+                        help="Number of token pairs arbitraged, each with its own Oasis book and Uniswap exchange (default: 3)")
+    parser.add_argument("--levels", type=int, default=100,
+                        help="Number of levels of each side of the Oasis order books (default: 100)")
+    parser.add_argument("--book-change-rate", type=float, default=0.3,
+                        help="Probability that an Oasis order book changes from one block to the next (default: 0.3)")
+    parser.add_argument("--volatility", type=float, default=0.001,
+                        help="Standard deviation of the per-block log price change of the arb tokens (default: 0.001)")
+    parser.add_argument("--divergence", type=float, default=0.002,
+                        help="Standard deviation of the log difference between the Uniswap and Oasis prices (default: 0.002)")
+    parser.add_argument("--api-latency", type=float, default=20.0,
+                        help="Latency injected in every Oasis REST API request, in milliseconds (default: 20)")
+    parser.add_argument("--rpc-latency", type=float, default=5.0,
+                        help="Latency injected in every JSON-RPC request, in milliseconds (default: 5)")
+    parser.add_argument("--jitter", type=float, default=0.5,
+                        help="Uniform jitter of the injected latencies, as a fraction of them (default: 0.5)")
+    parser.add_argument("--tail-probability", type=float, default=0.01,
+                        help="Probability that a request is slowed down by --tail-factor (default: 0.01)")
+    parser.add_argument("--tail-factor", type=float, default=10.0,
+                        help="Factor the latency of the slowed down requests is multiplied by (default: 10)")
+    parser.add_argument("--api-endpoints", type=int, default=1,
+                        help="Number of Oasis REST API stand-ins, all serving the same books (default: 1)")
+    parser.add_argument("--rpc-endpoints", type=int, default=1,
+                        help="Number of node stand-ins, all serving the same chain (default: 1)")
+    parser.add_argument("--max-engagement", type=int, default=100,
+                        help="Ether amount of maximum engagement passed to the keeper (default: 100)")
+    parser.add_argument("--seed", type=int, default=1,
+                        help="Seed of the synthetic markets and injected latencies (default: 1)")
+    parser.add_argument("--trace-memory", dest='trace_memory', action='store_true',
+                        help="Trace Python allocations with tracemalloc, which slows everything down")
+    parser.add_argument("--output", type=str,
+                        help="File to save the results to, as JSON")
+    parser.add_argument("--compare", type=str,
+                        help="Results of a previous run to compare with, exiting with status 1 on a regression")
+    parser.add_argument("--max-regression", type=float, default=10.0,
+                        help="Increase of a compared metric, in percent, above which it counts as a regression (default: 10)")
+    (arguments, keeper_arguments) = parser.parse_known_args()
+
+    logging.basicConfig(format='%(asctime)-15s %(levelname)-8s %(message)s', level=logging.WARNING)
+
+    results = run(arguments, keeper_arguments)
+    report(results)
+
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if arguments.compare:
+        with open(arguments.compare, 'r') as file:
+            regressions = compare(results, json.load(file), arguments.max_regression)
+
+        if regressions:
+            print(f"Regressed beyond {arguments.max_regression:.0f}%: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
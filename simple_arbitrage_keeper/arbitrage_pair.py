@@ -0,0 +1,338 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Callable, Optional
+
+from pymaker import Address
+from pymaker.numeric import Wad
+
+from simple_arbitrage_keeper.gas_model import GasModel
+from simple_arbitrage_keeper.market_snapshot import MarketSnapshot
+from simple_arbitrage_keeper.metrics import ORDER_SIZE
+from simple_arbitrage_keeper.oasis_api import OrderBookSnapshot
+from simple_arbitrage_keeper.sizing import ProfitCurveSearch
+from simple_arbitrage_keeper.uniswap import UniswapReserves
+
+# Kovan Sai and Dai, named even when configured without a name
+KNOWN_TOKEN_NAMES = {Address('0xC4375B7De8af5a38a93548eb8453a498222C4fF2'): 'SAI',
+                     Address('0x4F96Fe3b7A6Cf9725f59d353F723c1bDb64CA6Aa'): 'DAI'}
+
+
+def known_token_name(address: Address) -> str:
+    """ Oasis REST API name of a well-known token, or its address if it has none """
+    return KNOWN_TOKEN_NAMES.get(address, str(address))
+
+
+class Opportunity:
+    """ The best arbitrage trade found for one pair in one block
+
+    Sell `entry_amount` of the entry token and buy `arb_amount` of the arb token on the start exchange,
+    then sell `arb_amount` of the arb token and buy at least `exit_amount` of the entry token on the end exchange.
+
+    Attributes:
+        pair: The :py:class:`ArbitragePair` traded
+        start_exchange_name: Either 'Oasis' or 'Uniswap'
+        end_exchange_name: Either 'Oasis' or 'Uniswap'
+        entry_amount: Amount of the entry token sold on the start exchange
+        arb_amount: Amount of the arb token bought on the start exchange and sold on the end exchange
+        exit_amount: Minimum amount of the entry token bought on the end exchange
+        profit: Expected profit in the entry token, before gas
+        net_profit: Expected profit in the entry token, net of the estimated gas cost
+        profit_oasis_to_uniswap: Best profit, before gas, starting on Oasis (None if unfillable)
+        profit_uniswap_to_oasis: Best profit, before gas, starting on Uniswap (None if unfillable)
+    """
+
+    def __init__(self, pair, start_exchange_name: str, end_exchange_name: str, entry_amount: Wad, arb_amount: Wad,
+                 exit_amount: Wad, profit: Wad, net_profit: Wad,
+                 profit_oasis_to_uniswap: Optional[Wad] = None, profit_uniswap_to_oasis: Optional[Wad] = None):
+        self.pair = pair
+        self.start_exchange_name = start_exchange_name
+        self.end_exchange_name = end_exchange_name
+        self.entry_amount = entry_amount
+        self.arb_amount = arb_amount
+        self.exit_amount = exit_amount
+        self.profit = profit
+        self.net_profit = net_profit
+        self.profit_oasis_to_uniswap = profit_oasis_to_uniswap
+        self.profit_uniswap_to_oasis = profit_uniswap_to_oasis
+
+    @property
+    def route(self) -> tuple:
+        return self.start_exchange_name, self.end_exchange_name
+
+    def is_profitable(self) -> bool:
+        return self.net_profit > self.pair.min_profit
+
+    def __repr__(self):
+        return f"Opportunity({self.pair.name} from {self.start_exchange_name} to {self.end_exchange_name}, " \
+               f"entry_amount={self.entry_amount}, profit={self.profit}, net_profit={self.net_profit})"
+
+
+class ArbitragePair:
+    """ An entry token / arb token pair, arbitraged between its OasisDEX market and the Uniswap exchanges of both tokens
+
+    Pricing is done entirely against a :py:class:`MarketSnapshot`, so evaluating a pair makes no calls at all.
+
+    Attributes:
+        entry_token: Address of the token the arbitrage starts and ends with
+        arb_token: Address of the token arbitraged between both exchanges
+        entry_token_name: Name of the entry token, as used by the Oasis REST API
+        arb_token_name: Name of the arb token, as used by the Oasis REST API
+        uniswap_entry_exchange: Address of the Uniswap exchange of the entry token
+        uniswap_arb_exchange: Address of the Uniswap exchange of the arb token
+        min_profit: Minimum profit (net of gas, in entry token) of a trade worth executing
+        max_engagement: Maximum amount of the entry token engaged in a single trade
+    """
+
+    def __init__(self, entry_token: Address, arb_token: Address, entry_token_name: str, arb_token_name: str,
+                 uniswap_entry_exchange: Address, uniswap_arb_exchange: Address, min_profit: Wad, max_engagement: Wad):
+        assert(isinstance(entry_token, Address))
+        assert(isinstance(arb_token, Address))
+        assert(isinstance(entry_token_name, str))
+        assert(isinstance(arb_token_name, str))
+        assert(isinstance(uniswap_entry_exchange, Address))
+        assert(isinstance(uniswap_arb_exchange, Address))
+        assert(isinstance(min_profit, Wad))
+        assert(isinstance(max_engagement, Wad))
+
+        self.entry_token = entry_token
+        self.arb_token = arb_token
+        self.entry_token_name = entry_token_name
+        self.arb_token_name = arb_token_name
+        self.uniswap_entry_exchange = uniswap_entry_exchange
+        self.uniswap_arb_exchange = uniswap_arb_exchange
+        self.min_profit = min_profit
+        self.max_engagement = max_engagement
+
+    @staticmethod
+    def from_config(pair_config: dict, min_profit: Wad, max_engagement: Wad, token_name: Callable[[Address], str]):
+        """ Create a pair from its `--config` entry (or the equivalent command line arguments)
+
+        Args:
+            pair_config: Dictionary keyed by the names of the pair command line arguments
+            min_profit: The minimum profit used unless `min-profit` is given
+            max_engagement: The maximum engagement used unless `max-engagement` is given
+            token_name: Function naming the entry token unless `entry-token-name` is given
+        """
+        entry_token = Address(pair_config['entry-token'])
+
+        return ArbitragePair(entry_token=entry_token,
+                             arb_token=Address(pair_config['arb-token']),
+                             entry_token_name=pair_config.get('entry-token-name', token_name(entry_token)),
+                             arb_token_name=pair_config['arb-token-name'] if pair_config['arb-token-name'] != 'WETH' else 'ETH',
+                             uniswap_entry_exchange=Address(pair_config['uniswap-entry-exchange']),
+                             uniswap_arb_exchange=Address(pair_config['uniswap-arb-exchange']),
+                             min_profit=Wad(int(pair_config['min-profit'] * 10**18)) if 'min-profit' in pair_config else min_profit,
+                             max_engagement=Wad(int(pair_config['max-engagement'] * 10**18)) if 'max-engagement' in pair_config else max_engagement)
+
+    @property
+    def name(self) -> str:
+        return f"{self.arb_token_name}/{self.entry_token_name}"
+
+    @property
+    def book_key(self) -> tuple:
+        """ Key of the Oasis order book of this pair in a :py:class:`MarketSnapshot` """
+        return self.arb_token_name, self.entry_token_name
+
+    @property
+    def resources(self) -> set:
+        """ Balances and markets a trade of this pair consumes; pairs sharing any of them conflict within a block """
+        return {('balance', self.entry_token), ('oasis', self.book_key),
+                ('uniswap', self.uniswap_entry_exchange), ('uniswap', self.uniswap_arb_exchange)}
+
+    @property
+    def uniswap_markets(self) -> list:
+        """ `(token, exchange)` of the Uniswap exchanges the pair trades on, the entry token exchange first """
+        return [(self.entry_token, self.uniswap_entry_exchange), (self.arb_token, self.uniswap_arb_exchange)]
+
+    @ORDER_SIZE.labels('Oasis').time
+    def oasis_order_size(self, book: OrderBookSnapshot, size: Wad = None, entry_amount: Wad = None) -> Optional[Wad]:
+        """ Calculate the an oasis order buy size when buying/selling the arb_token
+
+        If a `size` is not supplied, calculates a total amount of arb_token to be purchased with `entry_amount`.
+        However, if size is supplied, it will calculate the total amount of entry_token that is purchased
+
+        Args:
+            book: The :py:class:`OrderBookSnapshot` of our Oasis market
+            size: The size of the arb_token that will be sold
+            entry_amount: The amount of entry_token that will be sold
+
+        Returns:
+            A :py:class:`pymaker.numeric.Wad` instance of either a final entry_token amount to be bought
+            or a final arb_token amount to be bought, or None if the order book is not deep enough
+        """
+        if size is None:
+            arb_token_amount = book.ask_index.base_for_quote(entry_amount.value)
+            return Wad(arb_token_amount) if arb_token_amount is not None else None
+
+        else:
+            entry_token_amount = book.bid_index.quote_for_base(size.value)
+            return Wad(entry_token_amount) if entry_token_amount is not None else None
+
+    @ORDER_SIZE.labels('Uniswap').time
+    def uniswap_order_size(self, reserves: tuple, size: Wad = None, entry_amount: Wad = None) -> Wad:
+        """ Calculate the an Uniswap buy size when buying/selling the arb_token
+
+        If a `size` is not supplied, calculates a total amount of arb_token to be purchased with `entry_amount`.
+        However, if size is supplied, it will calculate the total amount of entry_token that is purchased
+
+        Args:
+            reserves: The `(entry_reserves, arb_reserves)` tuple of :py:class:`UniswapReserves`
+            size: The size of the arb_token that will be sold
+            entry_amount: The amount of entry_token that will be sold
+
+        Returns:
+            A :py:class:`pymaker.numeric.Wad` instance of either a final entry_token amount to be bought
+            or a final arb_token amount to be bought
+        """
+        (entry_reserves, arb_reserves) = reserves
+
+        if size is None:
+            eth_amount = entry_reserves.token_to_eth_input_price(entry_amount)
+            return arb_reserves.eth_to_token_input_price(eth_amount)
+        else:
+            eth_amount = arb_reserves.token_to_eth_input_price(size)
+            return entry_reserves.eth_to_token_input_price(eth_amount)
+
+    def profit_oasis_to_uniswap(self, entry_amount: Wad, book: OrderBookSnapshot, reserves: tuple) -> Optional[Wad]:
+        """ Profit of buying the arb_token on Oasis with `entry_amount` and selling it on Uniswap, or None if unfillable """
+        oasis_arb_amount = self.oasis_order_size(book, entry_amount=entry_amount)
+        if oasis_arb_amount is None:
+            return None
+
+        return self.uniswap_order_size(reserves, size=oasis_arb_amount) - entry_amount
+
+    def profit_uniswap_to_oasis(self, entry_amount: Wad, book: OrderBookSnapshot, reserves: tuple) -> Optional[Wad]:
+        """ Profit of buying the arb_token on Uniswap with `entry_amount` and selling it on Oasis, or None if unfillable """
+        uniswap_arb_amount = self.uniswap_order_size(reserves, entry_amount=entry_amount)
+        exit_amount = self.oasis_order_size(book, size=uniswap_arb_amount)
+        if exit_amount is None:
+            return None
+
+        return exit_amount - entry_amount
+
+    def route_profit(self, route: tuple, entry_amount: Wad, snapshot: MarketSnapshot) -> Optional[Wad]:
+        """ Profit of trading `entry_amount` along `route`, a `(start_exchange_name, end_exchange_name)` tuple """
+        book = snapshot.book(self.book_key)
+        if book is None:
+            return None
+
+        reserves = (snapshot.reserves_of(self.uniswap_entry_exchange), snapshot.reserves_of(self.uniswap_arb_exchange))
+        if route == ('Oasis', 'Uniswap'):
+            return self.profit_oasis_to_uniswap(entry_amount, book, reserves)
+        else:
+            return self.profit_uniswap_to_oasis(entry_amount, book, reserves)
+
+    @staticmethod
+    def optimal_entry_amount(profit_curve_search: ProfitCurveSearch, profit_function, max_entry_amount: Wad):
+        """ Search the entry amount (up to `max_entry_amount`) maximizing `profit_function`
+
+        Returns:
+            A tuple of the best entry amount and its profit, both as :py:class:`pymaker.numeric.Wad`;
+            the profit is None if no amount can be filled
+        """
+        def profit(value: int):
+            result = profit_function(Wad(value))
+            return result.value if result is not None else None
+
+        (entry_amount, best_profit) = profit_curve_search.search(profit, 0, max_entry_amount.value)
+
+        return Wad(entry_amount), Wad(best_profit) if best_profit is not None else None
+
+    @staticmethod
+    def gas_cost(gas_model: GasModel, route: tuple, gas_price: Optional[int], entry_reserves: UniswapReserves) -> Wad:
+        """ Estimated gas cost of an arbitrage transaction along `route`, in entry_token terms
+
+        The ETH cost is converted at the mid price of the Uniswap entry exchange.
+        """
+        if gas_price is None or entry_reserves.eth_reserve == Wad(0):
+            return Wad(0)
+
+        return entry_reserves.eth_value_in_tokens(gas_model.cost(route, gas_price))
+
+    def evaluate(self, snapshot: MarketSnapshot, profit_curve_search: ProfitCurveSearch,
+                 gas_model: GasModel) -> Optional[Opportunity]:
+        """ Find the best trade of this pair against `snapshot`
+
+        With an entry_token of up to `max_engagement` (or our balance, if lower), search the entry amount
+        maximizing the profit of buying the arb_token on Oasis and selling it on Uniswap, and of the
+        same operation but starting on Uniswap, and keep the most profitable direction.
+
+        Args:
+            snapshot: The :py:class:`MarketSnapshot` of the block being processed
+            profit_curve_search: The :py:class:`ProfitCurveSearch` used to size the trade
+            gas_model: The :py:class:`GasModel` used to estimate the gas cost of the trade
+
+        Returns:
+            An :py:class:`Opportunity`, regardless of its profitability, or None if neither direction can be filled
+        """
+        book = snapshot.book(self.book_key)
+        if book is None:
+            return None
+
+        entry_reserves = snapshot.reserves_of(self.uniswap_entry_exchange)
+        reserves = (entry_reserves, snapshot.reserves_of(self.uniswap_arb_exchange))
+        max_entry_amount = Wad.min(snapshot.balance(self.entry_token), self.max_engagement)
+
+        (oasis_entry_amount, profit_oasis_to_uniswap) = self.optimal_entry_amount(
+            profit_curve_search, lambda amount: self.profit_oasis_to_uniswap(amount, book, reserves), max_entry_amount)
+
+        (uniswap_entry_amount, profit_uniswap_to_oasis) = self.optimal_entry_amount(
+            profit_curve_search, lambda amount: self.profit_uniswap_to_oasis(amount, book, reserves), max_entry_amount)
+
+        if profit_oasis_to_uniswap is None and profit_uniswap_to_oasis is None:
+            return None
+
+        if profit_uniswap_to_oasis is None or \
+                (profit_oasis_to_uniswap is not None and profit_oasis_to_uniswap > profit_uniswap_to_oasis):
+            route = ('Oasis', 'Uniswap')
+            entry_amount = oasis_entry_amount
+            arb_amount = self.oasis_order_size(book, entry_amount=entry_amount) * Wad.from_number(0.999999)
+            profit = profit_oasis_to_uniswap
+
+        else:
+            route = ('Uniswap', 'Oasis')
+            entry_amount = uniswap_entry_amount
+            arb_amount = self.uniswap_order_size(reserves, entry_amount=entry_amount) * Wad.from_number(0.999999)
+            profit = profit_uniswap_to_oasis
+
+        exit_amount = (profit + entry_amount) * Wad.from_number(0.999999)
+        net_profit = profit - self.gas_cost(gas_model, route, snapshot.gas_price, entry_reserves)
+
+        return Opportunity(self, route[0], route[1], entry_amount, arb_amount, exit_amount, profit, net_profit,
+                           profit_oasis_to_uniswap, profit_uniswap_to_oasis)
+
+    def __repr__(self):
+        return f"ArbitragePair({self.name})"
+
+
+def select_opportunities(opportunities: list) -> list:
+    """ Pick the profitable opportunities to execute, most profitable first, none of them sharing a balance or a market """
+    selected = []
+    used_resources = set()
+
+    for opportunity in sorted(opportunities, key=lambda opportunity: opportunity.net_profit, reverse=True):
+        if not opportunity.is_profitable():
+            break
+
+        if opportunity.pair.resources & used_resources:
+            continue
+
+        selected.append(opportunity)
+        used_resources |= opportunity.pair.resources
+
+    return selected
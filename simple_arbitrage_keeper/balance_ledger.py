@@ -0,0 +1,203 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+
+from pymaker import Address, Receipt
+from pymaker.numeric import Wad
+
+from simple_arbitrage_keeper.rpc_batch import BatchReader, ReadBatch, decode_address, encode_address
+
+TRANSFER = '0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef'
+
+
+def _hex(value) -> str:
+    return (value if isinstance(value, str) else '0x' + bytes(value).hex()).lower()
+
+
+class BalanceLedger:
+    """ Our token balances and allowances, kept in memory instead of being read every block
+
+    The ledger is seeded with a full read, then updated from the transfers of our own receipts as soon as
+    they are collected, and from the `Transfer` events from or to our address (e.g. external deposits) on a
+    background thread after every block. A transaction is never counted twice: transfers of a receipt are
+    skipped if the events of its block have already been applied, and events of a transaction whose receipt
+    has already been applied are skipped. Every `reconcile_blocks` blocks the balances are read again,
+    pinned to the last block whose events were applied, and any drift is logged and repaired.
+
+    Allowances are not derived from transfers, whose recipient is not necessarily the spender (e.g. an
+    Oasis `take` pays the maker directly); they are read along with the balances, and read again whenever
+    the balances are reconciled.
+    """
+    logger = logging.getLogger()
+
+    def __init__(self, batch_reader: BatchReader, owner: Address, tokens: list, reconcile_blocks: int = 100):
+        assert(isinstance(batch_reader, BatchReader))
+        assert(isinstance(owner, Address))
+        assert(isinstance(tokens, list))
+        assert(isinstance(reconcile_blocks, int))
+
+        self.batch_reader = batch_reader
+        self.owner = owner
+        self.tokens = tokens
+        self.reconcile_blocks = reconcile_blocks
+
+        self.balances = {}
+        self.allowances = {}
+        self.block_number = None
+        self.reconciled_at = None
+        self.receipt_deltas = {}
+        self.lock = threading.Lock()
+        self.update_lock = threading.Lock()
+
+    def queue_balances(self, batch: ReadBatch) -> dict:
+        """ Queue reads of all our balances in `batch`, to be passed to `seed()` """
+        return {token: batch.balance_of(token, self.owner) for token in self.tokens}
+
+    def seed(self, block_number: int, balances: dict, allowances: dict):
+        """ Seed the ledger from the results of `queue_balances()` and allowance reads, all pinned to `block_number`
+
+        Args:
+            block_number: The block the balances and allowances were read at
+            balances: Batch results of our balances, keyed by token
+            allowances: Batch results of allowances, keyed by `(owner, token, spender)`
+        """
+        self.restore(block_number,
+                     {token: result.value for token, result in balances.items()},
+                     {key: result.value for key, result in allowances.items()})
+
+    def restore(self, block_number: int, balances: dict, allowances: dict):
+        """ Replace the ledger with balances and allowances (as `Wad` values) known as of `block_number`
+
+        The ledger may be restored while in use, e.g. from a saved state first and from a fresh read later:
+        the transfers of receipts mined after `block_number` and already applied are applied again.
+        """
+        with self.update_lock, self.lock:
+            self.balances = dict(balances)
+            self.allowances = dict(allowances)
+            self.block_number = block_number
+            self.reconciled_at = block_number
+
+            self.receipt_deltas = {transaction_hash: (receipt_block, receipt_deltas)
+                                   for transaction_hash, (receipt_block, receipt_deltas) in self.receipt_deltas.items()
+                                   if receipt_block > block_number}
+            for (_, receipt_deltas) in self.receipt_deltas.values():
+                self._apply(receipt_deltas)
+
+    def state(self) -> tuple:
+        """ The `(block_number, balances, allowances)` of the ledger, as accepted by `restore()` """
+        with self.lock:
+            return self.block_number, dict(self.balances), dict(self.allowances)
+
+    def balance(self, token: Address) -> Wad:
+        return Wad(self.balances[token])
+
+    def balances_of(self, tokens) -> dict:
+        """ Our balances of `tokens`, keyed by token, as :py:class:`pymaker.numeric.Wad` """
+        with self.lock:
+            return {token: Wad(self.balances[token]) for token in tokens}
+
+    def allowance(self, owner: Address, token: Address, spender: Address) -> Wad:
+        return Wad(self.allowances[(owner, token, spender)])
+
+    def apply_receipt(self, receipt: Receipt):
+        """ Apply the transfers of one of our receipts """
+        transaction_hash = _hex(receipt.transaction_hash)
+        block_number = receipt.raw_receipt['blockNumber']
+
+        with self.lock:
+            if transaction_hash in self.receipt_deltas:
+                return
+
+            deltas = {}
+            for transfer in receipt.transfers:
+                if transfer.token_address in self.balances:
+                    if transfer.to_address == self.owner:
+                        deltas[transfer.token_address] = deltas.get(transfer.token_address, 0) + transfer.value.value
+                    if transfer.from_address == self.owner:
+                        deltas[transfer.token_address] = deltas.get(transfer.token_address, 0) - transfer.value.value
+
+            if self.block_number is not None and block_number <= self.block_number:
+                return
+
+            self.receipt_deltas[transaction_hash] = (block_number, deltas)
+            self._apply(deltas)
+
+    def update(self, block_number: int):
+        """ Apply the `Transfer` events up to `block_number`, reconciling the balances if due """
+        try:
+            with self.update_lock:
+                self._update(block_number)
+        except Exception:
+            self.logger.exception(f"Failed to update our balances to block #{block_number}")
+
+    def _update(self, block_number: int):
+        if self.block_number is None or block_number <= self.block_number:
+            return
+
+        owner_topic = '0x' + encode_address(self.owner)
+        batch = self.batch_reader.batch(block_number)
+        incoming = batch.logs(self.tokens, self.block_number + 1, block_number, [TRANSFER, None, owner_topic])
+        outgoing = batch.logs(self.tokens, self.block_number + 1, block_number, [TRANSFER, owner_topic])
+        reconcile = self.reconcile_blocks > 0 and block_number - self.reconciled_at >= self.reconcile_blocks
+        balances = self.queue_balances(batch) if reconcile else None
+        allowances = {(owner, token, spender): batch.allowance(token, owner, spender)
+                      for (owner, token, spender) in self.allowances} if reconcile else None
+        batch.execute()
+
+        with self.lock:
+            deltas = {}
+            for log in incoming.value + outgoing.value:
+                if _hex(log['transactionHash']) in self.receipt_deltas:
+                    continue
+
+                token = Address(log['address'])
+                value = int(log['data'], 16) * (-1 if log.get('removed') else 1)
+                if decode_address(log['topics'][2]) == self.owner:
+                    deltas[token] = deltas.get(token, 0) + value
+                if decode_address(log['topics'][1]) == self.owner:
+                    deltas[token] = deltas.get(token, 0) - value
+
+            self._apply(deltas)
+            self.block_number = block_number
+            self.receipt_deltas = {transaction_hash: (receipt_block, receipt_deltas)
+                                   for transaction_hash, (receipt_block, receipt_deltas) in self.receipt_deltas.items()
+                                   if receipt_block > block_number}
+
+            if reconcile:
+                self._reconcile(block_number, balances, allowances)
+
+    def _reconcile(self, block_number: int, balances: dict, allowances: dict):
+        self.reconciled_at = block_number
+        self.allowances = {key: result.value for key, result in allowances.items()}
+
+        later = {}
+        for (_, receipt_deltas) in self.receipt_deltas.values():
+            for token, delta in receipt_deltas.items():
+                later[token] = later.get(token, 0) + delta
+
+        for token, result in balances.items():
+            expected = result.value + later.get(token, 0)
+            if self.balances.get(token) != expected:
+                self.logger.warning(f"Ledger balance of {token} was {Wad(self.balances.get(token, 0))} instead of "
+                                    f"{Wad(expected)}, repaired at block #{block_number}")
+                self.balances[token] = expected
+
+    def _apply(self, deltas: dict):
+        for token, delta in deltas.items():
+            self.balances[token] = self.balances.get(token, 0) + delta
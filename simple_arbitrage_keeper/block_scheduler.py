@@ -0,0 +1,162 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from simple_arbitrage_keeper.metrics import BLOCKS_SKIPPED, BLOCK_TO_DECISION
+
+
+def submit_logged(executor: Executor, function: Callable, *args) -> Future:
+    """ Run `function` on `executor`, logging any exception it raises, as nothing may ever look at its result """
+    def log_failure(future: Future):
+        if not future.cancelled() and future.exception() is not None:
+            logging.getLogger().exception(f"{getattr(function, '__name__', function)} failed in the background",
+                                          exc_info=future.exception())
+
+    future = executor.submit(function, *args)
+    future.add_done_callback(log_failure)
+    return future
+
+
+class StaleBlock(Exception):
+    """ Raised to abandon the evaluation of a block once a newer block has arrived """
+    pass
+
+
+class BlockScheduler:
+    """ Evaluates blocks on a dedicated thread, always on the most recent block only
+
+    `on_block` never blocks the caller: it records the new block and wakes up the evaluation thread.
+    Blocks which arrive while an evaluation is running replace each other, so only the latest one is
+    evaluated next, and the running evaluation can abandon its work early by calling `check`.
+    Transactions are handed over to `submit` and sent from a separate thread, so quoting of the next
+    block never waits for a receipt.
+
+    Attributes:
+        latencies: The most recent block-to-decision latencies, in seconds
+    """
+    logger = logging.getLogger()
+
+    def __init__(self, evaluate: Callable[[int], None], latency_window: int = 1000, report_every: int = 100):
+        assert(callable(evaluate))
+
+        self.evaluate = evaluate
+        self.report_every = report_every
+        self.latencies = deque(maxlen=latency_window)
+
+        self.latest_block = None
+        self.pending_block = None
+        self.received_at = {}
+        self.decisions = 0
+        self.skipped = 0
+        self.running = True
+
+        self.condition = threading.Condition()
+        self.submitter = ThreadPoolExecutor(max_workers=1)
+        self.worker = threading.Thread(target=self._run, name='block-scheduler', daemon=True)
+        self.worker.start()
+
+    def on_block(self, block_number: int):
+        """ Schedule the evaluation of `block_number`, superseding any block not evaluated yet """
+        with self.condition:
+            if self.latest_block is not None and block_number <= self.latest_block:
+                return
+
+            if self.pending_block is not None:
+                self.skipped += 1
+                BLOCKS_SKIPPED.inc()
+                self.received_at.pop(self.pending_block, None)
+                self.logger.debug(f"Block #{self.pending_block} superseded by #{block_number} before being evaluated")
+
+            self.latest_block = block_number
+            self.pending_block = block_number
+            self.received_at[block_number] = time.perf_counter()
+            self.condition.notify()
+
+    def is_stale(self, block_number: Optional[int]) -> bool:
+        return block_number is not None and self.latest_block is not None and block_number < self.latest_block
+
+    def check(self, block_number: Optional[int]):
+        """ Raise :py:class:`StaleBlock` if a block newer than `block_number` has arrived """
+        if self.is_stale(block_number):
+            raise StaleBlock(f"Block #{block_number} superseded by #{self.latest_block}")
+
+    def record_decision(self, block_number: Optional[int]) -> Optional[float]:
+        """ Record that the decision for `block_number` has been made, returns its block-to-decision latency """
+        received_at = self.received_at.pop(block_number, None)
+        if received_at is None:
+            return None
+
+        latency = time.perf_counter() - received_at
+        self.latencies.append(latency)
+        BLOCK_TO_DECISION.observe(latency)
+        self.decisions += 1
+
+        if self.decisions % self.report_every == 0:
+            self.logger.info(f"Block-to-decision latency over the last {len(self.latencies)} blocks: "
+                             f"p50 {self.percentile(50)*1000:.1f}ms, p95 {self.percentile(95)*1000:.1f}ms, "
+                             f"max {max(self.latencies)*1000:.1f}ms; {self.skipped} blocks skipped so far")
+
+        return latency
+
+    def percentile(self, percent: float) -> float:
+        if not self.latencies:
+            return 0.0
+
+        ordered = sorted(self.latencies)
+        return ordered[min(int(len(ordered) * percent / 100), len(ordered) - 1)]
+
+    def submit(self, function: Callable, *args) -> Future:
+        """ Run `function` (e.g. a transaction submission) on the submission thread, logging any exception it raises """
+        return submit_logged(self.submitter, function, *args)
+
+    def stop(self):
+        """ Stop evaluating blocks and wait for submitted transactions to complete """
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+        self.worker.join()
+        self.submitter.shutdown(wait=True)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and self.pending_block is None:
+                    self.condition.wait()
+
+                if not self.running:
+                    return
+
+                block_number = self.pending_block
+                self.pending_block = None
+
+            try:
+                self.evaluate(block_number)
+            except StaleBlock as e:
+                self.skipped += 1
+                BLOCKS_SKIPPED.inc()
+                self.received_at.pop(block_number, None)
+                self.logger.debug(f"Abandoned evaluation: {e}")
+            except Exception:
+                self.received_at.pop(block_number, None)
+                self.logger.exception(f"Evaluation of block #{block_number} failed")
@@ -0,0 +1,243 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+from decimal import Decimal
+from typing import Optional
+
+from pymaker import Address
+from pymaker.oasis import MatchingMarket
+
+from simple_arbitrage_keeper.metrics import OASIS_ORDERS
+from simple_arbitrage_keeper.oasis_api import OrderBookSnapshot
+from simple_arbitrage_keeper.order_book import DepthIndex, WAD
+from simple_arbitrage_keeper.rpc_batch import BatchReader, decode_address
+
+# Topics of the MatchingMarket events which change an order
+LOG_MAKE = '0x773ff502687307abfa024ac9f62f9752a0d210dac2ffd9a29e38e12e2ea82c82'
+LOG_TAKE = '0x3383e3357c77fd2e3a4b30deea81179bc70a795d053d14d5b7f2f01d0fd4596f'
+LOG_KILL = '0x9577941d28fff863bfbee4694a6a4a56fb09e169619189d2eaa750b5b4819995'
+
+# `offers(uint256)` returns `(pay_amt, pay_gem, buy_amt, buy_gem, owner, timestamp)`
+OFFERS = '0x8a72ea6a'
+
+
+def _words(data: str) -> list:
+    data = data[2:] if data.startswith('0x') else data
+    return [data[i:i + 64] for i in range(0, len(data), 64)]
+
+
+def decode_order_event(log: dict) -> Optional[tuple]:
+    """ Decode a LogMake, LogTake or LogKill event into `(order_id, pay_token, buy_token)`
+
+    The order id is indexed in LogMake and LogKill but not in LogTake, and the tokens are never indexed.
+    """
+    topic = log['topics'][0] if log['topics'] else None
+    words = _words(log['data'])
+
+    if topic in (LOG_MAKE, LOG_KILL):
+        return int(log['topics'][1], 16), decode_address(words[0]), decode_address(words[1])
+    elif topic == LOG_TAKE:
+        return int(words[0], 16), decode_address(words[1]), decode_address(words[2])
+    else:
+        return None
+
+
+def decode_offer(result: str) -> Optional[tuple]:
+    """ Decode the result of `offers(id)` into `(pay_token, pay_amount, buy_token, buy_amount)`, None if not active """
+    words = _words(result or '0x')
+    if len(words) < 6:
+        return None
+
+    pay_amount = int(words[0], 16)
+    buy_amount = int(words[2], 16)
+    if pay_amount == 0 or buy_amount == 0 or int(words[5], 16) == 0:
+        return None
+
+    return decode_address(words[1]), pay_amount, decode_address(words[3]), buy_amount
+
+
+class ChainOrderBook:
+    """ Oasis order book of one market, kept in memory and updated from the MatchingMarket events
+
+    The book is bootstrapped once with a full read of the market, then for every new block the LogMake,
+    LogTake and LogKill events since the previous block are fetched and the orders they touched are read
+    again, pinned to that block, in a single JSON-RPC batch. Books are served from memory afterwards, with
+    the same interface as :py:class:`OasisAPI`.
+
+    Every `resync_blocks` blocks the market is read in full again on a background thread. Orders which
+    differ from the incrementally maintained book (and have not been touched since the resync started)
+    are counted as drift, logged and repaired.
+    """
+    logger = logging.getLogger()
+
+    def __init__(self, market: MatchingMarket, batch_reader: BatchReader, entry_token: Address, arb_token: Address,
+                 entry_token_name: str, arb_token_name: str, resync_blocks: int = 300):
+        assert(isinstance(market, MatchingMarket))
+        assert(isinstance(batch_reader, BatchReader))
+        assert(isinstance(entry_token, Address))
+        assert(isinstance(arb_token, Address))
+        assert(isinstance(resync_blocks, int))
+
+        self.market = market
+        self.batch_reader = batch_reader
+        self.entry_token = entry_token
+        self.arb_token = arb_token
+        self.entry_token_name = entry_token_name
+        self.arb_token_name = arb_token_name
+        self.resync_blocks = resync_blocks
+
+        self.orders = {}
+        self.block_number = None
+        self.snapshot = None
+        self.resynced_at = None
+        self.resync_thread = None
+        self.touched_since_resync = set()
+        self.drift = 0
+
+        self.lock = threading.Lock()
+        self.latency = OASIS_ORDERS.labels(f"{arb_token_name}/{entry_token_name}")
+
+    def get_orders(self, block_number: int = None):
+        """Returns the bids and asks of our market as of `block_number`, like :py:meth:`OasisAPI.get_orders`"""
+        snapshot = self.get_snapshot(block_number)
+        return snapshot.bids, snapshot.asks
+
+    def get_snapshot(self, block_number: int = None) -> OrderBookSnapshot:
+        """Returns the :py:class:`OrderBookSnapshot` of our market, updated to `block_number` if necessary"""
+        started = time.perf_counter()
+
+        try:
+            with self.lock:
+                if block_number is None:
+                    block_number = self.market.web3.eth.blockNumber
+
+                if self.block_number is None:
+                    self._bootstrap(block_number)
+                elif block_number > self.block_number:
+                    self._update(block_number)
+
+                if self.resync_blocks > 0 and self.resync_thread is None \
+                        and block_number - self.resynced_at >= self.resync_blocks:
+                    self._start_resync(block_number)
+
+                return self.snapshot
+        finally:
+            self.latency.observe(time.perf_counter() - started)
+
+    def _market_orders(self) -> dict:
+        orders = {}
+        for (pay_token, buy_token) in [(self.entry_token, self.arb_token), (self.arb_token, self.entry_token)]:
+            for order in self.market.get_orders(pay_token, buy_token):
+                orders[order.order_id] = (order.pay_token, order.pay_amount.value, order.buy_token, order.buy_amount.value)
+
+        return orders
+
+    def _bootstrap(self, block_number: int):
+        started = time.perf_counter()
+
+        self.orders = self._market_orders()
+        self.block_number = block_number
+        self.resynced_at = block_number
+        self.snapshot = self._build_snapshot(block_number)
+
+        self.logger.info(f"Bootstrapped the {self.arb_token_name}/{self.entry_token_name} Oasis book from chain "
+                         f"with {len(self.orders)} orders in {time.perf_counter() - started:.1f}s")
+
+    def _update(self, block_number: int):
+        batch = self.batch_reader.batch(block_number)
+        logs = batch.logs(self.market.address, self.block_number + 1, block_number, [[LOG_MAKE, LOG_TAKE, LOG_KILL]])
+        batch.execute()
+
+        touched = set()
+        tokens = {self.entry_token, self.arb_token}
+        for log in logs.value:
+            event = decode_order_event(log)
+            if event is not None and {event[1], event[2]} == tokens:
+                touched.add(event[0])
+
+        if touched:
+            batch = self.batch_reader.batch(block_number)
+            offers = {order_id: batch.call(self.market.address, OFFERS + hex(order_id)[2:].rjust(64, '0'), decode_offer)
+                      for order_id in touched}
+            batch.execute()
+
+            for order_id, offer in offers.items():
+                if offer.value is None:
+                    self.orders.pop(order_id, None)
+                else:
+                    self.orders[order_id] = offer.value
+
+            self.touched_since_resync |= touched
+            self.snapshot = self._build_snapshot(block_number)
+        else:
+            self.snapshot = self.snapshot.revalidated(block_number, time.time())
+
+        self.block_number = block_number
+
+    def _start_resync(self, block_number: int):
+        self.resynced_at = block_number
+        self.touched_since_resync = set()
+        self.resync_thread = threading.Thread(target=self._resync, name='oasis-book-resync', daemon=True)
+        self.resync_thread.start()
+
+    def _resync(self):
+        try:
+            orders = self._market_orders()
+
+            with self.lock:
+                drifted = [order_id for order_id in set(orders) | set(self.orders)
+                           if order_id not in self.touched_since_resync
+                           and orders.get(order_id) != self.orders.get(order_id)]
+
+                for order_id in drifted:
+                    if order_id in orders:
+                        self.orders[order_id] = orders[order_id]
+                    else:
+                        self.orders.pop(order_id, None)
+
+                if drifted:
+                    self.drift += len(drifted)
+                    self.snapshot = self._build_snapshot(self.block_number)
+                    self.logger.warning(f"Repaired {len(drifted)} drifted orders in the {self.arb_token_name}/"
+                                        f"{self.entry_token_name} Oasis book ({self.drift} so far)")
+                else:
+                    self.logger.debug(f"Resynced the {self.arb_token_name}/{self.entry_token_name} Oasis book, no drift")
+        except Exception:
+            self.logger.exception(f"Failed to resync the {self.arb_token_name}/{self.entry_token_name} Oasis book")
+        finally:
+            self.resync_thread = None
+
+    def _build_snapshot(self, block_number: int) -> OrderBookSnapshot:
+        """ Build the bids and asks, priced in the entry token per arb token, from the orders in memory """
+        bids = []
+        asks = []
+        for (pay_token, pay_amount, buy_token, buy_amount) in self.orders.values():
+            if pay_token == self.entry_token:
+                bids.append((Decimal(pay_amount) / Decimal(buy_amount), Decimal(buy_amount) / WAD))
+            else:
+                asks.append((Decimal(buy_amount) / Decimal(pay_amount), Decimal(pay_amount) / WAD))
+
+        bids.sort(key=lambda level: level[0], reverse=True)
+        asks.sort(key=lambda level: level[0])
+
+        return OrderBookSnapshot(block_number,
+                                 [[float(price), float(amount)] for price, amount in bids],
+                                 [[float(price), float(amount)] for price, amount in asks],
+                                 None, time.time(), DepthIndex(bids), DepthIndex(asks))
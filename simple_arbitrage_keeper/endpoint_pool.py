@@ -0,0 +1,195 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from simple_arbitrage_keeper.metrics import ENDPOINT_EJECTIONS, ENDPOINT_LATENCY, HEDGED_REQUESTS
+
+
+class Endpoint:
+    """ One endpoint of an :py:class:`EndpointPool`, with its latency and health
+
+    Attributes:
+        uri: The URI requests are sent to
+        latency: Exponentially weighted moving average of the latency of successful requests, in seconds
+        samples: Latencies of the most recent successful requests, in seconds
+        failures: Number of consecutive failed requests
+        ejected_until: Time until which the endpoint is only used once all others have failed
+    """
+
+    def __init__(self, uri: str, samples: int = 200):
+        self.uri = uri
+        self.latency = None
+        self.samples = deque(maxlen=samples)
+        self.failures = 0
+        self.ejected_until = 0.0
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """ Latency below which `fraction` of the recent requests completed, None without enough samples """
+        if len(self.samples) < 20:
+            return None
+
+        return sorted(self.samples)[int(fraction * (len(self.samples) - 1))]
+
+    def is_ejected(self, now: float) -> bool:
+        return now < self.ejected_until
+
+    def __repr__(self):
+        return f"Endpoint({self.uri}, latency={self.latency}, failures={self.failures})"
+
+
+class EndpointPool:
+    """ Sends requests to the fastest of several equivalent endpoints, hedging them against the slow ones
+
+    A request goes to the healthy endpoint with the lowest latency average first. If it has not answered
+    once its 95th latency percentile has elapsed, the same request is sent to the next endpoint as well,
+    which gets its own 95th latency percentile before the request is sent to the one after it, and so on.
+    Whichever answers first wins; the other answers are only used to update the latency statistics. A
+    request which fails is sent to the next endpoint straight away. After `max_failures` consecutive
+    failures an endpoint is ejected for `ejection_seconds`: it is never hedged to, and only tried once all
+    the others have failed, so ejection never makes a request fail that would otherwise have succeeded.
+
+    With a single endpoint requests are sent directly, from the calling thread.
+
+    Attributes:
+        name: Name of the pool, used in logs and metrics
+        endpoints: The :py:class:`Endpoint` of each URI
+    """
+    logger = logging.getLogger()
+
+    def __init__(self, name: str, uris: list, smoothing: float = 0.2, max_failures: int = 3,
+                 ejection_seconds: float = 30.0, initial_hedge_delay: float = 1.0, workers: int = 16):
+        assert(isinstance(name, str))
+        assert(isinstance(uris, list))
+        assert(len(uris) > 0)
+        assert(0 < smoothing <= 1)
+
+        self.name = name
+        self.endpoints = [Endpoint(uri) for uri in uris]
+        self.smoothing = smoothing
+        self.max_failures = max_failures
+        self.ejection_seconds = ejection_seconds
+        self.initial_hedge_delay = initial_hedge_delay
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-pool") \
+            if len(uris) > 1 else None
+
+        for endpoint in self.endpoints:
+            ENDPOINT_LATENCY.labels(name, endpoint.uri).set_function(lambda endpoint=endpoint: endpoint.latency or 0.0)
+
+    def ranked(self) -> list:
+        """ Healthy endpoints from the fastest, followed by the ejected ones """
+        now = time.time()
+        with self.lock:
+            return sorted(self.endpoints, key=lambda endpoint: (endpoint.is_ejected(now), endpoint.latency or 0.0))
+
+    def hedge_delay(self, endpoint: Endpoint) -> float:
+        """ Time to wait for `endpoint` before sending the same request to the next one """
+        with self.lock:
+            p95 = endpoint.percentile(0.95)
+            if p95 is not None:
+                return p95
+
+            return 2 * endpoint.latency if endpoint.latency is not None else self.initial_hedge_delay
+
+    def request(self, function: Callable[[str], object]):
+        """ Call `function` with the URI of one or more endpoints, returns the first result
+
+        `function` has to raise on any failure which another endpoint could avoid, e.g. a timeout or an
+        HTTP error. The exception of the last endpoint tried is raised if all of them fail.
+        """
+        endpoints = self.ranked()
+        if self.executor is None:
+            (succeeded, result) = self._call(endpoints[0], function)
+            if not succeeded:
+                raise result
+
+            return result
+
+        now = time.time()
+        healthy = len([endpoint for endpoint in endpoints if not endpoint.is_ejected(now)])
+
+        answers = queue.Queue()
+        delay = self.hedge_delay(endpoints[0])
+        outstanding = 1
+        next_index = 1
+        self.executor.submit(lambda endpoint=endpoints[0]: answers.put(self._call(endpoint, function)))
+
+        while True:
+            try:
+                (succeeded, result) = answers.get(timeout=delay if next_index < healthy else None)
+            except queue.Empty:
+                HEDGED_REQUESTS.labels(self.name).inc()
+                self.logger.debug(f"Hedging a {self.name} request to {endpoints[next_index].uri} after {delay*1000:.0f}ms")
+            else:
+                outstanding -= 1
+                if succeeded:
+                    return result
+
+                if next_index == len(endpoints) or (next_index >= healthy and outstanding > 0):
+                    if outstanding == 0:
+                        raise result
+                    continue
+
+            outstanding += 1
+            next_index += 1
+            delay = self.hedge_delay(endpoints[next_index - 1])
+            self.executor.submit(lambda endpoint=endpoints[next_index - 1]: answers.put(self._call(endpoint, function)))
+
+    def _call(self, endpoint: Endpoint, function: Callable) -> tuple:
+        started = time.perf_counter()
+        try:
+            result = function(endpoint.uri)
+        except Exception as e:
+            self._failed(endpoint, e)
+            return False, e
+
+        self._succeeded(endpoint, time.perf_counter() - started)
+        return True, result
+
+    def _succeeded(self, endpoint: Endpoint, latency: float):
+        with self.lock:
+            endpoint.latency = latency if endpoint.latency is None \
+                else endpoint.latency + self.smoothing * (latency - endpoint.latency)
+            endpoint.samples.append(latency)
+
+            if endpoint.failures >= self.max_failures:
+                self.logger.info(f"{self.name} endpoint {endpoint.uri} is healthy again")
+
+            endpoint.failures = 0
+            endpoint.ejected_until = 0.0
+
+    def _failed(self, endpoint: Endpoint, error: Exception):
+        with self.lock:
+            endpoint.failures += 1
+            if endpoint.failures >= self.max_failures and len(self.endpoints) > 1:
+                endpoint.ejected_until = time.time() + self.ejection_seconds
+
+                if endpoint.failures == self.max_failures:
+                    ENDPOINT_EJECTIONS.labels(self.name, endpoint.uri).inc()
+                    self.logger.warning(f"Ejecting {self.name} endpoint {endpoint.uri} for {self.ejection_seconds:.0f}s "
+                                        f"after {endpoint.failures} consecutive failures, the last one being: {error}")
+                else:
+                    self.logger.debug(f"{self.name} endpoint {endpoint.uri} still failing, ejected again: {error}")
+            else:
+                self.logger.debug(f"Request to {self.name} endpoint {endpoint.uri} failed: {error}")
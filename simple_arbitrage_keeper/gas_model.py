@@ -0,0 +1,95 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+from typing import Optional
+
+from pymaker.gas import GasPrice
+from pymaker.numeric import Wad
+
+
+class CachedGasPrice(GasPrice):
+    """ Gas price which is either fixed or the node gas price read with the chain state of each block
+
+    The node gas price is read in the per-block batch and passed to `cache()`. Until the first block has
+    been seen (i.e. during startup approvals) the node default is used, exactly like `DefaultGasPrice`.
+    """
+    logger = logging.getLogger()
+
+    def __init__(self, fixed_gas_price: int = 0):
+        assert(isinstance(fixed_gas_price, int))
+
+        self.fixed_gas_price = fixed_gas_price if fixed_gas_price > 0 else None
+        self.block_number = None
+        self.value = self.fixed_gas_price
+        self.lock = threading.Lock()
+
+    def cache(self, block_number: int, node_gas_price: int):
+        """ Cache the node gas price read in the chain state batch of `block_number` """
+        assert(isinstance(node_gas_price, int))
+
+        if self.fixed_gas_price is None:
+            with self.lock:
+                self.value = node_gas_price
+                self.block_number = block_number
+
+    def get_gas_price(self, time_elapsed: int) -> Optional[int]:
+        return self.value
+
+    def __repr__(self):
+        return f"CachedGasPrice(value={self.value}, block_number={self.block_number})"
+
+
+class GasModel:
+    """ Estimated gas units of each exchange route, calibrated from the receipts of our own trades
+
+    Routes are tuples of the exchange names of each leg, e.g. `(start_exchange_name, end_exchange_name)`.
+    Every receipt moves the estimate of its route towards the gas actually used, with an exponentially
+    weighted moving average. Routes never traded yet are estimated at `default_gas_units` per two legs.
+    """
+    logger = logging.getLogger()
+
+    DEFAULT_GAS_UNITS = 350000
+
+    def __init__(self, default_gas_units: int = DEFAULT_GAS_UNITS, smoothing: float = 0.2):
+        assert(isinstance(default_gas_units, int))
+        assert(0 < smoothing <= 1)
+
+        self.default_gas_units = default_gas_units
+        self.smoothing = smoothing
+        self.gas_units = {}
+
+    def estimate(self, route: tuple) -> int:
+        """ Estimated gas units used by an arbitrage transaction along `route` """
+        return int(self.gas_units.get(route, self.default_gas_units * max(len(route), 2) // 2))
+
+    def calibrate(self, route: tuple, gas_used: int):
+        """ Update the estimate of `route` with the gas used by one of our receipts """
+        assert(isinstance(gas_used, int))
+
+        previous = self.gas_units.get(route)
+        self.gas_units[route] = gas_used if previous is None \
+            else previous + self.smoothing * (gas_used - previous)
+
+        self.logger.debug(f"Gas estimate of {' to '.join(route)} is now {self.estimate(route)} ({gas_used} used)")
+
+    def cost(self, route: tuple, gas_price: int) -> Wad:
+        """ Estimated cost, in ETH, of an arbitrage transaction along `route` at `gas_price` """
+        assert(isinstance(gas_price, int))
+
+        return Wad(self.estimate(route) * gas_price)
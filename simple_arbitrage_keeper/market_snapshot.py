@@ -0,0 +1,91 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Optional
+
+from pymaker import Address
+from pymaker.numeric import Wad
+
+from simple_arbitrage_keeper.oasis_api import OrderBookSnapshot
+from simple_arbitrage_keeper.uniswap import UniswapReserves
+
+
+class MarketSnapshot:
+    """ Market state read once per block and shared by every pair evaluated against that block
+
+    Attributes:
+        block_number: The block the state was read for
+        balances: Our balance of each entry token, keyed by token :py:class:`pymaker.Address`
+        books: :py:class:`OrderBookSnapshot` of each Oasis market, keyed by `(arb_token_name, entry_token_name)`
+        reserves: :py:class:`UniswapReserves` of each Uniswap exchange, keyed by exchange :py:class:`pymaker.Address`
+        gas_price: The gas price (in Wei) transactions would be sent with, or None for the node default
+        timestamp: Unix timestamp at which the snapshot was taken
+    """
+
+    def __init__(self, block_number: Optional[int], balances: dict, books: dict, reserves: dict,
+                 gas_price: Optional[int], timestamp: float):
+        assert(isinstance(balances, dict))
+        assert(isinstance(books, dict))
+        assert(isinstance(reserves, dict))
+
+        self.block_number = block_number
+        self.balances = balances
+        self.books = books
+        self.reserves = reserves
+        self.gas_price = gas_price
+        self.timestamp = timestamp
+
+    def balance(self, token: Address) -> Wad:
+        return self.balances[token]
+
+    def book(self, book_key: tuple) -> Optional[OrderBookSnapshot]:
+        return self.books.get(book_key)
+
+    def reserves_of(self, exchange: Address) -> UniswapReserves:
+        return self.reserves[exchange]
+
+    def to_dict(self) -> dict:
+        """ Plain JSON-serializable representation of the snapshot, read back by `from_dict` """
+        return {
+            'block_number': self.block_number,
+            'timestamp': self.timestamp,
+            'gas_price': self.gas_price,
+            'balances': {token.address: str(balance.value) for token, balance in self.balances.items()},
+            'books': [{'arb_token_name': book_key[0], 'entry_token_name': book_key[1], 'bids': book.bids, 'asks': book.asks}
+                      for book_key, book in self.books.items()],
+            'reserves': {exchange.address: [str(reserves.token_reserve.value), str(reserves.eth_reserve.value)]
+                         for exchange, reserves in self.reserves.items()}
+        }
+
+    @staticmethod
+    def from_dict(data: dict):
+        block_number = data['block_number']
+        timestamp = data['timestamp']
+
+        return MarketSnapshot(block_number=block_number,
+                              balances={Address(token): Wad(int(balance)) for token, balance in data['balances'].items()},
+                              books={(book['arb_token_name'], book['entry_token_name']):
+                                         OrderBookSnapshot(block_number, book['bids'], book['asks'], None, timestamp)
+                                     for book in data['books']},
+                              reserves={Address(exchange): UniswapReserves(Wad(int(token_reserve)), Wad(int(eth_reserve)))
+                                        for exchange, (token_reserve, eth_reserve) in data['reserves'].items()},
+                              gas_price=data['gas_price'],
+                              timestamp=timestamp)
+
+    def __repr__(self):
+        return f"MarketSnapshot(block_number={self.block_number}, balances={len(self.balances)}, " \
+               f"books={len(self.books)}, reserves={len(self.reserves)}, gas_price={self.gas_price})"
@@ -0,0 +1,336 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import functools
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Callable
+
+
+class MetricsRegistry:
+    """ Collection of metrics, rendered in the Prometheus text exposition format """
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+
+        return metric
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics)
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = None) -> str:
+    labels = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra is not None:
+        labels.append(extra)
+
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != float('inf') else "+Inf"
+
+
+class Metric(ABC):
+    """ Base class of metrics, optionally split by label values
+
+    Values are recorded on the children returned by `labels(...)`, a metric without labels records
+    its values directly. Children are created once and cached, so recording a value only costs a dict
+    lookup and a short critical section.
+    """
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), registry: MetricsRegistry = REGISTRY):
+        assert(isinstance(name, str))
+        assert(isinstance(documentation, str))
+        assert(isinstance(labelnames, tuple))
+
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.children = {}
+        self.lock = threading.Lock()
+
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        assert(len(values) == len(self.labelnames))
+
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self._new_child())
+
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        """ A new child recording the values of one combination of label values """
+
+    def _unlabelled(self):
+        assert(len(self.labelnames) == 0)
+        return self.labels()
+
+    def samples(self) -> list:
+        with self.lock:
+            children = list(self.children.items())
+
+        lines = []
+        for values, child in children:
+            lines.extend(child.samples(self.name, self.labelnames, values))
+
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        assert(amount >= 0)
+
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name: str, labelnames: tuple, values: tuple) -> list:
+        return [f"{name}_total{_format_labels(labelnames, values)} {_format_value(self.value)}"]
+
+
+class Counter(Metric):
+    """ Monotonically increasing count, e.g. of opportunities seen """
+    type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self._unlabelled().inc(amount)
+
+
+class _GaugeChild:
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]):
+        """ Read the value from `function` whenever the metrics are rendered instead """
+        self.function = function
+
+    def samples(self, name: str, labelnames: tuple, values: tuple) -> list:
+        value = self.function() if self.function is not None else self.value
+        return [f"{name}{_format_labels(labelnames, values)} {_format_value(value)}"]
+
+
+class Gauge(Metric):
+    """ Value which can go up and down, e.g. the number of errors so far """
+    type = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self._unlabelled().set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        self._unlabelled().set_function(function)
+
+
+class _HistogramChild:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self, function: Callable) -> Callable:
+        """ Decorate `function` so that the duration of each call is observed, in seconds """
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.observe(time.perf_counter() - started)
+
+        return wrapper
+
+    def samples(self, name: str, labelnames: tuple, values: tuple) -> list:
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            bucket = 'le="' + _format_value(bound) + '"'
+            lines.append(f"{name}_bucket{_format_labels(labelnames, values, bucket)} {cumulative}")
+
+        lines.append(f"{name}_sum{_format_labels(labelnames, values)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(labelnames, values)} {cumulative}")
+
+        return lines
+
+
+class Histogram(Metric):
+    """ Distribution of observed values in cumulative buckets, e.g. of latencies in seconds """
+    type = "histogram"
+
+    LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                       0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), registry: MetricsRegistry = REGISTRY,
+                 buckets: tuple = LATENCY_BUCKETS):
+        assert(isinstance(buckets, tuple))
+        assert(list(buckets) == sorted(buckets))
+
+        self.buckets = buckets
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._unlabelled().observe(value)
+
+    def time(self, function: Callable) -> Callable:
+        return self._unlabelled().time(function)
+
+
+class MetricsServer:
+    """ Serves the metrics of a registry over HTTP, on a background thread, for Prometheus to scrape """
+    logger = logging.getLogger()
+
+    def __init__(self, port: int, host: str = '127.0.0.1', registry: MetricsRegistry = REGISTRY):
+        assert(isinstance(port, int))
+        assert(isinstance(host, str))
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode('utf-8')
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self.server = Server((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name='metrics-server', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        self.logger.info(f"Serving metrics on http://{self.server.server_address[0]}:{self.server.server_address[1]}/metrics")
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# Metrics of the keeper hot path
+BLOCK_HANDOFF = Histogram("simple_arbitrage_block_handoff_seconds",
+                          "Time spent in the process_block callback, handing the block over to the scheduler")
+BLOCK_EVALUATION = Histogram("simple_arbitrage_block_evaluation_seconds",
+                             "Time spent evaluating a block, from reading the market state to the decision")
+BLOCK_TO_DECISION = Histogram("simple_arbitrage_block_to_decision_seconds",
+                              "Time from a block arriving to the decision taken on it")
+OASIS_ORDERS = Histogram("simple_arbitrage_oasis_orders_seconds",
+                         "Time spent reading an Oasis order book, including cache hits", ("market",))
+CHAIN_STATE_BATCH = Histogram("simple_arbitrage_chain_state_batch_seconds",
+                              "Time spent reading balances, reserves and gas price in one JSON-RPC batch")
+ORDER_SIZE = Histogram("simple_arbitrage_order_size_seconds",
+                       "Time spent pricing one order against an exchange", ("exchange",))
+SIMULATION = Histogram("simple_arbitrage_simulation_seconds",
+                       "Time spent dry-running an arbitrage transaction with eth_call")
+EXECUTION = Histogram("simple_arbitrage_execution_seconds",
+                      "Time from sending an arbitrage transaction to receiving its receipt")
+
+OPPORTUNITIES_SEEN = Counter("simple_arbitrage_opportunities_seen",
+                             "Opportunities profitable net of gas and above the minimum profit", ("pair",))
+OPPORTUNITIES_TAKEN = Counter("simple_arbitrage_opportunities_taken",
+                              "Opportunities executed successfully", ("pair",))
+OPPORTUNITIES_REJECTED = Counter("simple_arbitrage_opportunities_rejected",
+                                 "Opportunities not submitted as their simulation reverted or was no longer profitable",
+                                 ("pair",))
+OPPORTUNITIES_FAILED = Counter("simple_arbitrage_opportunities_failed",
+                               "Opportunities whose transaction failed", ("pair",))
+REPLACEMENTS = Counter("simple_arbitrage_replacements",
+                       "Transactions sent again with the same nonce and a higher gas price")
+CANCELLATIONS = Counter("simple_arbitrage_cancellations",
+                        "Transactions cancelled as their opportunity disappeared before they were mined")
+HEDGED_REQUESTS = Counter("simple_arbitrage_hedged_requests",
+                          "Requests sent to a second endpoint as the first one was slower than its 95th percentile",
+                          ("pool",))
+ENDPOINT_EJECTIONS = Counter("simple_arbitrage_endpoint_ejections",
+                             "Endpoints ejected from their pool after consecutive failures", ("pool", "endpoint"))
+BLOCKS_SKIPPED = Counter("simple_arbitrage_blocks_skipped",
+                         "Blocks superseded by a newer block before their evaluation completed")
+
+IN_FLIGHT = Gauge("simple_arbitrage_transactions_in_flight",
+                  "Arbitrage transactions sent and not mined yet")
+ENDPOINT_LATENCY = Gauge("simple_arbitrage_endpoint_latency_seconds",
+                         "Moving average of the latency of successful requests to an endpoint", ("pool", "endpoint"))
+TIME_TO_FIRST_QUOTE = Gauge("simple_arbitrage_time_to_first_quote_seconds",
+                            "Time from the keeper starting to its first decision on a block", ("start",))
+ERRORS = Gauge("simple_arbitrage_errors",
+               "Number of errors so far; the keeper terminates when it reaches --max-errors")
+REALIZED_PROFIT = Gauge("simple_arbitrage_realized_profit",
+                        "Realized profit of our transactions, net of gas, in their entry token", ("token",))
+DRAWDOWN = Gauge("simple_arbitrage_drawdown",
+                 "How far the realized profit in an entry token is below the highest it has been", ("token",))
+GAS_SPENT = Gauge("simple_arbitrage_gas_spent_eth",
+                  "ETH spent on gas by our transactions")
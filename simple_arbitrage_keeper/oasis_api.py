@@ -1,44 +1,157 @@
 import logging
+import threading
+import time
+
 import requests
 from pymaker.util import http_response_summary
 
+from simple_arbitrage_keeper.endpoint_pool import EndpointPool
+from simple_arbitrage_keeper.metrics import OASIS_ORDERS
+from simple_arbitrage_keeper.order_book import DepthIndex
+
+
+
+class OrderBookSnapshot:
+    """A parsed Oasis order book for one token pair, as fetched for a given block
+
+    Attributes:
+        block_number: The block number the snapshot was fetched (or revalidated) for, if known
+        bids: List of bid elements [price (float), amount (float)]
+        asks: List of ask elements [price (float), amount (float)]
+        etag: The `ETag` header returned by the REST API, used to issue conditional requests
+        fetched_at: Unix timestamp of the last time the snapshot was fetched or revalidated
+        bid_index: :py:class:`DepthIndex` of the bids, used to price selling the arb token
+        ask_index: :py:class:`DepthIndex` of the asks, used to price buying the arb token
+    """
+
+    def __init__(self, block_number: int, bids: list, asks: list, etag: str, fetched_at: float,
+                 bid_index: DepthIndex = None, ask_index: DepthIndex = None):
+        self.block_number = block_number
+        self.bids = bids
+        self.asks = asks
+        self.etag = etag
+        self.fetched_at = fetched_at
+        self.bid_index = bid_index if bid_index is not None else DepthIndex(bids)
+        self.ask_index = ask_index if ask_index is not None else DepthIndex(asks)
+
+    def revalidated(self, block_number: int, fetched_at: float):
+        """Returns a copy of this snapshot, sharing the parsed book, marked as current for `block_number`"""
+        return OrderBookSnapshot(block_number, self.bids, self.asks, self.etag, fetched_at, self.bid_index, self.ask_index)
 
 
 class OasisAPI:
     """A class for reading and presenting json data from the Oasis Rest API
 
+    Order books are cached per token pair, so repeated reads within the same block share a single
+    request and a single parsed book. Conditional requests (`If-None-Match`) are used to revalidate
+    a cached book, so an unchanged book is neither downloaded nor parsed again.
+
+    `api_server` is either the URL of one REST API server, or an :py:class:`EndpointPool` of equivalent
+    servers (usually shared by the books of all pairs) to which every request is sent hedged.
+
     Documentation: developer.makerdao.com/oasis/api/2/markets
 
     """
     logger = logging.getLogger()
     timeout = 15.5
 
-    def __init__(self, api_server: str, entry_token_name: str, arb_token_name: str):
-        assert(isinstance(api_server, str))
+    def __init__(self, api_server, entry_token_name: str, arb_token_name: str, max_staleness: float = 0.0,
+                 session: requests.Session = None):
+        assert(isinstance(api_server, str) or isinstance(api_server, EndpointPool))
+        assert(isinstance(max_staleness, float) or isinstance(max_staleness, int))
 
 
         self.entry_token_name = entry_token_name
         self.arb_token_name = arb_token_name
-        self.api_server = api_server
+        self.api_server = api_server if isinstance(api_server, EndpointPool) else EndpointPool('oasis-api', [api_server])
+        self.max_staleness = max_staleness
+
+        self.session = session if session is not None else requests.Session()
+        self.snapshots = {}
+        self.lock = threading.Lock()
+        self.latency = OASIS_ORDERS.labels(f"{arb_token_name}/{entry_token_name}")
 
 
-    def get_orders(self):
+    def get_orders(self, block_number: int = None):
         """Returns active orders filtered by token pair
-        Issues an `/v2/orders/XYZ/XYZ` call to the Oasis REST API
+        Issues an `/v2/orders/XYZ/XYZ` call to the Oasis REST API, unless the book has already been fetched
+        for `block_number` or the cached book is younger than `max_staleness` seconds
+
+        Args:
+            block_number: The block number the orders are read for
 
         Returns:
             Two lists: bid elements [price (float), amount (float)] and ask elements [price (float), amounts (float)]
         """
 
-        response = requests.get(f"{self.api_server}/v2/orders/{self.arb_token_name}/{self.entry_token_name}", timeout=self.timeout)
-        if not response.ok:
-            raise Exception(f"Failed to fetch Oasis orders from REST API: {http_response_summary(response)}")
+        snapshot = self.get_snapshot(block_number)
+        return snapshot.bids, snapshot.asks
+
+
+    def get_snapshot(self, block_number: int = None) -> OrderBookSnapshot:
+        """Returns the cached :py:class:`OrderBookSnapshot` for our token pair, fetching it if necessary
+
+        Args:
+            block_number: The block number the orders are read for
+
+        Returns:
+            A :py:class:`OrderBookSnapshot` instance
+        """
+
+        pair = (self.arb_token_name, self.entry_token_name)
+        started = time.perf_counter()
+
+        try:
+            return self._get_snapshot(pair, block_number)
+        finally:
+            self.latency.observe(time.perf_counter() - started)
+
+
+    def _get_snapshot(self, pair: tuple, block_number: int) -> OrderBookSnapshot:
+        with self.lock:
+            cached = self.snapshots.get(pair)
+            now = time.time()
+
+            if cached is not None:
+                if block_number is not None and cached.block_number == block_number:
+                    return cached
+
+                if now - cached.fetched_at <= self.max_staleness:
+                    return cached
+
+            snapshot = self._fetch(block_number, cached, now)
+            self.snapshots[pair] = snapshot
+
+            return snapshot
+
+
+    def _fetch(self, block_number: int, cached: OrderBookSnapshot, now: float) -> OrderBookSnapshot:
+        headers = {'If-None-Match': cached.etag} if cached is not None and cached.etag is not None else {}
+
+        def get(api_server: str) -> requests.Response:
+            response = self.session.get(f"{api_server}/v2/orders/{self.arb_token_name}/{self.entry_token_name}",
+                                        headers=headers, timeout=self.timeout)
+
+            if not response.ok and response.status_code != 304:
+                raise Exception(f"Failed to fetch Oasis orders from REST API: {http_response_summary(response)}")
+
+            return response
+
+        response = self.api_server.request(get)
+
+        if response.status_code == 304 and cached is not None:
+            return cached.revalidated(block_number, now)
 
         data = response.json()
         if 'data' in data:
-            bids = list(map(lambda x: [float(i) for i in x], data['data']['bids']))
-            asks = list(map(lambda x: [float(i) for i in x], data['data']['asks']))
-            return bids, asks
+            raw_bids = data['data']['bids']
+            raw_asks = data['data']['asks']
 
         else:
-            return []
+            raw_bids, raw_asks = [], []
+
+        bids = [[float(i) for i in x] for x in raw_bids]
+        asks = [[float(i) for i in x] for x in raw_asks]
+
+        return OrderBookSnapshot(block_number, bids, asks, response.headers.get('ETag'), now,
+                                 DepthIndex(raw_bids), DepthIndex(raw_asks))
@@ -0,0 +1,99 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from bisect import bisect_left
+from decimal import Decimal
+from typing import Iterable, List, Optional
+
+WAD = 10**18
+
+
+def to_wad_value(number) -> int:
+    """ Converts a number (or numeric string) as returned by the Oasis REST API to an exact `Wad` value """
+    return int(Decimal(str(number)) * WAD)
+
+
+class DepthIndex:
+    """ Cumulative depth of one side of an Oasis order book, built once per order book snapshot
+
+    Levels are `[price, amount]` pairs in book order (best price first), where `price` is quoted in
+    the quote (entry) token per base (arb) token and `amount` is in the base token. Cumulative base
+    and quote sums are held as exact integers, so the fill for any size is a binary search plus a single
+    interpolation within the last level touched, in `Wad` precision.
+
+    Attributes:
+        prices: `Wad` values of the price of each level
+        cumulative_base: `Wad` values of the base token amount available up to and including each level
+        cumulative_quote: `Wad` values of the quote token amount available up to and including each level
+    """
+
+    def __init__(self, levels: Iterable):
+        self.prices = []
+        self.cumulative_base = []
+        self.cumulative_quote = []
+
+        total_base = 0
+        total_quote = 0
+        for level in levels:
+            price = to_wad_value(level[0])
+            amount = to_wad_value(level[1])
+
+            total_base += amount
+            total_quote += amount * price // WAD
+
+            self.prices.append(price)
+            self.cumulative_base.append(total_base)
+            self.cumulative_quote.append(total_quote)
+
+    def __len__(self):
+        return len(self.prices)
+
+    def base_for_quote(self, quote_amount: int) -> Optional[int]:
+        """ Amount of the base token bought by spending `quote_amount` of the quote token (i.e. walking the asks)
+
+        Returns:
+            A `Wad` value, or `None` if the book is not deep enough to fill `quote_amount`
+        """
+        index = bisect_left(self.cumulative_quote, quote_amount)
+        if index == len(self.prices):
+            return None
+
+        base_before = self.cumulative_base[index - 1] if index > 0 else 0
+        quote_before = self.cumulative_quote[index - 1] if index > 0 else 0
+        return base_before + (quote_amount - quote_before) * WAD // self.prices[index]
+
+    def quote_for_base(self, base_amount: int) -> Optional[int]:
+        """ Amount of the quote token bought by selling `base_amount` of the base token (i.e. walking the bids)
+
+        Returns:
+            A `Wad` value, or `None` if the book is not deep enough to fill `base_amount`
+        """
+        index = bisect_left(self.cumulative_base, base_amount)
+        if index == len(self.prices):
+            return None
+
+        base_before = self.cumulative_base[index - 1] if index > 0 else 0
+        quote_before = self.cumulative_quote[index - 1] if index > 0 else 0
+        return quote_before + (base_amount - base_before) * self.prices[index] // WAD
+
+    def base_for_quotes(self, quote_amounts: Iterable[int]) -> List[Optional[int]]:
+        """ Batched :py:meth:`base_for_quote` """
+        return [self.base_for_quote(quote_amount) for quote_amount in quote_amounts]
+
+    def quote_for_bases(self, base_amounts: Iterable[int]) -> List[Optional[int]]:
+        """ Batched :py:meth:`quote_for_base` """
+        return [self.quote_for_base(base_amount) for base_amount in base_amounts]
@@ -0,0 +1,322 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+from pymaker import Address, Receipt
+from pymaker.numeric import Wad
+
+TRADE = 'trade'
+FAILURE = 'failure'
+CANCELLATION = 'cancellation'
+
+
+def outcome(receipt: Receipt, cancellation: bool) -> str:
+    """ `CANCELLATION` if the transaction mined was a cancellation, which cannot fail, otherwise `TRADE` or `FAILURE` """
+    if cancellation:
+        return CANCELLATION
+
+    return TRADE if receipt.successful else FAILURE
+
+
+def format_amounts(amounts: dict, token_name: Callable[[Address], str]) -> str:
+    """ Amounts (as `Wad` values) keyed by token, e.g. "-10.0 DAI and 10.2 DAI", skipping zero amounts """
+    return " and ".join(f"{Wad(amount)} {token_name(token)}" for token, amount in amounts.items() if amount != 0) or "nothing"
+
+
+class PnLEntry:
+    """ The realized outcome of one of our mined transactions
+
+    Attributes:
+        timestamp: Unix timestamp at which the receipt was recorded
+        entry_token: The entry token of the opportunity the transaction executed
+        nets: Net amount (as a `Wad` value) of each token we received, negative if we sent it, keyed by token
+        gas_spent: ETH spent on gas, in Wei
+        gas_cost: `gas_spent` converted to the entry token, as a `Wad` value
+        outcome: One of `TRADE`, `FAILURE` or `CANCELLATION`
+    """
+
+    def __init__(self, timestamp: float, entry_token: Address, nets: dict, gas_spent: int, gas_cost: int, outcome: str):
+        self.timestamp = timestamp
+        self.entry_token = entry_token
+        self.nets = nets
+        self.gas_spent = gas_spent
+        self.gas_cost = gas_cost
+        self.outcome = outcome
+
+    def to_dict(self) -> dict:
+        return {'timestamp': self.timestamp,
+                'entry_token': self.entry_token.address,
+                'nets': {token.address: str(net) for token, net in self.nets.items()},
+                'gas_spent': str(self.gas_spent),
+                'gas_cost': str(self.gas_cost),
+                'outcome': self.outcome}
+
+    @staticmethod
+    def from_dict(data: dict):
+        return PnLEntry(timestamp=data['timestamp'],
+                        entry_token=Address(data['entry_token']),
+                        nets={Address(token): int(net) for token, net in data['nets'].items()},
+                        gas_spent=int(data['gas_spent']),
+                        gas_cost=int(data['gas_cost']),
+                        outcome=data['outcome'])
+
+
+class PnL:
+    """ Running totals of a set of :py:class:`PnLEntry`, each added (or removed) in time proportional to its transfers
+
+    Attributes:
+        nets: Net amount (as a `Wad` value) of each token received by us, keyed by token
+        gas_costs: Gas cost (as a `Wad` value) of the transactions entering with each token, in that token
+        gas_spent: ETH spent on gas, in Wei
+        counts: Number of transactions of each outcome
+    """
+
+    def __init__(self):
+        self.nets = {}
+        self.gas_costs = {}
+        self.gas_spent = 0
+        self.counts = {TRADE: 0, FAILURE: 0, CANCELLATION: 0}
+
+    def add(self, entry: PnLEntry, sign: int = 1):
+        for token, net in entry.nets.items():
+            self.nets[token] = self.nets.get(token, 0) + sign * net
+
+        self.gas_costs[entry.entry_token] = self.gas_costs.get(entry.entry_token, 0) + sign * entry.gas_cost
+        self.gas_spent += sign * entry.gas_spent
+        self.counts[entry.outcome] += sign
+
+    def profit(self, token: Address) -> Wad:
+        """ Realized profit in `token`, net of the gas cost of the transactions entering with it """
+        return Wad(self.nets.get(token, 0) - self.gas_costs.get(token, 0))
+
+    def copy(self):
+        pnl = PnL()
+        pnl.nets = dict(self.nets)
+        pnl.gas_costs = dict(self.gas_costs)
+        pnl.gas_spent = self.gas_spent
+        pnl.counts = dict(self.counts)
+        return pnl
+
+    def to_dict(self) -> dict:
+        return {'nets': {token.address: str(net) for token, net in self.nets.items()},
+                'gas_costs': {token.address: str(gas_cost) for token, gas_cost in self.gas_costs.items()},
+                'gas_spent': str(self.gas_spent),
+                'counts': self.counts}
+
+    @staticmethod
+    def from_dict(data: dict):
+        pnl = PnL()
+        pnl.nets = {Address(token): int(net) for token, net in data['nets'].items()}
+        pnl.gas_costs = {Address(token): int(gas_cost) for token, gas_cost in data['gas_costs'].items()}
+        pnl.gas_spent = int(data['gas_spent'])
+        pnl.counts.update(data['counts'])
+        return pnl
+
+
+class RollingWindow:
+    """ :py:class:`PnL` of the entries recorded over the last `seconds`
+
+    Entries are added as they are recorded and removed once they are older than `seconds`, so the totals
+    are always current without ever summing the whole window again.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.entries = deque()
+        self.pnl = PnL()
+
+    def add(self, entry: PnLEntry):
+        self.entries.append(entry)
+        self.pnl.add(entry)
+
+    def expire(self, now: float):
+        while self.entries and self.entries[0].timestamp <= now - self.seconds:
+            self.pnl.add(self.entries.popleft(), -1)
+
+
+class PnLLedger:
+    """ Our realized profit and loss, accumulated from the receipts of our transactions as they are collected
+
+    Every receipt is read once: its transfers from or to `owner` are added to the running net of each
+    token, and the gas it spent to the running gas totals, both for our whole history and for the rolling
+    windows of `WINDOWS`. The realized profit of an entry token is its net minus the gas cost of the
+    transactions entering with it, and its drawdown is how far that profit is below its highest value.
+
+    With a `path`, the ledger is restored from it and saved to it again at most every `checkpoint_seconds`
+    (see `checkpoint_due()`), atomically, along with the entries of the longest window.
+
+    Attributes:
+        owner: Our address
+        totals: :py:class:`PnL` of our whole history
+        peaks: Highest realized profit (as a `Wad` value) reached by each entry token
+        windows: :py:class:`RollingWindow` of each window name
+    """
+    logger = logging.getLogger()
+
+    VERSION = 1
+    WINDOWS = {'hour': 3600, 'day': 86400}
+
+    def __init__(self, owner: Address, path: Optional[str] = None, checkpoint_seconds: float = 60.0):
+        assert(isinstance(owner, Address))
+        assert(isinstance(path, str) or path is None)
+
+        self.owner = owner
+        self.path = path
+        self.checkpoint_seconds = checkpoint_seconds
+
+        self.totals = PnL()
+        self.peaks = {}
+        self.windows = {name: RollingWindow(seconds) for name, seconds in self.WINDOWS.items()}
+        self.lock = threading.Lock()
+        self.changed = False
+        self.checkpointed_at = time.time()
+
+        if self.path is not None:
+            self._load()
+
+    def record(self, receipt: Receipt, entry_token: Address, gas_spent: int, gas_cost: Wad, outcome: str) -> dict:
+        """ Record one of our mined transactions
+
+        Args:
+            receipt: The receipt of the transaction
+            entry_token: The entry token of the opportunity it executed
+            gas_spent: ETH spent on gas, in Wei
+            gas_cost: `gas_spent` converted to the entry token
+            outcome: One of `TRADE`, `FAILURE` or `CANCELLATION`
+
+        Returns:
+            The net amount (as a `Wad` value) of each token we received in the transaction, keyed by token
+        """
+        assert(isinstance(gas_cost, Wad))
+        assert(outcome in (TRADE, FAILURE, CANCELLATION))
+
+        nets = {}
+        for transfer in receipt.transfers:
+            if transfer.to_address == self.owner:
+                nets[transfer.token_address] = nets.get(transfer.token_address, 0) + transfer.value.value
+            if transfer.from_address == self.owner:
+                nets[transfer.token_address] = nets.get(transfer.token_address, 0) - transfer.value.value
+
+        entry = PnLEntry(time.time(), entry_token, {token: net for token, net in nets.items() if net != 0},
+                         gas_spent, gas_cost.value, outcome)
+
+        with self.lock:
+            self._add(entry)
+            self.changed = True
+
+        return entry.nets
+
+    def _add(self, entry: PnLEntry):
+        self.totals.add(entry)
+        self.peaks[entry.entry_token] = max(self.peaks.get(entry.entry_token, 0), self.totals.profit(entry.entry_token).value)
+
+        for window in self.windows.values():
+            window.add(entry)
+            window.expire(entry.timestamp)
+
+    def profit(self, token: Address) -> Wad:
+        """ Realized profit in `token` over our whole history, net of gas """
+        with self.lock:
+            return self.totals.profit(token)
+
+    def drawdown(self, token: Address) -> Wad:
+        """ How far the realized profit in `token` is below the highest it has been """
+        with self.lock:
+            return Wad(self.peaks.get(token, 0)) - self.totals.profit(token)
+
+    def window(self, name: str) -> PnL:
+        """ A copy of the :py:class:`PnL` of the entries recorded within the `name` window (e.g. 'hour') """
+        with self.lock:
+            window = self.windows[name]
+            window.expire(time.time())
+            return window.pnl.copy()
+
+    def summary(self, token: Address, token_name: Callable[[Address], str]) -> str:
+        """ Realized profit in `token` over our whole history and each window, for the logs """
+        with self.lock:
+            now = time.time()
+            for window in self.windows.values():
+                window.expire(now)
+
+            name = token_name(token)
+            return f"Realized profit {self.totals.profit(token)} {name} net of gas over {self.totals.counts[TRADE]} trades " \
+                   f"({self.totals.counts[FAILURE]} failed, {self.totals.counts[CANCELLATION]} cancelled), " + \
+                   ", ".join(f"last {window_name} {window.pnl.profit(token)} {name}"
+                             for window_name, window in self.windows.items()) + \
+                   f"; {Wad(self.totals.gas_spent)} ETH spent on gas in total"
+
+    def checkpoint_due(self) -> bool:
+        return self.path is not None and self.changed and time.time() - self.checkpointed_at >= self.checkpoint_seconds
+
+    def checkpoint(self):
+        """ Save the ledger to `path`, if anything has been recorded since it was last saved """
+        if self.path is None:
+            return
+
+        with self.lock:
+            if not self.changed:
+                return
+
+            longest = max(self.windows.values(), key=lambda window: window.seconds)
+            data = {'version': self.VERSION,
+                    'saved_at': time.time(),
+                    'totals': self.totals.to_dict(),
+                    'peaks': {token.address: str(peak) for token, peak in self.peaks.items()},
+                    'entries': [entry.to_dict() for entry in longest.entries]}
+            self.changed = False
+            self.checkpointed_at = time.time()
+
+        try:
+            temporary_path = f"{self.path}.tmp"
+            with open(temporary_path, 'w') as file:
+                json.dump(data, file)
+            os.replace(temporary_path, self.path)
+        except Exception:
+            self.changed = True
+            self.logger.exception(f"Failed to save the PnL ledger to {self.path}")
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            self.logger.warning(f"Ignoring the PnL file {self.path} which cannot be read: {e}")
+            return
+
+        if data.get('version') != self.VERSION:
+            self.logger.warning(f"Ignoring the PnL file {self.path} of version {data.get('version')}")
+            return
+
+        self.totals = PnL.from_dict(data['totals'])
+        self.peaks = {Address(token): int(peak) for token, peak in data['peaks'].items()}
+
+        now = time.time()
+        for entry in map(PnLEntry.from_dict, data['entries']):
+            for window in self.windows.values():
+                if entry.timestamp > now - window.seconds:
+                    window.add(entry)
+
+        self.logger.info(f"Restored the PnL of {sum(self.totals.counts.values())} transactions from {self.path}")
@@ -0,0 +1,213 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import gzip
+import json
+import logging
+import sys
+import time
+from typing import Iterable, Optional
+
+from pymaker.numeric import Wad
+
+from simple_arbitrage_keeper.arbitrage_pair import ArbitragePair, known_token_name, select_opportunities
+from simple_arbitrage_keeper.gas_model import GasModel
+from simple_arbitrage_keeper.market_snapshot import MarketSnapshot
+from simple_arbitrage_keeper.sizing import ProfitCurveSearch
+from simple_arbitrage_keeper.snapshot_recorder import SnapshotFile, is_snapshot_recording
+
+
+def read_snapshots(path: str) -> Iterable[MarketSnapshot]:
+    """ Read recorded :py:class:`MarketSnapshot`s from a `--record-snapshots` recording or from a JSON lines file,
+    gzip-compressed if it ends with `.gz` """
+    if is_snapshot_recording(path):
+        with SnapshotFile(path) as recording:
+            for data in recording:
+                yield MarketSnapshot.from_dict(data)
+        return
+
+    opener = gzip.open if path.endswith('.gz') else open
+
+    with opener(path, 'rt') as file:
+        for line in file:
+            if line.strip():
+                yield MarketSnapshot.from_dict(json.loads(line))
+
+
+class Replay:
+    """ Runs the keeper decision logic over recorded market snapshots, without any node or REST API
+
+    Every snapshot goes through the same :py:meth:`ArbitragePair.evaluate` and `select_opportunities` calls
+    as in the keeper, and selected opportunities are assumed to be filled exactly as quoted. With an
+    `initial_balance`, our entry token balances are simulated (starting from it and moved by the profit of
+    every simulated trade) instead of read from the snapshots. A pair whose order book is missing from a
+    snapshot cannot be evaluated in it, which is logged the first time it happens.
+
+    Attributes:
+        pnl: Simulated profit, net of gas, of each entry token
+        trades: Number of simulated trades
+        blocks: Number of snapshots replayed
+        decision_times: Time taken to decide on each snapshot, in seconds
+    """
+    logger = logging.getLogger()
+
+    def __init__(self, pairs: list, profit_curve_search: ProfitCurveSearch, gas_model: GasModel,
+                 initial_balance: Optional[Wad] = None):
+        assert(isinstance(pairs, list))
+
+        self.pairs = pairs
+        self.profit_curve_search = profit_curve_search
+        self.gas_model = gas_model
+        self.initial_balance = initial_balance
+
+        self.balances = {}
+        self.missing_books = set()
+        self.pnl = {}
+        self.trades = 0
+        self.blocks = 0
+        self.decision_times = []
+
+    def replay(self, snapshot: MarketSnapshot) -> dict:
+        """ Decide on one snapshot, returns the decision as a JSON-serializable dictionary """
+        if self.initial_balance is not None:
+            for pair in self.pairs:
+                self.balances.setdefault(pair.entry_token, self.initial_balance)
+            snapshot.balances = dict(self.balances)
+
+        for pair in self.pairs:
+            if snapshot.book(pair.book_key) is None and pair.book_key not in self.missing_books:
+                self.missing_books.add(pair.book_key)
+                self.logger.warning(f"No {pair.name} order book recorded in block #{snapshot.block_number}, the pair "
+                                    f"is not evaluated in blocks without it (recorded books: "
+                                    f"{', '.join('/'.join(book_key) for book_key in snapshot.books) or 'none'})")
+
+        started = time.perf_counter()
+        opportunities = [opportunity for opportunity in (pair.evaluate(snapshot, self.profit_curve_search, self.gas_model)
+                                                         for pair in self.pairs) if opportunity is not None]
+        selected = select_opportunities(opportunities)
+        decision_time = time.perf_counter() - started
+
+        self.blocks += 1
+        self.decision_times.append(decision_time)
+
+        for opportunity in selected:
+            token = opportunity.pair.entry_token
+            self.trades += 1
+            self.pnl[token] = self.pnl.get(token, Wad(0)) + opportunity.net_profit
+            if token in self.balances:
+                self.balances[token] = self.balances[token] + opportunity.net_profit
+
+        return {
+            'block_number': snapshot.block_number,
+            'decision_us': round(decision_time * 1e6, 1),
+            'opportunities': [{'pair': opportunity.pair.name,
+                               'route': '/'.join(opportunity.route),
+                               'entry_amount': str(opportunity.entry_amount),
+                               'profit': str(opportunity.profit),
+                               'net_profit': str(opportunity.net_profit),
+                               'executed': opportunity in selected} for opportunity in opportunities]
+        }
+
+    def summary(self, token_name) -> str:
+        ordered = sorted(self.decision_times)
+
+        def percentile(percent: float) -> float:
+            return ordered[min(int(len(ordered) * percent / 100), len(ordered) - 1)] if ordered else 0.0
+
+        pnl = ", ".join(f"{value} {token_name(token)}" for token, value in self.pnl.items()) or "none"
+        return f"Replayed {self.blocks} blocks: {self.trades} trades, PnL net of gas {pnl}; " \
+               f"decision time p50 {percentile(50)*1e6:.0f}us, p95 {percentile(95)*1e6:.0f}us, " \
+               f"max {percentile(100)*1e6:.0f}us, total {sum(ordered):.2f}s"
+
+
+class SimpleArbitrageReplay:
+    """Offline replay of recorded market snapshots through the simple-arbitrage-keeper strategy"""
+
+    logger = logging.getLogger('simple-arbitrage-replay')
+
+    def __init__(self, args):
+        parser = argparse.ArgumentParser("simple-arbitrage-replay")
+
+        parser.add_argument("--snapshots", type=str, nargs='+', required=True,
+                            help="Recorded market snapshot files, replayed in the order given")
+
+        parser.add_argument("--config", type=str, required=True,
+                            help="JSON file listing the token pairs to arbitrage, as used by the keeper")
+
+        parser.add_argument("--min-profit", type=int, required=True,
+                            help="Ether amount of minimum profit (in base token, net of estimated gas) from one arbitrage operation")
+
+        parser.add_argument("--max-engagement", type=int, required=True,
+                            help="Ether amount of maximum engagement (in base token) in one arbitrage operation")
+
+        parser.add_argument("--gas-units", type=int, default=GasModel.DEFAULT_GAS_UNITS,
+                            help=f"Estimate of the gas used by one arbitrage transaction (default: {GasModel.DEFAULT_GAS_UNITS})")
+
+        parser.add_argument("--sizing-grid-points", type=int, default=32,
+                            help="Number of entry sizes sampled per direction before refining the most profitable one (default: 32)")
+
+        parser.add_argument("--balance", type=float,
+                            help="Simulate entry token balances starting from this Ether amount instead of using the recorded balances")
+
+        parser.add_argument("--output", type=str,
+                            help="File to write the per-block decisions to, as JSON lines")
+
+        parser.add_argument("--debug", dest='debug', action='store_true',
+                            help="Enable debug output")
+
+        self.arguments = parser.parse_args(args)
+
+        logging.basicConfig(format='%(asctime)-15s %(levelname)-8s %(message)s',
+                            level=(logging.DEBUG if self.arguments.debug else logging.INFO))
+
+        with open(self.arguments.config, 'r') as file:
+            pair_configs = json.load(file)['pairs']
+
+        self.pairs = [ArbitragePair.from_config(pair_config,
+                                                Wad(int(self.arguments.min_profit * 10**18)),
+                                                Wad(int(self.arguments.max_engagement * 10**18)),
+                                                known_token_name)
+                      for pair_config in pair_configs]
+
+        self.token_names = {pair.entry_token: pair.entry_token_name for pair in self.pairs}
+
+        self.replay = Replay(pairs=self.pairs,
+                             profit_curve_search=ProfitCurveSearch(grid_points=self.arguments.sizing_grid_points),
+                             gas_model=GasModel(default_gas_units=self.arguments.gas_units),
+                             initial_balance=Wad.from_number(self.arguments.balance) if self.arguments.balance is not None else None)
+
+    def main(self):
+        started = time.perf_counter()
+        output = open(self.arguments.output, 'w') if self.arguments.output else None
+
+        try:
+            for path in self.arguments.snapshots:
+                for snapshot in read_snapshots(path):
+                    decision = self.replay.replay(snapshot)
+                    if output is not None:
+                        output.write(json.dumps(decision) + '\n')
+        finally:
+            if output is not None:
+                output.close()
+
+        self.logger.info(self.replay.summary(lambda token: self.token_names.get(token, str(token))))
+        self.logger.info(f"Replay took {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == '__main__':
+    SimpleArbitrageReplay(sys.argv[1:]).main()
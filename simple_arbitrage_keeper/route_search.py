@@ -0,0 +1,401 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import math
+from typing import Optional
+
+from pymaker import Address
+from pymaker.numeric import Wad
+
+from simple_arbitrage_keeper.arbitrage_pair import ArbitragePair, Opportunity
+from simple_arbitrage_keeper.gas_model import GasModel
+from simple_arbitrage_keeper.market_snapshot import MarketSnapshot
+from simple_arbitrage_keeper.order_book import WAD
+from simple_arbitrage_keeper.sizing import ProfitCurveSearch
+
+# Uniswap V1 keeps 997/1000 of every input
+UNISWAP_FEE = math.log(0.997)
+
+INFINITY = float('inf')
+
+
+class OasisLeg:
+    """ Selling `pay_token` for `buy_token` on the Oasis market of an :py:class:`ArbitragePair`
+
+    Paying the entry token of the pair walks its asks, paying the arb token walks its bids.
+    """
+    exchange_name = 'Oasis'
+    uniswap_exchange = None
+
+    def __init__(self, pay_token: Address, buy_token: Address, book_key: tuple, buys_base: bool):
+        self.pay_token = pay_token
+        self.buy_token = buy_token
+        self.book_key = book_key
+        self.buys_base = buys_base
+
+    @property
+    def resources(self) -> set:
+        return {('oasis', self.book_key)}
+
+    def weight(self, snapshot: MarketSnapshot) -> float:
+        """ Minus the log of the marginal rate of the leg, infinite if the book side is empty """
+        book = snapshot.book(self.book_key)
+        index = None if book is None else book.ask_index if self.buys_base else book.bid_index
+        if not index:
+            return INFINITY
+
+        price = math.log(index.prices[0] / WAD)
+        return price if self.buys_base else -price
+
+    def fill(self, pay_amount: int, snapshot: MarketSnapshot) -> Optional[int]:
+        """ Amount of `buy_token` bought with `pay_amount`, None if the book is not deep enough """
+        book = snapshot.book(self.book_key)
+        if book is None:
+            return None
+
+        return book.ask_index.base_for_quote(pay_amount) if self.buys_base else book.bid_index.quote_for_base(pay_amount)
+
+    def __eq__(self, other):
+        return isinstance(other, OasisLeg) and (self.pay_token, self.buy_token, self.book_key) == \
+               (other.pay_token, other.buy_token, other.book_key)
+
+    def __hash__(self):
+        return hash((self.exchange_name, self.pay_token, self.buy_token, self.book_key))
+
+
+class UniswapLeg:
+    """ Selling `pay_token` for `buy_token` with `tokenToTokenSwapInput`, i.e. through ETH on both Uniswap exchanges """
+    exchange_name = 'Uniswap'
+
+    def __init__(self, pay_token: Address, buy_token: Address, pay_exchange: Address, buy_exchange: Address):
+        self.pay_token = pay_token
+        self.buy_token = buy_token
+        self.pay_exchange = pay_exchange
+        self.buy_exchange = buy_exchange
+
+    @property
+    def uniswap_exchange(self) -> Address:
+        """ The exchange the swap is sent to """
+        return self.pay_exchange
+
+    @property
+    def resources(self) -> set:
+        return {('uniswap', self.pay_exchange), ('uniswap', self.buy_exchange)}
+
+    def weight(self, snapshot: MarketSnapshot) -> float:
+        """ Minus the log of the marginal rate of the leg, including the fee of both swaps """
+        pay_reserves = snapshot.reserves_of(self.pay_exchange)
+        buy_reserves = snapshot.reserves_of(self.buy_exchange)
+        if min(pay_reserves.token_reserve.value, pay_reserves.eth_reserve.value,
+               buy_reserves.token_reserve.value, buy_reserves.eth_reserve.value) == 0:
+            return INFINITY
+
+        return -(2 * UNISWAP_FEE
+                 + math.log(pay_reserves.eth_reserve.value / pay_reserves.token_reserve.value)
+                 + math.log(buy_reserves.token_reserve.value / buy_reserves.eth_reserve.value))
+
+    def fill(self, pay_amount: int, snapshot: MarketSnapshot) -> Optional[int]:
+        eth_amount = snapshot.reserves_of(self.pay_exchange).token_to_eth_input_price(Wad(pay_amount))
+        return snapshot.reserves_of(self.buy_exchange).eth_to_token_input_price(eth_amount).value
+
+    def __eq__(self, other):
+        return isinstance(other, UniswapLeg) and (self.pay_token, self.buy_token) == (other.pay_token, other.buy_token)
+
+    def __hash__(self):
+        return hash((self.exchange_name, self.pay_token, self.buy_token))
+
+
+class Cycle:
+    """ A sequence of legs starting and ending with the same entry token, traded in a single bundle
+
+    A cycle stands in for the :py:class:`ArbitragePair` of its opportunities, so it exposes the same
+    `name`, `entry_token`, `resources`, `min_profit` and `route_profit()` as a pair does. Two cycles
+    made of the same legs are equal, so a cycle found again in a later block is recognized.
+
+    Attributes:
+        legs: The :py:class:`OasisLeg` and :py:class:`UniswapLeg` of the cycle, in trading order
+        entry_token: Address of the token the cycle starts and ends with
+        uniswap_entry_exchange: Address of the Uniswap exchange of the entry token, used to price gas
+        min_profit: Minimum profit (net of gas, in entry token) of a trade worth executing
+        max_engagement: Maximum amount of the entry token engaged in a single trade
+    """
+
+    def __init__(self, legs: tuple, uniswap_entry_exchange: Address, min_profit: Wad, max_engagement: Wad,
+                 token_names: dict):
+        assert(isinstance(legs, tuple))
+        assert(legs[0].pay_token == legs[-1].buy_token)
+
+        self.legs = legs
+        self.entry_token = legs[0].pay_token
+        self.uniswap_entry_exchange = uniswap_entry_exchange
+        self.min_profit = min_profit
+        self.max_engagement = max_engagement
+        self.name = token_names[self.entry_token] + \
+            ''.join(f" -{leg.exchange_name}-> {token_names[leg.buy_token]}" for leg in legs)
+
+    @property
+    def tokens(self) -> list:
+        return [leg.pay_token for leg in self.legs]
+
+    @property
+    def route(self) -> tuple:
+        return tuple(leg.exchange_name for leg in self.legs)
+
+    @property
+    def resources(self) -> set:
+        resources = {('balance', self.entry_token)}
+        for leg in self.legs:
+            resources |= leg.resources
+
+        return resources
+
+    @property
+    def uniswap_markets(self) -> list:
+        """ `(token, exchange)` of the Uniswap exchanges the cycle trades on, the entry token exchange first """
+        markets = [(self.entry_token, self.uniswap_entry_exchange)]
+        for leg in self.legs:
+            if isinstance(leg, UniswapLeg):
+                for market in [(leg.pay_token, leg.pay_exchange), (leg.buy_token, leg.buy_exchange)]:
+                    if market not in markets:
+                        markets.append(market)
+
+        return markets
+
+    def amounts(self, entry_amount: Wad, snapshot: MarketSnapshot) -> Optional[list]:
+        """ Amount bought by each leg when entering the cycle with `entry_amount`, None if a leg cannot be filled """
+        amounts = []
+        amount = entry_amount.value
+        for leg in self.legs:
+            amount = leg.fill(amount, snapshot)
+            if amount is None:
+                return None
+
+            amounts.append(amount)
+
+        return amounts
+
+    def route_profit(self, route: tuple, entry_amount: Wad, snapshot: MarketSnapshot) -> Optional[Wad]:
+        """ Profit of trading `entry_amount` around the cycle, or None if unfillable; `route` is always our own """
+        amounts = self.amounts(entry_amount, snapshot)
+        return Wad(amounts[-1]) - entry_amount if amounts is not None else None
+
+    def __eq__(self, other):
+        return isinstance(other, Cycle) and self.legs == other.legs
+
+    def __hash__(self):
+        return hash(self.legs)
+
+    def __repr__(self):
+        return f"Cycle({self.name})"
+
+
+class CycleOpportunity(Opportunity):
+    """ The best trade found around a :py:class:`Cycle` in one block
+
+    Attributes:
+        buy_amounts: Minimum amount bought by each leg, which is also the amount paid into the next one
+    """
+
+    def __init__(self, cycle: Cycle, entry_amount: Wad, buy_amounts: list, profit: Wad, net_profit: Wad):
+        super().__init__(cycle, cycle.legs[0].exchange_name, cycle.legs[-1].exchange_name, entry_amount,
+                         buy_amounts[0], buy_amounts[-1], profit, net_profit)
+        self.buy_amounts = buy_amounts
+
+    @property
+    def route(self) -> tuple:
+        return self.pair.route
+
+    def __repr__(self):
+        return f"CycleOpportunity({self.pair.name}, entry_amount={self.entry_amount}, profit={self.profit}, " \
+               f"net_profit={self.net_profit})"
+
+
+class RouteSearch:
+    """ Finds the most profitable cycle of 2 to `max_hops` legs across all Oasis markets and Uniswap exchanges
+
+    Tokens are the nodes of a graph whose edges are the legs available between them: both sides of every
+    configured Oasis market, and a `tokenToTokenSwapInput` between every two tokens with a Uniswap exchange.
+    The graph is built once, with the adjacency of every node precomputed. Every block each leg is weighted
+    with minus the log of its marginal rate, so a cycle is profitable at the margin exactly when its weights
+    sum to a negative number. A hop-limited Bellman-Ford relaxation from each entry token finds the most
+    negative cycle of each length back to it, and only those are sized against the actual depth of the
+    books and reserves, with the same :py:class:`ProfitCurveSearch` as the pairs.
+
+    Attributes:
+        max_hops: Maximum number of legs of a cycle
+        min_hops: Minimum number of legs of a cycle; 3 skips the two-leg cycles the pairs already evaluate
+    """
+    logger = logging.getLogger()
+
+    def __init__(self, pairs: list, token_names: dict, min_hops: int = 3, max_hops: int = 4):
+        assert(isinstance(pairs, list))
+        assert(isinstance(token_names, dict))
+        assert(2 <= min_hops <= max_hops)
+
+        self.token_names = token_names
+        self.min_hops = min_hops
+        self.max_hops = max_hops
+
+        uniswap_exchanges = {}
+        legs = []
+        for pair in pairs:
+            uniswap_exchanges.setdefault(pair.entry_token, pair.uniswap_entry_exchange)
+            uniswap_exchanges.setdefault(pair.arb_token, pair.uniswap_arb_exchange)
+
+            for leg in [OasisLeg(pair.entry_token, pair.arb_token, pair.book_key, buys_base=True),
+                        OasisLeg(pair.arb_token, pair.entry_token, pair.book_key, buys_base=False)]:
+                if leg not in legs:
+                    legs.append(leg)
+
+        for pay_token, pay_exchange in uniswap_exchanges.items():
+            for buy_token, buy_exchange in uniswap_exchanges.items():
+                if pay_token != buy_token:
+                    legs.append(UniswapLeg(pay_token, buy_token, pay_exchange, buy_exchange))
+
+        self.uniswap_exchanges = uniswap_exchanges
+        self.legs = legs
+        self.nodes = list(uniswap_exchanges)
+        index = {token: i for i, token in enumerate(self.nodes)}
+        self.leg_nodes = [(index[leg.pay_token], index[leg.buy_token]) for leg in legs]
+
+        self.adjacency = [[] for _ in self.nodes]
+        for i, (pay_node, buy_node) in enumerate(self.leg_nodes):
+            self.adjacency[pay_node].append((i, buy_node))
+
+        self.pairs = pairs
+        self.source_nodes = [index[pair.entry_token] for pair in pairs]
+
+        self.logger.info(f"Route search over {len(self.nodes)} tokens and {len(self.legs)} legs, "
+                         f"cycles of {min_hops} to {max_hops} legs")
+
+    def sources(self) -> dict:
+        """ The `(min_profit, max_engagement)` of cycles from each entry token node, the most conservative of its pairs
+
+        Read from the pairs on every search, so a change of their settings (e.g. a throttled max engagement)
+        applies to the cycles as well.
+        """
+        sources = {}
+        for source, pair in zip(self.source_nodes, self.pairs):
+            (min_profit, max_engagement) = sources.get(source, (pair.min_profit, pair.max_engagement))
+            sources[source] = (Wad.max(min_profit, pair.min_profit), Wad.min(max_engagement, pair.max_engagement))
+
+        return sources
+
+    def weights(self, snapshot: MarketSnapshot) -> list:
+        return [leg.weight(snapshot) for leg in self.legs]
+
+    def negative_cycles(self, source: int, weights: list) -> list:
+        """ The most negative cycle of each length from `min_hops` to `max_hops` through `source`
+
+        `distances[hops][node]` is the lowest weight of a walk of `hops` legs from `source` to `node`, and
+        `predecessors[hops][node]` the last leg of that walk. Walks do not go through `source` on the way,
+        and cycles visiting another token twice are dropped when they are reconstructed.
+
+        Returns:
+            A list of `(weight, legs)` tuples, `legs` being indices into `self.legs`
+        """
+        distances = [{source: 0.0}]
+        predecessors = [{}]
+        cycles = []
+
+        for hops in range(1, self.max_hops + 1):
+            current = {}
+            current_predecessors = {}
+            closing = INFINITY
+            closing_leg = None
+
+            for node, distance in distances[-1].items():
+                for (leg, next_node) in self.adjacency[node]:
+                    weight = distance + weights[leg]
+                    if next_node == source:
+                        if weight < closing:
+                            closing = weight
+                            closing_leg = leg
+                    elif hops < self.max_hops and weight < current.get(next_node, INFINITY):
+                        current[next_node] = weight
+                        current_predecessors[next_node] = leg
+
+            if hops >= self.min_hops and closing < 0:
+                path = self._path(predecessors, closing_leg, hops)
+                if path is not None:
+                    cycles.append((closing, path))
+
+            distances.append(current)
+            predecessors.append(current_predecessors)
+
+        return cycles
+
+    def _path(self, predecessors: list, closing_leg: int, hops: int) -> Optional[tuple]:
+        path = [closing_leg]
+        node = self.leg_nodes[closing_leg][0]
+        for level in range(hops - 1, 0, -1):
+            leg = predecessors[level][node]
+            path.append(leg)
+            node = self.leg_nodes[leg][0]
+
+        path.reverse()
+        visited = [self.leg_nodes[leg][0] for leg in path]
+        return tuple(path) if len(set(visited)) == len(visited) else None
+
+    def search(self, snapshot: MarketSnapshot, profit_curve_search: ProfitCurveSearch,
+               gas_model: GasModel) -> Optional[CycleOpportunity]:
+        """ Find the most profitable cycle trade against `snapshot`
+
+        Returns:
+            The :py:class:`CycleOpportunity` with the highest net profit, regardless of its profitability,
+            or None if no cycle is profitable at the margin
+        """
+        weights = self.weights(snapshot)
+
+        best = None
+        for source, (min_profit, max_engagement) in self.sources().items():
+            entry_token = self.nodes[source]
+            max_entry_amount = Wad.min(snapshot.balance(entry_token), max_engagement)
+            if max_entry_amount == Wad(0):
+                continue
+
+            for (_, path) in self.negative_cycles(source, weights):
+                cycle = Cycle(tuple(self.legs[leg] for leg in path), self.uniswap_exchanges[entry_token],
+                              min_profit, max_engagement, self.token_names)
+
+                opportunity = self.evaluate(cycle, snapshot, profit_curve_search, gas_model, max_entry_amount)
+                if opportunity is not None and (best is None or opportunity.net_profit > best.net_profit):
+                    best = opportunity
+
+        return best
+
+    @staticmethod
+    def evaluate(cycle: Cycle, snapshot: MarketSnapshot, profit_curve_search: ProfitCurveSearch, gas_model: GasModel,
+                 max_entry_amount: Wad) -> Optional[CycleOpportunity]:
+        """ Size the trade around `cycle` maximizing its profit, like :py:meth:`ArbitragePair.evaluate` does for a route """
+        (entry_amount, profit) = ArbitragePair.optimal_entry_amount(
+            profit_curve_search, lambda amount: cycle.route_profit(cycle.route, amount, snapshot), max_entry_amount)
+
+        if profit is None:
+            return None
+
+        buy_amounts = []
+        amount = entry_amount.value
+        for leg in cycle.legs:
+            amount = (Wad(leg.fill(amount, snapshot)) * Wad.from_number(0.999999)).value
+            buy_amounts.append(Wad(amount))
+
+        net_profit = profit - ArbitragePair.gas_cost(gas_model, cycle.route, snapshot.gas_price,
+                                                     snapshot.reserves_of(cycle.uniswap_entry_exchange))
+
+        return CycleOpportunity(cycle, entry_amount, buy_amounts, profit, net_profit)
@@ -0,0 +1,214 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import itertools
+import logging
+import threading
+from typing import Callable
+
+import requests
+
+from pymaker import Address
+from pymaker.util import http_response_summary
+
+from simple_arbitrage_keeper.endpoint_pool import EndpointPool
+
+BALANCE_OF = '0x70a08231'
+ALLOWANCE = '0xdd62ed3e'
+OWNER = '0x8da5cb5b'
+
+
+def encode_address(address: Address) -> str:
+    """ ABI-encode an address as a 32 byte word, without the `0x` prefix """
+    return address.address[2:].lower().rjust(64, '0')
+
+
+def decode_uint(result: str) -> int:
+    return int(result, 16) if result not in (None, '0x') else 0
+
+
+def decode_address(result: str) -> Address:
+    return Address('0x' + result[-40:])
+
+
+class CallErrors(Exception):
+    """ Raised for a batch some calls of which a node answered with a JSON-RPC error, e.g. `header not found`
+    when it has not seen the block the batch is pinned to yet
+
+    Attributes:
+        responses: The whole batch response, so that the calls can still be resolved if no other node does better
+    """
+
+    def __init__(self, responses: list, errors: list):
+        super().__init__(f"{len(errors)} of {len(responses)} calls of the JSON-RPC batch failed, the first one with: {errors[0]}")
+        self.responses = responses
+
+
+class BatchResult:
+    """ The result of one call of a :py:class:`ReadBatch`, available once the batch has been executed """
+
+    def __init__(self, method: str, params: list, decoder: Callable):
+        self.method = method
+        self.params = params
+        self.decoder = decoder
+        self.executed = False
+        self.result = None
+        self.error = None
+
+    def resolve(self, response: dict):
+        self.executed = True
+        if 'error' in response:
+            self.error = response['error']
+        else:
+            self.result = self.decoder(response.get('result'))
+
+    @property
+    def value(self):
+        if not self.executed:
+            raise Exception(f"Batch has not been executed yet, no result for {self.method}")
+        if self.error is not None:
+            raise Exception(f"JSON-RPC call {self.method} failed: {self.error}")
+
+        return self.result
+
+
+class ReadBatch:
+    """ Read-only calls grouped into a single JSON-RPC batch request, all pinned to the same block
+
+    Calls are queued with the methods below, each returning a :py:class:`BatchResult` whose value
+    becomes available once :py:meth:`execute` has sent the whole batch in one HTTP round trip.
+    """
+
+    def __init__(self, reader, block_identifier='latest'):
+        self.reader = reader
+        self.block = hex(block_identifier) if isinstance(block_identifier, int) else block_identifier
+        self.calls = []
+
+    def __len__(self):
+        return len(self.calls)
+
+    def _queue(self, method: str, params: list, decoder: Callable) -> BatchResult:
+        result = BatchResult(method, params, decoder)
+        self.calls.append(result)
+        return result
+
+    def call(self, to: Address, data: str, decoder: Callable = decode_uint, from_address: Address = None) -> BatchResult:
+        """ Queue an `eth_call` of `data` on the contract at `to`, optionally sent from `from_address` """
+        transaction = {'to': to.address, 'data': data}
+        if from_address is not None:
+            transaction['from'] = from_address.address
+
+        return self._queue('eth_call', [transaction, self.block], decoder)
+
+    def balance_of(self, token: Address, owner: Address) -> BatchResult:
+        """ Queue an ERC20 `balanceOf(owner)` call, decoded as an integer (i.e. a `Wad` value) """
+        return self.call(token, BALANCE_OF + encode_address(owner))
+
+    def allowance(self, token: Address, owner: Address, spender: Address) -> BatchResult:
+        """ Queue an ERC20 `allowance(owner, spender)` call, decoded as an integer (i.e. a `Wad` value) """
+        return self.call(token, ALLOWANCE + encode_address(owner) + encode_address(spender))
+
+    def owner(self, contract: Address) -> BatchResult:
+        """ Queue an `owner()` call, decoded as a :py:class:`pymaker.Address` """
+        return self.call(contract, OWNER, decode_address)
+
+    def eth_balance(self, address: Address) -> BatchResult:
+        """ Queue an `eth_getBalance`, decoded as an integer (i.e. a `Wad` value) """
+        return self._queue('eth_getBalance', [address.address, self.block], decode_uint)
+
+    def gas_price(self) -> BatchResult:
+        """ Queue an `eth_gasPrice`, decoded as an integer """
+        return self._queue('eth_gasPrice', [], decode_uint)
+
+    def logs(self, address, from_block: int, to_block: int, topics: list) -> BatchResult:
+        """ Queue an `eth_getLogs` of the events of the contract at `address` (or of a list of contracts),
+        returned as raw log dictionaries """
+        addresses = [item.address for item in address] if isinstance(address, list) else address.address
+        log_filter = {'address': addresses, 'fromBlock': hex(from_block), 'toBlock': hex(to_block), 'topics': topics}
+        return self._queue('eth_getLogs', [log_filter], lambda result: result or [])
+
+    def execute(self):
+        """ Send all queued calls as one JSON-RPC batch request and resolve their results """
+        if self.calls:
+            self.reader.execute(self.calls)
+
+
+class BatchReader:
+    """ Sends batches of read-only JSON-RPC calls to a node over a pooled HTTP session
+
+    Given several nodes, every batch is sent as a hedged request through an :py:class:`EndpointPool`. A node
+    answering any call of a batch with a JSON-RPC error counts as failing it, so the batch is sent to the next
+    node. If every node fails and one of them answered that way, the calls are resolved from the last such
+    answer, errors included, rather than failing with the error of the last node tried.
+
+    Attributes:
+        pool: The :py:class:`EndpointPool` of the HTTP endpoints of the nodes
+        timeout: Timeout of a batch request, in seconds
+    """
+    logger = logging.getLogger()
+
+    def __init__(self, endpoint_uri, timeout: float, session: requests.Session = None):
+        assert(isinstance(endpoint_uri, str) or isinstance(endpoint_uri, list))
+
+        self.pool = EndpointPool('rpc', [endpoint_uri] if isinstance(endpoint_uri, str) else endpoint_uri)
+        self.timeout = timeout
+        self.session = session if session is not None else requests.Session()
+        self.request_ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def batch(self, block_identifier='latest') -> ReadBatch:
+        """ Start a new :py:class:`ReadBatch` pinned to `block_identifier` (a block number, or 'latest') """
+        return ReadBatch(self, block_identifier)
+
+    def execute(self, calls: list):
+        with self.lock:
+            first_id = next(self.request_ids)
+            self.request_ids = itertools.count(first_id + len(calls))
+
+        payload = [{'jsonrpc': '2.0', 'id': first_id + index, 'method': call.method, 'params': call.params}
+                   for index, call in enumerate(calls)]
+
+        def post(endpoint_uri: str) -> list:
+            response = self.session.post(endpoint_uri, json=payload, timeout=self.timeout)
+            if not response.ok:
+                raise Exception(f"Failed to execute JSON-RPC batch: {http_response_summary(response)}")
+
+            data = response.json()
+            if not isinstance(data, list):
+                raise Exception(f"JSON-RPC batch of {len(calls)} calls failed: {data.get('error', data)}")
+
+            errors = [item['error'] for item in data if 'error' in item]
+            if errors:
+                call_errors.append(CallErrors(data, errors))
+                raise call_errors[-1]
+
+            return data
+
+        call_errors = []
+        try:
+            data = self.pool.request(post)
+        except Exception as e:
+            if not call_errors:
+                raise
+
+            self.logger.debug(f"Every node failed the JSON-RPC batch, the last one with: {e}")
+            data = call_errors[-1].responses
+        responses = {item.get('id'): item for item in data}
+        for index, call in enumerate(calls):
+            call.resolve(responses.get(first_id + index, {'error': 'missing from the batch response'}))
+
+        self.logger.debug(f"Executed JSON-RPC batch of {len(calls)} calls")
@@ -16,21 +16,41 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+import json
 import logging
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
+import requests
 from web3 import Web3, HTTPProvider
 
 
 
-from simple_arbitrage_keeper.uniswap import UniswapWrapper
+from simple_arbitrage_keeper.arbitrage_pair import ArbitragePair, Opportunity, known_token_name, select_opportunities
+from simple_arbitrage_keeper.balance_ledger import BalanceLedger
+from simple_arbitrage_keeper.block_scheduler import BlockScheduler, submit_logged
+from simple_arbitrage_keeper.chain_order_book import ChainOrderBook
+from simple_arbitrage_keeper.endpoint_pool import EndpointPool
+from simple_arbitrage_keeper.gas_model import CachedGasPrice, GasModel
+from simple_arbitrage_keeper.market_snapshot import MarketSnapshot
+from simple_arbitrage_keeper.metrics import BLOCK_EVALUATION, BLOCK_HANDOFF, CHAIN_STATE_BATCH, DRAWDOWN, ERRORS, \
+    GAS_SPENT, MetricsServer, OPPORTUNITIES_FAILED, OPPORTUNITIES_REJECTED, OPPORTUNITIES_SEEN, OPPORTUNITIES_TAKEN, \
+    REALIZED_PROFIT, TIME_TO_FIRST_QUOTE
+from simple_arbitrage_keeper.uniswap import UniswapWrapper, queue_reserves
 from simple_arbitrage_keeper.oasis_api import OasisAPI
-from simple_arbitrage_keeper.transfer_formatter import TransferFormatter
-
-from pymaker import Address, web3_via_http
+from simple_arbitrage_keeper.pnl_ledger import CANCELLATION, PnLLedger, TRADE, format_amounts, outcome
+from simple_arbitrage_keeper.route_search import CycleOpportunity, RouteSearch
+from simple_arbitrage_keeper.rpc_batch import BatchReader
+from simple_arbitrage_keeper.simulation import BundleSimulator, Simulation
+from simple_arbitrage_keeper.sizing import ProfitCurveSearch
+from simple_arbitrage_keeper.snapshot_recorder import SnapshotRecorder
+from simple_arbitrage_keeper.submission_manager import PendingTransaction, SubmissionManager
+from simple_arbitrage_keeper.warm_start import LazyContracts, WarmState
+
+from pymaker import Address, Receipt, Transact, web3_via_http
 from pymaker.approval import via_tx_manager, directly
-from pymaker.gas import DefaultGasPrice, FixedGasPrice
 from pymaker.keys import register_keys
 from pymaker.lifecycle import Lifecycle
 from pymaker.numeric import Wad
@@ -44,13 +64,20 @@ class SimpleArbitrageKeeper:
 
     logger = logging.getLogger('simple-arbitrage-keeper')
 
+    PAIR_ARGUMENTS = ['entry-token', 'arb-token', 'arb-token-name', 'uniswap-entry-exchange', 'uniswap-arb-exchange']
+
+    # same threshold as `pymaker.approval`, below which an allowance gets approved again
+    APPROVED_ALLOWANCE = Wad(2**128 - 1)
+
     def __init__(self, args, **kwargs):
         """Pass in arguements assign necessary variables/objects and instantiate other Classes"""
+        self.started_at = time.perf_counter()
 
         parser = argparse.ArgumentParser("simple-arbitrage-keeper")
 
-        parser.add_argument("--rpc-host", type=str, default="localhost",
-                            help="JSON-RPC host (default: `localhost:8545')")
+        parser.add_argument("--rpc-host", type=str, nargs='+', default=["localhost"],
+                            help="JSON-RPC host(s); market state reads are hedged across all of them, transactions "
+                                 "are sent to the first one (default: `localhost:8545')")
 
         parser.add_argument("--rpc-timeout", type=int, default=10,
                             help="JSON-RPC timeout (in seconds, default: 10)")
@@ -61,38 +88,57 @@ class SimpleArbitrageKeeper:
         parser.add_argument("--eth-key", type=str, nargs='*', required=True,
                             help="Ethereum private key(s) to use (e.g. 'key_file=/path/to/keystore.json,pass_file=/path/to/passphrase.txt')")
 
-        parser.add_argument("--uniswap-entry-exchange", type=str, required=True,
+        parser.add_argument("--uniswap-entry-exchange", type=str,
                             help="Ethereum address of the Uniswap Exchange contract for the entry token market; checksummed (e.g. '0x12AebC')")
 
-        parser.add_argument("--uniswap-arb-exchange", type=str, required=True,
+        parser.add_argument("--uniswap-arb-exchange", type=str,
                             help="Ethereum address of the Uniswap Exchange contract for the arb token market; checksummed (e.g. '0x12AebC')")
 
         parser.add_argument("--oasis-address", type=str, required=True,
                             help="Ethereum address of the OasisDEX contract; checksummed (e.g. '0x12AebC')")
 
-        parser.add_argument("--oasis-api-endpoint", type=str, required=True,
-                            help="Endpoint of of the Oasis V2 REST API (e.g. 'https://kovan-api.oasisdex.com' )")
+        parser.add_argument("--oasis-support-address", type=str,
+                            help="Ethereum address of the OasisDEX support contract, used to read whole order books; checksummed (e.g. '0x12AebC')")
+
+        parser.add_argument("--oasis-api-endpoint", type=str, nargs='+',
+                            help="Endpoint(s) of the Oasis V2 REST API, order book reads are hedged across all of them (e.g. 'https://kovan-api.oasisdex.com' )")
+
+        parser.add_argument("--oasis-book-source", type=str, choices=['api', 'chain'], default='api',
+                            help="Read Oasis order books from the REST API, or from the OasisDEX contract and its events (default: 'api')")
+
+        parser.add_argument("--oasis-resync-blocks", type=int, default=300,
+                            help="Number of blocks between full reads of the order books maintained from chain events, 0 to disable (default: 300)")
+
+        parser.add_argument("--oasis-max-staleness", type=float, default=0.0,
+                            help="Maximum age (in seconds) of a cached Oasis order book before it is revalidated with the REST API (default: 0)")
 
         parser.add_argument("--relayer-per-page", type=int, default=100,
                             help="Number of orders to fetch per one page from the 0x Relayer API (default: 100)")
 
+        parser.add_argument("--config", type=str,
+                            help="JSON file listing the token pairs to arbitrage, replacing the single pair given by the "
+                                 "--entry-token, --arb-token, --arb-token-name and --uniswap-*-exchange arguments")
+
         parser.add_argument("--tx-manager", type=str, required=True,
                             help="Ethereum address of the TxManager contract to use for multi-step arbitrage; checksummed (e.g. '0x12AebC')")
 
         parser.add_argument("--gas-price", type=int, default=0,
                             help="Gas price in Wei (default: node default), (e.g. 1000000000 for 1 GWei)")
 
-        parser.add_argument("--entry-token", type=str, required=True,
+        parser.add_argument("--gas-units", type=int, default=GasModel.DEFAULT_GAS_UNITS,
+                            help=f"Initial estimate of the gas used by one arbitrage transaction, refined from our receipts (default: {GasModel.DEFAULT_GAS_UNITS})")
+
+        parser.add_argument("--entry-token", type=str,
                             help="The token address that the bot starts and ends with in every transaction; checksummed (e.g. '0x12AebC')")
 
-        parser.add_argument("--arb-token", type=str, required=True,
+        parser.add_argument("--arb-token", type=str,
                             help="The token address that arbitraged between both exchanges; checksummed (e.g. '0x12AebC')")
 
-        parser.add_argument("--arb-token-name", type=str, required=True,
+        parser.add_argument("--arb-token-name", type=str,
                             help="The token name that arbitraged between both exchanges (e.g. 'SAI', 'WETH', 'REP')")
 
         parser.add_argument("--min-profit", type=int, required=True,
-                            help="Ether amount of minimum profit (in base token) from one arbitrage operation (e.g. 1 for 1 Sai min profit)")
+                            help="Ether amount of minimum profit (in base token, net of estimated gas) from one arbitrage operation (e.g. 1 for 1 Sai min profit)")
 
         parser.add_argument("--max-engagement", type=int, required=True,
                             help="Ether amount of maximum engagement (in base token) in one arbitrage operation (e.g. 100 for 100 Sai max engagement)")
@@ -100,58 +146,199 @@ class SimpleArbitrageKeeper:
         parser.add_argument("--max-errors", type=int, default=100,
                             help="Maximum number of allowed errors before the keeper terminates (default: 100)")
 
+        parser.add_argument("--sizing-grid-points", type=int, default=32,
+                            help="Number of entry sizes sampled per direction before refining the most profitable one (default: 32)")
+
+        parser.add_argument("--max-route-hops", type=int, choices=[2, 3, 4], default=2,
+                            help="Maximum number of legs of the cycles searched across all Oasis markets and Uniswap exchanges, "
+                                 "3 or 4 to search cycles beyond the two routes of each pair (default: 2)")
+
+        parser.add_argument("--quote-threads", type=int, default=4,
+                            help="Number of worker threads used to fetch per-block market data concurrently (default: 4)")
+
+        parser.add_argument("--reconcile-blocks", type=int, default=100,
+                            help="Number of blocks between full reads of the balances tracked from our receipts and Transfer events, 0 to disable (default: 100)")
+
+        parser.add_argument("--replace-after-blocks", type=int, default=3,
+                            help="Number of blocks after which a transaction not mined yet is sent again with a higher gas price (default: 3)")
+
+        parser.add_argument("--gas-price-increase", type=float, default=1.125,
+                            help="Factor the gas price of a transaction is multiplied by when it is sent again (default: 1.125)")
+
+        parser.add_argument("--max-gas-price", type=int, default=0,
+                            help="Maximum gas price (in Wei) transactions are sent again with, 0 for no maximum (default: 0)")
+
+        parser.add_argument("--no-simulation", dest='simulation', action='store_false',
+                            help="Submit transactions without dry-running them with eth_call at the pending block first")
+
+        parser.add_argument("--state-file", type=str,
+                            help="File persisting the verified TxManager ownership, approvals and balances between runs, "
+                                 "to start quoting on the very next block and verify them in the background")
+
+        parser.add_argument("--pnl-file", type=str,
+                            help="File the realized profit and loss of our transactions is checkpointed to, and restored from at startup")
+
+        parser.add_argument("--pnl-checkpoint-seconds", type=float, default=60.0,
+                            help="Minimum number of seconds between checkpoints of the profit and loss to --pnl-file (default: 60)")
+
+        parser.add_argument("--max-drawdown", type=float,
+                            help="Ether amount of realized loss (in an entry token, net of gas) from its highest realized profit "
+                                 "at which the keeper terminates (default: disabled)")
+
+        parser.add_argument("--throttle-hourly-loss", type=float,
+                            help="Ether amount of realized loss (in an entry token, net of gas) over the last hour for which "
+                                 "the max engagement of the pairs entering with it is halved, and halved again for every "
+                                 "further such amount lost (default: disabled)")
+
+        parser.add_argument("--record-snapshots", type=str,
+                            help="File to append the market state and decision of every block to, for offline analysis and replay")
+
+        parser.add_argument("--metrics-port", type=int,
+                            help="Port to serve Prometheus metrics on, from localhost (default: disabled)")
+
         parser.add_argument("--debug", dest='debug', action='store_true',
                             help="Enable debug output")
 
         self.arguments = parser.parse_args(args)
 
+        if self.arguments.config is None:
+            missing = [f"--{name}" for name in self.PAIR_ARGUMENTS if getattr(self.arguments, name.replace('-', '_')) is None]
+            if missing:
+                parser.error(f"the following arguments are required unless --config is given: {', '.join(missing)}")
+
+        if self.arguments.oasis_book_source == 'api' and self.arguments.oasis_api_endpoint is None:
+            parser.error("the following arguments are required unless --oasis-book-source is 'chain': --oasis-api-endpoint")
+
         self.web3: Web3 = kwargs['web3'] if 'web3' in kwargs else web3_via_http(
-            endpoint_uri=self.arguments.rpc_host, timeout=self.arguments.rpc_timeout)
+            endpoint_uri=self.arguments.rpc_host[0], timeout=self.arguments.rpc_timeout)
 
         self.web3.eth.defaultAccount = self.arguments.eth_from
         register_keys(self.web3, self.arguments.eth_key)
         self.our_address = Address(self.arguments.eth_from)
 
-        # self.sai = ERC20Token(web3=self.web3, address=Address('0x89d24a6b4ccb1b6faa2625fe562bdd9a23260359'))  # Mainnet Sai
-        # self.dai = ERC20Token(web3=self.web3, address=Address('0x6b175474e89094c44da98b954eedeac495271d0f'))  # Mainnet Dai
+        self.min_profit = Wad(int(self.arguments.min_profit * 10**18))
+        self.max_engagement = Wad(int(self.arguments.max_engagement * 10**18))
+        self.max_errors = self.arguments.max_errors
+        self.errors = 0
 
-        self.ksai = ERC20Token(web3=self.web3, address=Address('0xC4375B7De8af5a38a93548eb8453a498222C4fF2')) #Kovan Sai
-        self.kdai = ERC20Token(web3=self.web3, address=Address('0x4F96Fe3b7A6Cf9725f59d353F723c1bDb64CA6Aa')) #Kovan Dai
+        self.token_names = {}
+        self.tokens = LazyContracts()
+        self.uniswap_exchanges = LazyContracts()
+        self.exchange_tokens = {}
+        self.order_books = {}
+        self.oasis_session = requests.Session()
+        self.oasis_pool = EndpointPool('oasis-api', self.arguments.oasis_api_endpoint) \
+            if self.arguments.oasis_api_endpoint else None
+
+        # contracts are only constructed when first used, see `oasis` and `tx_manager`
+        self.oasis_address = Address(self.arguments.oasis_address)
+        self.tx_manager_address = Address(self.arguments.tx_manager) if self.arguments.tx_manager else None
+        self.contracts = LazyContracts()
+        self.contracts.register(self.oasis_address, lambda: MatchingMarket(
+            web3=self.web3, address=self.oasis_address,
+            support_address=Address(self.arguments.oasis_support_address) if self.arguments.oasis_support_address else None))
+        if self.tx_manager_address is not None:
+            self.contracts.register(self.tx_manager_address, lambda: TxManager(web3=self.web3, address=self.tx_manager_address))
+
+        self.batch_reader = BatchReader(endpoint_uri=self.arguments.rpc_host, timeout=self.arguments.rpc_timeout)
+
+        self.pairs = [self.create_pair(pair_config) for pair_config in self.pair_configs()]
+        self.route_search = RouteSearch(self.pairs, self.token_names, min_hops=3, max_hops=self.arguments.max_route_hops) \
+            if self.arguments.max_route_hops > 2 else None
+        self.ledger = BalanceLedger(self.batch_reader, self.our_address, list(self.tokens), self.arguments.reconcile_blocks)
+        self.pnl = PnLLedger(self.our_address, self.arguments.pnl_file, self.arguments.pnl_checkpoint_seconds)
+        self.max_drawdown = Wad.from_number(self.arguments.max_drawdown) if self.arguments.max_drawdown is not None else None
+        self.throttle_loss = Wad.from_number(self.arguments.throttle_hourly_loss) \
+            if self.arguments.throttle_hourly_loss is not None else None
+        self.max_engagements = [pair.max_engagement for pair in self.pairs]
+        self.throttle_steps = {}
+        self.latest_snapshot = None
+
+        for entry_token in set(pair.entry_token for pair in self.pairs):
+            REALIZED_PROFIT.labels(self.token_name(entry_token)).set_function(
+                lambda entry_token=entry_token: float(self.pnl.profit(entry_token).value) / 10**18)
+            DRAWDOWN.labels(self.token_name(entry_token)).set_function(
+                lambda entry_token=entry_token: float(self.pnl.drawdown(entry_token).value) / 10**18)
+        GAS_SPENT.set_function(lambda: self.pnl.totals.gas_spent / 10**18)
+
+        self.cached_gas_price = CachedGasPrice(self.arguments.gas_price)
+        self.gas_model = GasModel(default_gas_units=self.arguments.gas_units)
+        self.profit_curve_search = ProfitCurveSearch(grid_points=self.arguments.sizing_grid_points)
+        self.executor = ThreadPoolExecutor(max_workers=self.arguments.quote_threads)
+        self.bookkeeper = ThreadPoolExecutor(max_workers=2, thread_name_prefix='bookkeeping')
+        self.simulator = BundleSimulator(self.batch_reader, self.gas_model, self.our_address) \
+            if self.arguments.simulation else None
+        self.scheduler = BlockScheduler(self.find_best_opportunity_available)
+        self.submission_manager = SubmissionManager(web3=self.web3,
+                                                    from_address=self.our_address,
+                                                    gas_price=self.cached_gas_price,
+                                                    on_receipt=self.on_receipt,
+                                                    replace_after_blocks=self.arguments.replace_after_blocks,
+                                                    gas_price_increase=self.arguments.gas_price_increase,
+                                                    max_gas_price=self.arguments.max_gas_price)
+        ERRORS.set_function(lambda: self.errors)
+        self.metrics_server = MetricsServer(self.arguments.metrics_port) if self.arguments.metrics_port else None
+
+        self.recorder = SnapshotRecorder(self.arguments.record_snapshots) if self.arguments.record_snapshots else None
+
+        self.chain_id = None
+        self.warm_start = False
+        self.first_quote_latency = None
+        self.warm_state = WarmState(self.arguments.state_file, self.state_contracts()) \
+            if self.arguments.state_file else None
 
-        self.entry_token = ERC20Token(web3=self.web3, address=Address(self.arguments.entry_token))
-        self.arb_token = ERC20Token(web3=self.web3, address=Address(self.arguments.arb_token))
-        self.arb_token.name = self.arguments.arb_token_name \
-            if self.arguments.arb_token_name != 'WETH' else 'ETH'
+        logging.basicConfig(format='%(asctime)-15s %(levelname)-8s %(message)s',
+                            level=(logging.DEBUG if self.arguments.debug else logging.INFO))
 
 
-        self.uniswap_entry_exchange = UniswapWrapper(self.web3, self.entry_token.address, Address(self.arguments.uniswap_entry_exchange)) \
-            if self.arguments.uniswap_entry_exchange is not None else None
+    def pair_configs(self) -> list:
+        """ Pairs to arbitrage, either listed in the `--config` file or given by the command line arguments
 
-        self.uniswap_arb_exchange = UniswapWrapper(self.web3, self.arb_token.address, Address(self.arguments.uniswap_arb_exchange)) \
-            if self.arguments.uniswap_arb_exchange is not None else None
+        The config file is a JSON object with a `pairs` list, each pair using the names of the corresponding
+        command line arguments. `min-profit` and `max-engagement` default to the command line values, and
+        `entry-token-name` to the name known for the entry token address.
+        """
+        if self.arguments.config is None:
+            return [{name: getattr(self.arguments, name.replace('-', '_')) for name in self.PAIR_ARGUMENTS}]
 
-        self.oasis_api_endpoint = OasisAPI(api_server=self.arguments.oasis_api_endpoint,
-                                           entry_token_name=self.token_name(self.entry_token.address),
-                                           arb_token_name=self.arb_token.name) \
-            if self.arguments.oasis_api_endpoint is not None else None
+        with open(self.arguments.config, 'r') as file:
+            config = json.load(file)
 
-        self.oasis = MatchingMarket(web3=self.web3, address=Address(self.arguments.oasis_address))
+        return config['pairs']
 
 
-        self.min_profit = Wad(int(self.arguments.min_profit * 10**18))
-        self.max_engagement = Wad(int(self.arguments.max_engagement * 10**18))
-        self.max_errors = self.arguments.max_errors
-        self.errors = 0
+    def create_pair(self, pair_config: dict) -> ArbitragePair:
+        """ Create an :py:class:`ArbitragePair`, registering the tokens, exchanges and Oasis order book it uses """
+        pair = ArbitragePair.from_config(pair_config, self.min_profit, self.max_engagement, self.token_name)
 
-        if self.arguments.tx_manager:
-            self.tx_manager = TxManager(web3=self.web3, address=Address(self.arguments.tx_manager))
-            if self.tx_manager.owner() != self.our_address:
-                raise Exception(f"The TxManager has to be owned by the address the keeper is operating from.")
-        else:
-            self.tx_manager = None
+        self.token_names.setdefault(pair.arb_token, pair.arb_token_name)
+        self.token_names.setdefault(pair.entry_token, pair.entry_token_name)
 
-        logging.basicConfig(format='%(asctime)-15s %(levelname)-8s %(message)s',
-                            level=(logging.DEBUG if self.arguments.debug else logging.INFO))
+        for token in [pair.entry_token, pair.arb_token]:
+            self.tokens.register(token, lambda token=token: ERC20Token(web3=self.web3, address=token))
+
+        for (token, exchange) in [(pair.entry_token, pair.uniswap_entry_exchange), (pair.arb_token, pair.uniswap_arb_exchange)]:
+            self.exchange_tokens.setdefault(exchange, token)
+            self.uniswap_exchanges.register(exchange, lambda token=token, exchange=exchange:
+                                            UniswapWrapper(self.web3, token, exchange))
+
+        if pair.book_key not in self.order_books:
+            if self.arguments.oasis_book_source == 'chain':
+                self.order_books[pair.book_key] = ChainOrderBook(market=self.oasis,
+                                                                 batch_reader=self.batch_reader,
+                                                                 entry_token=pair.entry_token,
+                                                                 arb_token=pair.arb_token,
+                                                                 entry_token_name=pair.entry_token_name,
+                                                                 arb_token_name=pair.arb_token_name,
+                                                                 resync_blocks=self.arguments.oasis_resync_blocks)
+            else:
+                self.order_books[pair.book_key] = OasisAPI(api_server=self.oasis_pool,
+                                                           entry_token_name=pair.entry_token_name,
+                                                           arb_token_name=pair.arb_token_name,
+                                                           max_staleness=self.arguments.oasis_max_staleness,
+                                                           session=self.oasis_session)
+
+        return pair
 
 
     def main(self):
@@ -167,10 +354,116 @@ class SimpleArbitrageKeeper:
             self.lifecycle = lifecycle
             lifecycle.on_startup(self.startup)
             lifecycle.on_block(self.process_block)
+            lifecycle.on_shutdown(self.shutdown)
 
 
     def startup(self):
+        """ Get ready to quote the next block, either warm from the state file or cold
+
+        A warm start restores the ledger from the state saved by the previous run, without any other call,
+        and verifies ownership, balances and allowances again in the background. A cold start does the same
+        verification before returning.
+        """
+        if self.metrics_server is not None:
+            self.metrics_server.start()
+
+        state = None
+        if self.warm_state is not None:
+            self.chain_id = int(self.web3.version.network)
+            state = self.warm_state.load(self.chain_id)
+
+        if state is not None:
+            self.warm_start = True
+            self.ledger.restore(*state)
+            submit_logged(self.bookkeeper, self.revalidate)
+            self.logger.info(f"Warm start from the state of block #{state[0]} in {self.arguments.state_file}, "
+                             f"verifying it in the background")
+        else:
+            self.verify()
+
+
+    def verify(self):
+        """ Check the TxManager ownership and seed the ledger with all our balances and allowances in one batch,
+        then approve what is missing and save the state for the next warm start """
+        block_number = self.web3.eth.blockNumber
+        batch = self.batch_reader.batch(block_number)
+        tx_manager_owner = batch.owner(self.tx_manager_address) if self.tx_manager_address else None
+        balances = self.ledger.queue_balances(batch)
+        allowances = self.queue_allowances(batch)
+        batch.execute()
+
+        if tx_manager_owner is not None and tx_manager_owner.value != self.our_address:
+            raise Exception(f"The TxManager has to be owned by the address the keeper is operating from.")
+
+        self.ledger.seed(block_number, balances, allowances)
         self.approve()
+        self.save_state()
+
+
+    def revalidate(self):
+        """ Verify the state a warm start has been made from, terminating the keeper if it no longer holds """
+        started = time.perf_counter()
+
+        try:
+            self.verify()
+            self.logger.info(f"Verified the warm start state in {time.perf_counter() - started:.1f}s")
+        except Exception as e:
+            self.logger.exception("Failed to verify the warm start state")
+            self.lifecycle.terminate(f"Warm start state could not be verified: {e}")
+
+
+    def state_contracts(self) -> dict:
+        """ Our address and all the contracts we use, identifying our entry in the state file """
+        return {'our_address': self.our_address.address,
+                'tx_manager': self.arguments.tx_manager,
+                'oasis': self.oasis_address.address,
+                'tokens': sorted(token.address for token in self.tokens),
+                'uniswap_exchanges': sorted([exchange.address, token.address] for exchange, token in self.exchange_tokens.items())}
+
+
+    def save_state(self):
+        """ Save the ledger to the state file, if any """
+        if self.warm_state is None or self.ledger.block_number is None:
+            return
+
+        try:
+            if self.chain_id is None:
+                self.chain_id = int(self.web3.version.network)
+
+            self.warm_state.save(self.chain_id, *self.ledger.state())
+        except Exception:
+            self.logger.exception(f"Failed to save the state to {self.arguments.state_file}")
+
+
+    def shutdown(self):
+        self.scheduler.stop()
+        self.submission_manager.stop()
+        self.bookkeeper.shutdown(wait=True)
+        self.save_state()
+        self.pnl.checkpoint()
+
+        if self.recorder is not None:
+            self.recorder.close()
+
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+
+
+    def queue_allowances(self, batch) -> dict:
+        """ Queue reads of every allowance `approve()` relies on, keyed by `(owner, token, spender)` """
+        token_owner = self.tx_manager_address if self.tx_manager_address else self.our_address
+
+        spenders = [(token, self.oasis_address) for token in self.tokens] + \
+                   [(token, exchange) for exchange, token in self.exchange_tokens.items()]
+        allowances = {(token_owner, token, spender): batch.allowance(token, token_owner, spender)
+                      for (token, spender) in spenders}
+
+        if self.tx_manager_address:
+            for token in self.tokens:
+                allowances[(self.our_address, token, self.tx_manager_address)] = \
+                    batch.allowance(token, self.our_address, self.tx_manager_address)
+
+        return allowances
 
 
     def approve(self):
@@ -180,193 +473,415 @@ class SimpleArbitrageKeeper:
         Approve Uniswap exchanges to access our tokens that they swap from our TxManager
         Approve TxManager to access our tokens from our ETH_FROM address
 
+        Allowances which are already set according to the ledger are skipped without any further call.
         """
-        approval_method = via_tx_manager(self.tx_manager, gas_price=self.gas_price()) if self.tx_manager \
-            else directly(gas_price=self.gas_price())
+        def missing(owner: Address, tokens: list, spender: Address) -> list:
+            return [self.tokens[token] for token in tokens
+                    if self.ledger.allowance(owner, token, spender) < self.APPROVED_ALLOWANCE]
 
-        self.oasis.approve([self.entry_token, self.arb_token], approval_method)
+        token_owner = self.tx_manager_address if self.tx_manager_address else self.our_address
+        approval_method = via_tx_manager(self.tx_manager, gas_price=self.gas_price()) if self.tx_manager_address \
+            else directly(gas_price=self.gas_price())
 
-        if self.uniswap_entry_exchange:
-            self.uniswap_entry_exchange.approve([self.entry_token], approval_method)
+        oasis_tokens = missing(token_owner, list(self.tokens), self.oasis_address)
+        if oasis_tokens:
+            self.oasis.approve(oasis_tokens, approval_method)
 
-        if self.uniswap_arb_exchange:
-            self.uniswap_arb_exchange.approve([self.arb_token], approval_method)
+        for exchange, token in self.exchange_tokens.items():
+            exchange_tokens = missing(token_owner, [token], exchange)
+            if exchange_tokens:
+                self.uniswap_exchanges[exchange].approve(exchange_tokens, approval_method)
 
-        if self.tx_manager:
-            self.tx_manager.approve([self.entry_token, self.arb_token], directly(gas_price=self.gas_price()))
+        if self.tx_manager_address:
+            tx_manager_tokens = missing(self.our_address, list(self.tokens), self.tx_manager_address)
+            if tx_manager_tokens:
+                self.tx_manager.approve(tx_manager_tokens, directly(gas_price=self.gas_price()))
 
 
     def token_name(self, address: Address) -> str:
-        if address == self.ksai.address:
-            return "SAI"
-        if address == self.kdai.address:
-            return "DAI"
+        if address in self.token_names:
+            return self.token_names[address]
+
+        return known_token_name(address)
+
+
+    @property
+    def oasis(self) -> MatchingMarket:
+        return self.contracts[self.oasis_address]
+
+
+    @property
+    def tx_manager(self) -> Optional[TxManager]:
+        return self.contracts[self.tx_manager_address] if self.tx_manager_address is not None else None
+
+
+    @BLOCK_HANDOFF.time
+    def process_block(self):
+        """Callback called on each new block. If too many errors, terminate the keeper to minimize potential damage.
+
+        The block is only handed over to the scheduler, which evaluates it on its own thread and skips it
+        if a newer block arrives first, so a slow block never delays the next one.
+        """
+        if self.errors >= self.max_errors:
+            self.lifecycle.terminate()
         else:
-            return str(address)
+            self.scheduler.on_block(self.web3.eth.blockNumber)
 
 
-    def oasis_order_size(self, size: Wad = None):
-        """ Calculate the an oasis order buy size when buying/selling the arb_token
+    def read_snapshot(self, block_number: int = None) -> MarketSnapshot:
+        """Read the market state all pairs are evaluated against, once per block.
 
-        Query's the Oasis REST API and, if a `size` is not supplied, calculates a total amount of arb_token to be purchased.
-        However, if size is supplied, it will calculate the total amount of entry_token that is purchased
+        The Uniswap reserves and the gas price are read in a single JSON-RPC batch pinned to `block_number`,
+        while the Oasis order books are fetched concurrently. Each of them is read only once however many
+        pairs share it. Our entry token balances come from the ledger, without any call.
 
         Args:
-            size: The size of the arb_token that will be sold
+            block_number: The number of the block being processed
 
         Returns:
-            A :py:class:`pymaker.numeric.Wad` instance of either a final entry_token amount to be bought
-            or a final arb_token amount to be bought
+            A :py:class:`MarketSnapshot` instance
         """
 
-        if self.oasis_api_endpoint is None:
-            return None
+        started = time.perf_counter()
 
-        (bids, asks) = self.oasis_api_endpoint.get_orders()
+        book_futures = {book_key: self.executor.submit(self._timed, order_book.get_snapshot, block_number)
+                        for book_key, order_book in self.order_books.items()}
 
-        entry_token_amount = 0
-        arb_token_amount = 0
+        batch = self.batch_reader.batch(block_number if block_number is not None else 'latest')
 
-        if size is None:
-            for order in asks:
-                entry_token_amount = entry_token_amount + order[0] * order[1]
-                arb_token_amount = arb_token_amount + order[1]
+        reserves_results = {address: queue_reserves(batch, token, address)
+                            for address, token in self.exchange_tokens.items()}
+        gas_price_result = batch.gas_price() if self.arguments.gas_price <= 0 else None
 
-                if entry_token_amount >= float(self.entry_amount):
-                    #some linear interpolation
-                    final_arb_token_amount = arb_token_amount - order[1] + \
-                        (float(self.entry_amount) - (entry_token_amount - order[0] * order[1])) * (1/order[0])
-                    return Wad(int(final_arb_token_amount*10**18))
+        (_, batch_latency) = self._timed(batch.execute)
+        CHAIN_STATE_BATCH.observe(batch_latency)
 
-        else:
-            for order in bids:
-                entry_token_amount = entry_token_amount + order[0] * order[1]
-                arb_token_amount = arb_token_amount + order[1]
+        balances = self.ledger.balances_of(set(pair.entry_token for pair in self.pairs))
+        reserves = {address: reserves_result() for address, reserves_result in reserves_results.items()}
+        if gas_price_result is not None:
+            self.cached_gas_price.cache(block_number, gas_price_result.value)
 
-                if arb_token_amount >= float(size):
-                    #some linear interpolation
-                    final_entry_token_amount = entry_token_amount - (order[0] * order[1]) + \
-                        (float(size) - (arb_token_amount - order[1])) * (order[0])
-                    return Wad(int(final_entry_token_amount*10**18))
+        (books, orders_latency) = self._collect(book_futures)
 
+        self.logger.debug(f"Block snapshot latencies: chain state batch of {len(batch)} calls {batch_latency*1000:.1f}ms, "
+                          f"oasis orders {orders_latency*1000:.1f}ms, total {(time.perf_counter() - started)*1000:.1f}ms")
 
-    def uniswap_order_size(self, size: Wad = None):
-        """ Calculate the an Uniswap buy size when buying/selling the arb_token
+        return MarketSnapshot(block_number=block_number,
+                              balances=balances,
+                              books=books,
+                              reserves=reserves,
+                              gas_price=self.cached_gas_price.get_gas_price(0),
+                              timestamp=time.time())
 
-        Reads the Uniswap entry, arb and eth exchange contracts, and if a `size` is not supplied,
-        calculates a total amount of arb_token to be purchased. However, if size is supplied,
-        it will calculate the total amount of entry_token that is purchased
 
-        Args:
-            size: The size of the arb_token that will be sold
+    @BLOCK_EVALUATION.time
+    def find_best_opportunity_available(self, block_number: int = None):
+        """Find the best arbitrage opportunities present and execute them.
 
-        Returns:
-            A :py:class:`pymaker.numeric.Wad` instance of either a final entry_token amount to be bought
-            or a final arb_token amount to be bought
+        For every pair, with an entry_token of up to entry_amount, calculate the profitability of buying
+        an arb_token on Oasis and selling it on Uniswap, and of the same operation but starting on Uniswap,
+        against a single :py:class:`MarketSnapshot` of the block.
+
+        With `--max-route-hops` above 2, the most profitable cycle of up to that many legs across all Oasis
+        markets and Uniswap exchanges is searched as well, and competes with the opportunities of the pairs.
+
+        Opportunities whose profit, net of gas, is beyond the minimum profit of their pair are dry-run
+        against the pending block while the other pairs are being quoted, and those still profitable are
+        printed and executed, most profitable first, skipping those competing for a balance or a market
+        already used. Execution happens on the scheduler submission thread, and the evaluation is abandoned
+        as soon as a newer block arrives.
+
+        Args:
+            block_number: The number of the block being processed, used to share the per-block snapshot
         """
-        if size is None:
-            ethAmt = self.uniswap_entry_exchange.uniswap_base.get_token_eth_input_price(self.entry_amount)
-            arbAmt = self.uniswap_arb_exchange.uniswap_base.get_eth_token_input_price(ethAmt)
-            return Wad(arbAmt)
-        else:
-            ethAmt = self.uniswap_arb_exchange.uniswap_base.get_token_eth_input_price(size)
-            entryAmt = self.uniswap_entry_exchange.uniswap_base.get_eth_token_input_price(ethAmt)
-            return Wad(entryAmt)
 
+        snapshot = self.read_snapshot(block_number)
+        self.latest_snapshot = snapshot
+        self.scheduler.check(block_number)
+        self.throttle()
 
-    def process_block(self):
-        """Callback called on each new block. If too many errors, terminate the keeper to minimize potential damage."""
-        if self.errors >= self.max_errors:
-            self.lifecycle.terminate()
-        else:
-            self.find_best_opportunity_available()
+        in_flight_resources = self.submission_manager.in_flight_resources()
+
+        quoting_started = time.perf_counter()
+        opportunities = []
+        simulations = {}
+
+        def consider(opportunity):
+            opportunities.append(opportunity)
+            if opportunity.is_profitable() and not (opportunity.pair.resources & in_flight_resources):
+                OPPORTUNITIES_SEEN.labels(opportunity.pair.name).inc()
+
+                if self.simulator is not None and self.tx_manager_address is not None:
+                    simulations[opportunity] = self.executor.submit(self.simulate, opportunity, snapshot)
+
+        for pair in self.pairs:
+            opportunity = pair.evaluate(snapshot, self.profit_curve_search, self.gas_model)
+
+            if opportunity is None:
+                self.logger.info(f"Neither Oasis nor Uniswap can fill a {pair.name} trade")
+                continue
+
+            #Print the highest profit/(loss) to see how close we come to breaking even
+            self.logger.info(f"Best trade regardless of profit/min-profit: {opportunity.profit} {self.token_name(pair.entry_token)} "
+                             f"from {opportunity.start_exchange_name} to {opportunity.end_exchange_name} "
+                             f"with {opportunity.entry_amount} {self.token_name(pair.entry_token)}, "
+                             f"{opportunity.net_profit} {self.token_name(pair.entry_token)} net of gas")
+            consider(opportunity)
+
+        self.logger.debug(f"Quoted {len(self.pairs)} pairs in {(time.perf_counter() - quoting_started)*1000:.1f}ms")
+
+        if self.route_search is not None:
+            search_started = time.perf_counter()
+            opportunity = self.route_search.search(snapshot, self.profit_curve_search, self.gas_model)
+            self.logger.debug(f"Searched cycles in {(time.perf_counter() - search_started)*1000:.1f}ms")
+
+            if opportunity is not None:
+                entry_token_name = self.token_name(opportunity.pair.entry_token)
+                self.logger.info(f"Best cycle regardless of profit/min-profit: {opportunity.profit} {entry_token_name} "
+                                 f"along {opportunity.pair.name} with {opportunity.entry_amount} {entry_token_name}, "
+                                 f"{opportunity.net_profit} {entry_token_name} net of gas")
+                consider(opportunity)
+
+        simulations = {opportunity: future.result() for opportunity, future in simulations.items()}
+        for simulation in simulations.values():
+            if not simulation.is_profitable():
+                OPPORTUNITIES_REJECTED.labels(simulation.opportunity.pair.name).inc()
+                self.logger.info(f"Not executing the {simulation.opportunity.pair.name} opportunity as it is no longer "
+                                 f"profitable at the pending block: " + (f"simulation reverted with {simulation.error}"
+                                 if not simulation.succeeded else f"{simulation.net_profit} net of gas"))
+
+        self.scheduler.check(block_number)
+        selected = select_opportunities([opportunity for opportunity in opportunities
+                                         if not (opportunity.pair.resources & in_flight_resources)
+                                         and (opportunity not in simulations or simulations[opportunity].is_profitable())])
+
+        if self.recorder is not None:
+            self.recorder.record(snapshot, opportunities, selected)
+
+        latency = self.scheduler.record_decision(block_number)
+        if latency is not None:
+            self.logger.debug(f"Decision for block #{block_number} made {latency*1000:.1f}ms after it arrived")
+
+        if self.first_quote_latency is None:
+            self.first_quote_latency = time.perf_counter() - self.started_at
+            TIME_TO_FIRST_QUOTE.labels('warm' if self.warm_start else 'cold').set(self.first_quote_latency)
+            self.logger.info(f"First decision made {self.first_quote_latency:.2f}s after a "
+                             f"{'warm' if self.warm_start else 'cold'} start")
+
+        current = {opportunity.pair: opportunity for opportunity in opportunities}
+
+        def still_profitable(pending_transaction) -> bool:
+            opportunity = current.get(pending_transaction.opportunity.pair)
+            if opportunity is None and isinstance(pending_transaction.opportunity, CycleOpportunity):
+                # only the best cycle is kept every block, so the one in flight is evaluated again on its own
+                cycle = pending_transaction.opportunity.pair
+                opportunity = RouteSearch.evaluate(cycle, snapshot, self.profit_curve_search, self.gas_model,
+                                                   Wad.min(snapshot.balance(cycle.entry_token), cycle.max_engagement))
+
+            return opportunity is not None and opportunity.is_profitable() \
+                and opportunity.route == pending_transaction.opportunity.route
+
+        if in_flight_resources:
+            self.scheduler.submit(self.submission_manager.on_block, block_number, still_profitable)
 
+        submit_logged(self.bookkeeper, self.ledger.update, block_number)
+        if self.pnl.checkpoint_due():
+            submit_logged(self.bookkeeper, self.pnl.checkpoint)
 
-    def find_best_opportunity_available(self):
-        """Find the best arbitrage opportunity present and execute it.
+        if selected:
+            self.scheduler.submit(self.execute_opportunities, selected, simulations, block_number)
 
-        With an entry_token of entry_amount, calculate the profitability of buying an arb_token
-        on Oasis and selling it on Uniswap. Calculate the profitability of the same operation
-        but starting on Uniswap. Depending on the comparison between these profitabilities,
-        assign the variables pertaining to start_exchange and end_exchange.
 
-        If the highestProfit is beyond the minimum profit as set by the user, print the opportunity
-        and attempt to execute it in one transaction
+    def throttle(self):
+        """ Scale the max engagement of the pairs (and cycles) entering with each token to its realized loss over the last hour
+
+        Nothing changes until the loss reaches `--throttle-hourly-loss`. From then on the max engagement is halved for
+        every multiple of that amount lost, and restored as the losing trades leave the window.
         """
+        if self.throttle_loss is None:
+            return
 
-        self.entry_amount = Wad.min(self.entry_token.balance_of(self.our_address), self.max_engagement)
+        hour = self.pnl.window('hour')
+        for pair, max_engagement in zip(self.pairs, self.max_engagements):
+            loss = Wad(0) - hour.profit(pair.entry_token)
+            steps = loss.value // self.throttle_loss.value if loss > Wad(0) else 0
 
-        oasis_arb_amount = self.oasis_order_size()
-        profit_oasis_to_uniswap = self.uniswap_order_size(oasis_arb_amount) - self.entry_amount
+            if steps != self.throttle_steps.get(pair.entry_token, 0):
+                self.throttle_steps[pair.entry_token] = steps
+                self.logger.warning(f"Realized loss over the last hour is {loss} {self.token_name(pair.entry_token)}, "
+                                    f"max engagement of the pairs entering with it divided by {2**steps}")
 
-        uniswap_arb_amount = self.uniswap_order_size()
-        profit_uniswap_to_oasis = self.oasis_order_size(uniswap_arb_amount) - self.entry_amount
+            pair.max_engagement = Wad(max_engagement.value >> steps)
 
-        if profit_oasis_to_uniswap > profit_uniswap_to_oasis:
-            self.start_exchange, self.start_exchange.name = self.oasis, 'Oasis'
-            self.arb_amount = oasis_arb_amount * Wad.from_number(0.999999)
-            self.end_exchange, self.end_exchange.name = self.uniswap_arb_exchange, 'Uniswap'
 
-        else:
-            self.start_exchange, self.start_exchange.name = self.uniswap_entry_exchange, 'Uniswap'
-            self.arb_amount = uniswap_arb_amount * Wad.from_number(0.999999)
-            self.end_exchange, self.end_exchange.name = self.oasis, 'Oasis'
+    def gas_cost(self, gas_spent: int, uniswap_entry_exchange: Address) -> Wad:
+        """ `gas_spent` (in Wei) in entry token terms, at the latest mid price of the Uniswap entry exchange """
+        if self.latest_snapshot is None or uniswap_entry_exchange not in self.latest_snapshot.reserves:
+            return Wad(0)
+
+        reserves = self.latest_snapshot.reserves_of(uniswap_entry_exchange)
+        return reserves.eth_value_in_tokens(Wad(gas_spent)) if reserves.eth_reserve > Wad(0) else Wad(0)
 
-        highestProfit = max(profit_oasis_to_uniswap, profit_uniswap_to_oasis)
-        self.exit_amount = (highestProfit + self.entry_amount) * Wad.from_number(0.999999)
 
-        #Print the highest profit/(loss) to see how close we come to breaking even
-        self.logger.info(f"Best trade regardless of profit/min-profit: {highestProfit} {self.token_name(self.entry_token.address)} "
-                         f"from {self.start_exchange.name} to {self.end_exchange.name}")
+    def simulate(self, opportunity: Opportunity, snapshot: MarketSnapshot) -> Simulation:
+        """Dry-run the transaction of `opportunity` against the pending block."""
+        return self.simulator.simulate(opportunity,
+                                       self.arbitrage_transaction(opportunity),
+                                       snapshot,
+                                       snapshot.gas_price)
 
-        opportunity = highestProfit if highestProfit > self.min_profit else None
 
-        if opportunity:
+    def execute_opportunities(self, opportunities: list, simulations: dict = None, block_number: int = None):
+        """Print and execute the selected opportunities, one transaction each."""
+        for opportunity in opportunities:
             self.print_opportunity(opportunity)
-            self.execute_opportunity_in_one_transaction()
+            self.execute_opportunity_in_one_transaction(opportunity, (simulations or {}).get(opportunity), block_number)
+
+
+    def _collect(self, futures: dict):
+        """Wait for futures of `_timed` calls, returns their results and the longest latency among them."""
+        results = {}
+        latency = 0.0
+
+        for key, future in futures.items():
+            (results[key], elapsed) = future.result()
+            latency = max(latency, elapsed)
+
+        return results, latency
+
+
+    @staticmethod
+    def _timed(function, *args):
+        """Call `function` and return its result together with the elapsed time in seconds."""
+        started = time.perf_counter()
+        result = function(*args)
+
+        return result, time.perf_counter() - started
 
 
+    def exchange(self, exchange_name: str, uniswap_exchange: Address):
+        """The exchange object to trade on, either Oasis or the Uniswap exchange at `uniswap_exchange`."""
+        return self.oasis if exchange_name == 'Oasis' else self.uniswap_exchanges[uniswap_exchange]
 
 
-    def print_opportunity(self, opportunity: Wad):
+    def print_opportunity(self, opportunity: Opportunity):
         """Print the details of the opportunity."""
-        self.logger.info(f"Profit opportunity of {opportunity} {self.token_name(self.entry_token.address)} "
-                         f"from {self.start_exchange.name} to {self.end_exchange.name}")
+        self.logger.info(f"Profit opportunity of {opportunity.net_profit} {self.token_name(opportunity.pair.entry_token)} "
+                         f"from {' to '.join(opportunity.route)}" +
+                         (f" along {opportunity.pair.name}" if isinstance(opportunity, CycleOpportunity) else ""))
 
 
-    def execute_opportunity_in_one_transaction(self):
-        """Execute the opportunity in one transaction, using the `tx_manager`.
+    def arbitrage_transaction(self, opportunity: Opportunity) -> Transact:
+        """Build the `tx_manager` transaction executing the opportunity.
 
         Sell entry_token and buy arb_token on start_exchange
         Sell arb_token and buy entry_token on end_exchange
 
         """
 
-        tokens = [self.entry_token.address, self.arb_token.address]
+        if isinstance(opportunity, CycleOpportunity):
+            return self.cycle_transaction(opportunity)
+
+        pair = opportunity.pair
+        start_exchange = self.exchange(opportunity.start_exchange_name, pair.uniswap_entry_exchange)
+        end_exchange = self.exchange(opportunity.end_exchange_name, pair.uniswap_arb_exchange)
+
+        tokens = [pair.entry_token, pair.arb_token]
+
+        invocations = [start_exchange.make(pay_token=pair.entry_token,
+                                           pay_amount=opportunity.entry_amount,
+                                           buy_token=pair.arb_token,
+                                           buy_amount=opportunity.arb_amount).invocation(),
+                       end_exchange.make(pay_token=pair.arb_token,
+                                         pay_amount=opportunity.arb_amount,
+                                         buy_token=pair.entry_token,
+                                         buy_amount=opportunity.exit_amount).invocation()]
+
+        return self.tx_manager.execute(tokens, invocations)
+
+
+    def cycle_transaction(self, opportunity: CycleOpportunity) -> Transact:
+        """Build the `tx_manager` transaction executing a cycle, one invocation per leg.
+
+        Every leg sells what the previous one bought, at least its minimum buy amount.
+        """
+
+        cycle = opportunity.pair
+        invocations = []
+        pay_amount = opportunity.entry_amount
+        for leg, buy_amount in zip(cycle.legs, opportunity.buy_amounts):
+            invocations.append(self.exchange(leg.exchange_name, leg.uniswap_exchange).make(pay_token=leg.pay_token,
+                                                                                         pay_amount=pay_amount,
+                                                                                         buy_token=leg.buy_token,
+                                                                                         buy_amount=buy_amount).invocation())
+            pay_amount = buy_amount
 
-        invocations = [self.start_exchange.make(pay_token=self.entry_token.address,
-                                               pay_amount=self.entry_amount,
-                                               buy_token=self.arb_token.address,
-                                               buy_amount=self.arb_amount).invocation(),
-                       self.end_exchange.make(pay_token=self.arb_token.address,
-                                               pay_amount=self.arb_amount,
-                                               buy_token=self.entry_token.address,
-                                               buy_amount=self.exit_amount).invocation()]
+        return self.tx_manager.execute(cycle.tokens, invocations)
 
-        receipt = self.tx_manager.execute(tokens, invocations).transact(gas_price=self.gas_price(), gas_buffer=300000)
 
-        if receipt:
-            self.logger.info(f"The profit we made is {TransferFormatter().format_net(receipt.transfers, self.our_address, self.token_name)}")
+    def execute_opportunity_in_one_transaction(self, opportunity: Opportunity, simulation: Simulation = None,
+                                               block_number: int = None):
+        """Send the opportunity in one transaction, using the `tx_manager`, without waiting for it to be mined.
+
+        The receipt is handled by `on_receipt` once the :py:class:`SubmissionManager` has collected it.
+        """
+
+        transact = self.arbitrage_transaction(opportunity)
+        pending_transaction = self.submission_manager.submit(opportunity, transact, block_number, simulation)
+
+        if pending_transaction is None:
+            self.errors += 1
+            OPPORTUNITIES_FAILED.labels(opportunity.pair.name).inc()
+
+
+    def on_receipt(self, pending_transaction: PendingTransaction, receipt: Optional[Receipt], cancellation: bool):
+        """Record a mined arbitrage transaction (or its cancellation, if that is what `cancellation` tells was mined) in
+        the PnL ledger, and log the realized profit next to the quoted one, and the simulated one if it was dry-run.
+
+        The keeper terminates if the realized profit in the entry token has fallen `--max-drawdown` below its highest.
+        """
+        opportunity = pending_transaction.opportunity
+        pair = opportunity.pair
+
+        if receipt is None:
+            self.logger.warning(f"Nonce of {pending_transaction} was used by another transaction")
+            return
+
+        self.ledger.apply_receipt(receipt)
+
+        gas_spent = receipt.gas_used * (pending_transaction.gas_price_of(receipt.transaction_hash) or 0)
+        receipt_outcome = outcome(receipt, cancellation)
+        nets = self.pnl.record(receipt, pair.entry_token, gas_spent, self.gas_cost(gas_spent, pair.uniswap_entry_exchange),
+                               receipt_outcome)
+
+        if receipt_outcome == CANCELLATION:
+            self.logger.info(f"Cancelled the {pair.name} transaction in {self.web3.toHex(receipt.transaction_hash)}")
+
+        elif receipt_outcome == TRADE:
+            simulation = pending_transaction.simulation
+            expected = f"quoted {opportunity.net_profit}" if simulation is None \
+                else f"quoted {opportunity.net_profit}, simulated {simulation.net_profit}"
+            self.logger.info(f"The profit we made is {format_amounts(nets, self.token_name)} "
+                             f"({expected} {self.token_name(pair.entry_token)} net of gas)")
+            self.gas_model.calibrate(opportunity.route, receipt.gas_used)
+            OPPORTUNITIES_TAKEN.labels(pair.name).inc()
+
         else:
+            self.logger.warning(f"The {pair.name} transaction {self.web3.toHex(receipt.transaction_hash)} failed")
             self.errors += 1
+            OPPORTUNITIES_FAILED.labels(pair.name).inc()
+
+        self.logger.info(self.pnl.summary(pair.entry_token, self.token_name))
+
+        if self.max_drawdown is not None and self.pnl.drawdown(pair.entry_token) >= self.max_drawdown:
+            self.pnl.checkpoint()
+            self.lifecycle.terminate(f"Realized profit in {self.token_name(pair.entry_token)} is "
+                                     f"{self.pnl.drawdown(pair.entry_token)} below its highest, beyond --max-drawdown")
 
 
     def gas_price(self):
-        """ FixedGasPrice if gas_price argument present, otherwise node DefaultGasPrice """
-        if self.arguments.gas_price > 0:
-            return FixedGasPrice(self.arguments.gas_price)
-        else:
-            return DefaultGasPrice()
+        """ Gas price argument if present, otherwise the node gas price cached for the current block """
+        return self.cached_gas_price
 
 
 if __name__ == '__main__':
@@ -0,0 +1,132 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import time
+from typing import Optional
+
+from pymaker import Address, Transact
+from pymaker.numeric import Wad
+
+from simple_arbitrage_keeper.arbitrage_pair import ArbitragePair, Opportunity
+from simple_arbitrage_keeper.gas_model import GasModel
+from simple_arbitrage_keeper.market_snapshot import MarketSnapshot
+from simple_arbitrage_keeper.metrics import SIMULATION
+from simple_arbitrage_keeper.rpc_batch import BatchReader
+from simple_arbitrage_keeper.uniswap import queue_reserves
+
+
+class Simulation:
+    """ Outcome of the dry run of an arbitrage transaction against the pending block
+
+    Attributes:
+        opportunity: The :py:class:`Opportunity` the transaction was built for
+        succeeded: Whether the transaction would have been executed without reverting
+        profit: Profit of the opportunity entry amount repriced against the pending Uniswap reserves
+        net_profit: `profit` net of the estimated gas cost
+        error: The error returned by the node if the transaction would revert
+        latency: Time taken by the simulation, in seconds
+    """
+
+    def __init__(self, opportunity: Opportunity, succeeded: bool, profit: Optional[Wad], net_profit: Optional[Wad],
+                 error: Optional[str], latency: float):
+        self.opportunity = opportunity
+        self.succeeded = succeeded
+        self.profit = profit
+        self.net_profit = net_profit
+        self.error = error
+        self.latency = latency
+
+    def is_profitable(self) -> bool:
+        return self.succeeded and self.net_profit is not None and self.net_profit > self.opportunity.pair.min_profit
+
+    def __repr__(self):
+        return f"Simulation({self.opportunity.pair.name} from {self.opportunity.start_exchange_name} to " \
+               f"{self.opportunity.end_exchange_name}, succeeded={self.succeeded}, net_profit={self.net_profit}, " \
+               f"error={self.error})"
+
+
+class BundleSimulator:
+    """ Dry-runs arbitrage transactions with `eth_call` at the pending block before they are submitted
+
+    The transaction is called from our address exactly as it would be sent, and the reserves of every
+    Uniswap exchange it trades on are read in the same JSON-RPC batch, so a single round trip tells both whether the bundle
+    would revert and what the opportunity is worth once the pending transactions are mined. `eth_call`
+    returns no logs, so the simulated profit is the opportunity repriced against the pending reserves
+    (Oasis legs are priced against the order books of the block), rather than decoded transfers.
+    """
+    logger = logging.getLogger()
+
+    def __init__(self, batch_reader: BatchReader, gas_model: GasModel, from_address: Address):
+        assert(isinstance(batch_reader, BatchReader))
+        assert(isinstance(gas_model, GasModel))
+        assert(isinstance(from_address, Address))
+
+        self.batch_reader = batch_reader
+        self.gas_model = gas_model
+        self.from_address = from_address
+
+    @staticmethod
+    def encode(transact: Transact) -> str:
+        """ Encode the call data of a pymaker :py:class:`pymaker.Transact` """
+        return transact.contract.encodeABI(fn_name=transact.function_name, args=transact.parameters)
+
+    def simulate(self, opportunity: Opportunity, transact: Transact, snapshot: MarketSnapshot,
+                 gas_price: Optional[int]) -> Simulation:
+        """ Dry-run `transact`, built for `opportunity` against `snapshot`, against the pending block
+
+        The pair of the opportunity (an :py:class:`ArbitragePair` or a :py:class:`Cycle`) tells which Uniswap
+        exchanges to read and reprices the opportunity through its `route_profit()`.
+        """
+        assert(isinstance(opportunity, Opportunity))
+        assert(isinstance(snapshot, MarketSnapshot))
+
+        started = time.perf_counter()
+        pair = opportunity.pair
+
+        batch = self.batch_reader.batch('pending')
+        call = batch.call(transact.address, self.encode(transact), lambda result: result, self.from_address)
+        reserves_results = {exchange: queue_reserves(batch, token, exchange)
+                            for (token, exchange) in pair.uniswap_markets}
+        error = None
+        try:
+            batch.execute()
+            error = call.error
+        except Exception as e:
+            error = e
+
+        profit = None
+        net_profit = None
+        if error is None:
+            reserves = dict(snapshot.reserves)
+            reserves.update({exchange: reserves_result() for exchange, reserves_result in reserves_results.items()})
+            pending = MarketSnapshot(snapshot.block_number, snapshot.balances, snapshot.books, reserves,
+                                     gas_price, snapshot.timestamp)
+
+            profit = pair.route_profit(opportunity.route, opportunity.entry_amount, pending)
+            if profit is not None:
+                net_profit = profit - ArbitragePair.gas_cost(self.gas_model, opportunity.route, gas_price,
+                                                             pending.reserves_of(pair.uniswap_entry_exchange))
+
+        latency = time.perf_counter() - started
+        SIMULATION.observe(latency)
+
+        simulation = Simulation(opportunity, error is None, profit, net_profit,
+                                str(error) if error is not None else None, latency)
+        self.logger.debug(f"{simulation} in {latency*1000:.1f}ms")
+
+        return simulation
@@ -0,0 +1,97 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Callable, Optional, Tuple
+
+INVERSE_GOLDEN_RATIO = (5 ** 0.5 - 1) / 2
+
+
+class ProfitCurveSearch:
+    """ Finds the trade size maximizing an arbitrage profit curve
+
+    The curve is first sampled on an evenly spaced grid between `low` and `high`, which guards against
+    the local maxima a partially consumed order book can produce, and the best grid bracket is then
+    narrowed down with a golden-section search. Sizes and profits are integers (i.e. `Wad` values), and a
+    profit function may return `None` for sizes which cannot be filled at all. A size of 0 trades nothing,
+    so it is never returned from a range with other sizes: when every size loses, the smallest loss is.
+
+    Attributes:
+        grid_points: Number of evenly spaced sizes sampled before the golden-section search
+        precision: Relative width (of the `high` bound) at which the golden-section search stops
+    """
+
+    def __init__(self, grid_points: int = 32, precision: float = 1e-6):
+        assert(isinstance(grid_points, int))
+        assert(grid_points >= 2)
+        assert(0 < precision < 1)
+
+        self.grid_points = grid_points
+        self.precision = precision
+
+    def search(self, profit_function: Callable[[int], Optional[int]], low: int, high: int) -> Tuple[int, Optional[int]]:
+        """ Returns the size between `low` and `high` with the highest profit, and that profit
+
+        Args:
+            profit_function: Function returning the profit (or `None` if unfillable) for a given size
+            low: The smallest size considered
+            high: The largest size considered
+
+        Returns:
+            A `(size, profit)` tuple; `profit` is `None` if no size in the range can be filled
+        """
+        assert(isinstance(low, int))
+        assert(isinstance(high, int))
+
+        evaluated = {}
+
+        def evaluate(size: int):
+            if size not in evaluated:
+                evaluated[size] = profit_function(size)
+            return evaluated[size]
+
+        if high <= low:
+            return low, evaluate(low)
+
+        low = max(low, 1)
+
+        step = (high - low) / (self.grid_points - 1)
+        grid = sorted(set([low + int(step * i) for i in range(self.grid_points - 1)] + [high]))
+
+        best_index = max(range(len(grid)), key=lambda i: self._key(evaluate(grid[i])))
+
+        left = grid[max(best_index - 1, 0)]
+        right = grid[min(best_index + 1, len(grid) - 1)]
+        tolerance = max(int((high - low) * self.precision), 1)
+
+        x1 = right - int((right - left) * INVERSE_GOLDEN_RATIO)
+        x2 = left + int((right - left) * INVERSE_GOLDEN_RATIO)
+        while right - left > tolerance and x1 < x2:
+            if self._key(evaluate(x1)) < self._key(evaluate(x2)):
+                left = x1
+                x1 = x2
+                x2 = left + int((right - left) * INVERSE_GOLDEN_RATIO)
+            else:
+                right = x2
+                x2 = x1
+                x1 = right - int((right - left) * INVERSE_GOLDEN_RATIO)
+
+        best_size = max(evaluated, key=lambda size: (self._key(evaluated[size]), -size))
+        return best_size, evaluated[best_size]
+
+    @staticmethod
+    def _key(profit: Optional[int]):
+        return (0, 0) if profit is None else (1, profit)
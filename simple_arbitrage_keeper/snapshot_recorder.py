@@ -0,0 +1,272 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import mmap
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from typing import Iterator, Tuple
+
+from simple_arbitrage_keeper.market_snapshot import MarketSnapshot
+
+# File layout: MAGIC, then one record per block. Each record is a RECORD_HEADER (length and CRC32 of the
+# payload, block number) followed by the zlib-compressed payload. A payload is a little-endian uint32 length,
+# the JSON metadata of that length, then the price/amount pairs of every order book level as little-endian
+# doubles, in the order of `books` in the metadata (bids first, then asks).
+MAGIC = b'SAKSNAP1'
+RECORD_HEADER = struct.Struct('<IIQ')
+METADATA_LENGTH = struct.Struct('<I')
+
+
+def _float64_array(values) -> array:
+    result = array('d', values)
+    if sys.byteorder != 'little':
+        result.byteswap()
+    return result
+
+
+def _opportunity_to_dict(opportunity, executed: bool) -> dict:
+    def wad(value):
+        return str(value.value) if value is not None else None
+
+    return {'pair': opportunity.pair.name,
+            'route': '/'.join(opportunity.route),
+            'entry_amount': wad(opportunity.entry_amount),
+            'profit': wad(opportunity.profit),
+            'net_profit': wad(opportunity.net_profit),
+            'profit_oasis_to_uniswap': wad(opportunity.profit_oasis_to_uniswap),
+            'profit_uniswap_to_oasis': wad(opportunity.profit_uniswap_to_oasis),
+            'executed': executed}
+
+
+def encode_record(snapshot: MarketSnapshot, opportunities: list, selected: list, compression_level: int = 6) -> bytes:
+    """ Encode the market state of one block, the opportunities found in it and the decision taken as one record """
+    data = snapshot.to_dict()
+
+    levels = []
+    for book in data['books']:
+        bids = book.pop('bids')
+        asks = book.pop('asks')
+        book['bid_levels'] = len(bids)
+        book['ask_levels'] = len(asks)
+        for level in bids + asks:
+            levels.append(level[0])
+            levels.append(level[1])
+
+    data['opportunities'] = [_opportunity_to_dict(opportunity, opportunity in selected) for opportunity in opportunities]
+
+    metadata = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    payload = zlib.compress(METADATA_LENGTH.pack(len(metadata)) + metadata + _float64_array(levels).tobytes(),
+                            compression_level)
+
+    block_number = snapshot.block_number if snapshot.block_number is not None else 0
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload), block_number) + payload
+
+
+def decode_payload(payload) -> dict:
+    """ Decode a compressed record payload back into a dictionary readable by `MarketSnapshot.from_dict` """
+    raw = zlib.decompress(payload)
+    (metadata_length,) = METADATA_LENGTH.unpack_from(raw, 0)
+    data = json.loads(raw[METADATA_LENGTH.size:METADATA_LENGTH.size + metadata_length].decode('utf-8'))
+
+    levels = array('d')
+    levels.frombytes(raw[METADATA_LENGTH.size + metadata_length:])
+    if sys.byteorder != 'little':
+        levels.byteswap()
+
+    position = 0
+    for book in data['books']:
+        for side in ['bids', 'asks']:
+            count = book.pop('bid_levels' if side == 'bids' else 'ask_levels')
+            book[side] = [[levels[position + 2*i], levels[position + 2*i + 1]] for i in range(count)]
+            position += 2 * count
+
+    return data
+
+
+class SnapshotFile:
+    """ Memory-mapped reader of a snapshot recording
+
+    Record headers can be scanned without decompressing anything, so finding a block in months of data
+    only touches the headers. A truncated last record (e.g. after a crash) is ignored.
+    """
+
+    def __init__(self, path: str):
+        self.file = open(path, 'rb')
+
+        if os.fstat(self.file.fileno()).st_size < len(MAGIC):
+            raise Exception(f"{path} is not a snapshot recording")
+
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            raise Exception(f"{path} is not a snapshot recording")
+
+    def offsets(self) -> Iterator[Tuple[int, int]]:
+        """ Yields the `(block_number, offset)` of every complete record """
+        offset = len(MAGIC)
+        while offset + RECORD_HEADER.size <= len(self.map):
+            (length, _, block_number) = RECORD_HEADER.unpack_from(self.map, offset)
+            if offset + RECORD_HEADER.size + length > len(self.map):
+                break
+
+            yield block_number, offset
+            offset += RECORD_HEADER.size + length
+
+    def valid_length(self) -> int:
+        """ Length of the recording up to the end of its last complete record with a valid CRC32
+
+        Records are checked in order and the first one failing its CRC32 ends the recording, as nothing
+        written after it can be trusted.
+        """
+        end = len(MAGIC)
+        for _, offset in self.offsets():
+            (length, crc, _) = RECORD_HEADER.unpack_from(self.map, offset)
+            if zlib.crc32(self.map[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]) != crc:
+                break
+
+            end = offset + RECORD_HEADER.size + length
+
+        return end
+
+    def __len__(self):
+        return len(self.map)
+
+    def read(self, offset: int) -> dict:
+        """ Decode the record at `offset`, checking its CRC32 """
+        (length, crc, _) = RECORD_HEADER.unpack_from(self.map, offset)
+        payload = self.map[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+        if zlib.crc32(payload) != crc:
+            raise Exception(f"Corrupted snapshot record at offset {offset}")
+
+        return decode_payload(payload)
+
+    def __iter__(self) -> Iterator[dict]:
+        for _, offset in self.offsets():
+            yield self.read(offset)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def is_snapshot_recording(path: str) -> bool:
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+class SnapshotRecorder:
+    """ Appends the market state of every block, and the decision taken, to a snapshot recording
+
+    `record` only puts the objects on a queue; encoding, compression and writing all happen on a
+    background thread, so recording never delays the block callback. If the writer falls behind by
+    more than `queue_size` blocks, new blocks are dropped (and counted) rather than waited for.
+
+    An existing recording is appended to, after truncating any torn or corrupted tail left by a crash
+    so that new records are not written after bytes no reader can get past.
+    """
+    logger = logging.getLogger()
+
+    def __init__(self, path: str, queue_size: int = 1000, compression_level: int = 6, flush_interval: float = 5.0):
+        assert(isinstance(path, str))
+
+        self.path = path
+        self.compression_level = compression_level
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.recorded = 0
+
+        self._truncate_torn_tail()
+
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+            self.file.flush()
+
+        self.writer = threading.Thread(target=self._run, name='snapshot-recorder', daemon=True)
+        self.writer.start()
+
+    def _truncate_torn_tail(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return
+
+        # a crash while writing the magic of a new recording
+        if os.path.getsize(self.path) < len(MAGIC):
+            with open(self.path, 'rb') as file:
+                if MAGIC.startswith(file.read()):
+                    os.truncate(self.path, 0)
+                    return
+
+        with SnapshotFile(self.path) as recording:
+            size = len(recording)
+            valid_length = recording.valid_length()
+
+        if valid_length < size:
+            self.logger.warning(f"Truncating {size - valid_length} bytes of torn or corrupted records "
+                                f"at the end of {self.path}")
+            os.truncate(self.path, valid_length)
+
+    def record(self, snapshot: MarketSnapshot, opportunities: list, selected: list):
+        try:
+            self.queue.put_nowait((snapshot, list(opportunities), list(selected)))
+        except queue.Full:
+            self.dropped += 1
+            self.logger.warning(f"Snapshot recorder is falling behind, dropped block #{snapshot.block_number} "
+                                f"({self.dropped} dropped so far)")
+
+    def close(self):
+        """ Write all queued blocks and close the recording """
+        self.queue.put(None)
+        self.writer.join()
+        self.file.close()
+
+    def _run(self):
+        last_flush = time.time()
+
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = False
+
+            if item is None:
+                self.file.flush()
+                return
+
+            if item:
+                try:
+                    self.file.write(encode_record(*item, compression_level=self.compression_level))
+                    self.recorded += 1
+                except Exception:
+                    self.logger.exception(f"Failed to record block #{item[0].block_number}")
+
+            if time.time() - last_flush >= self.flush_interval:
+                self.file.flush()
+                last_flush = time.time()
@@ -0,0 +1,339 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import math
+import threading
+import time
+from typing import Callable, Optional
+
+from web3 import Web3
+
+from pymaker import Address, Receipt, Transact
+from pymaker.gas import GasPrice
+
+from simple_arbitrage_keeper.metrics import CANCELLATIONS, EXECUTION, IN_FLIGHT, REPLACEMENTS
+
+
+def hash_to_hex(transaction_hash) -> str:
+    """ A transaction hash, as returned by pymaker or as found in a receipt, as a lowercase hex string """
+    return transaction_hash.lower() if isinstance(transaction_hash, str) else '0x' + bytes(transaction_hash).hex()
+
+
+class PendingTransaction:
+    """ An arbitrage transaction sent and not mined yet, with all the transactions sent with its nonce
+
+    Attributes:
+        opportunity: The :py:class:`Opportunity` the transaction executes
+        simulation: The :py:class:`Simulation` of the transaction, if it was dry-run
+        transact: The :py:class:`pymaker.Transact` of the arbitrage transaction
+        nonce: The nonce of the transaction and of all its replacements
+        gas: The gas limit of the arbitrage transaction
+        gas_price: The gas price of the latest transaction sent with `nonce`
+        transaction_hashes: Hashes of the arbitrage transactions sent with `nonce`, the latest last
+        cancellation_hashes: Hashes of the cancellations sent with `nonce`, the latest last
+        gas_prices: Gas price of every transaction sent with `nonce`, keyed by its hash
+        block_number: The block the latest transaction was sent at
+        sent_at: Time the first transaction was sent at
+        cancelled: Whether a cancellation has been sent with `nonce`
+    """
+
+    def __init__(self, opportunity, simulation, transact: Transact, nonce: int, gas: int, block_number: int):
+        self.opportunity = opportunity
+        self.simulation = simulation
+        self.transact = transact
+        self.nonce = nonce
+        self.gas = gas
+        self.gas_price = None
+        self.transaction_hashes = []
+        self.cancellation_hashes = []
+        self.gas_prices = {}
+        self.block_number = block_number
+        self.sent_at = time.time()
+        self.cancelled = False
+
+    @property
+    def resources(self) -> set:
+        return self.opportunity.pair.resources
+
+    def is_cancellation(self, transaction_hash) -> bool:
+        """ Whether `transaction_hash` is one of the cancellations sent with `nonce` """
+        return hash_to_hex(transaction_hash) in self.cancellation_hashes
+
+    def gas_price_of(self, transaction_hash) -> Optional[int]:
+        """ The gas price `transaction_hash` was sent with, if it was sent with `nonce` """
+        return self.gas_prices.get(hash_to_hex(transaction_hash))
+
+    def __repr__(self):
+        return f"PendingTransaction({self.opportunity.pair.name}, nonce={self.nonce}, gas_price={self.gas_price}, " \
+               f"sent={len(self.transaction_hashes)}, cancellations={len(self.cancellation_hashes)})"
+
+
+class SubmissionManager:
+    """ Sends arbitrage transactions without waiting for them to be mined
+
+    Nonces are allocated locally, so several transactions can be in flight at once; the lock is only held to
+    reserve a nonce and to update the transactions in flight, never while waiting for the node. Every block,
+    in-flight transactions which have not been mined for `replace_after_blocks` blocks are sent again with the
+    same nonce and a gas price higher by `gas_price_increase`, and those whose opportunity has disappeared are
+    cancelled by replacing them with a zero-value transfer to ourselves. A cancellation which cannot be sent
+    is tried again on the next block, and the arbitrage transaction is kept as it is, as it may still be mined.
+
+    Receipts are collected on a background thread and handed over to
+    `on_receipt(pending_transaction, receipt, cancellation)`, with a :py:class:`pymaker.Receipt` (or None if
+    the nonce was used by a transaction we do not know about) and whether the transaction mined was one of the
+    cancellations, as an arbitrage transaction can still be mined after its cancellation has been sent.
+    """
+    logger = logging.getLogger()
+
+    CANCELLATION_GAS = 21000
+    MIN_REPLACEMENT_INCREASE = 1.1
+
+    def __init__(self, web3: Web3, from_address: Address, gas_price: GasPrice, on_receipt: Callable,
+                 gas_buffer: int = 300000, replace_after_blocks: int = 3, gas_price_increase: float = 1.125,
+                 max_gas_price: int = 0, poll_interval: float = 1.0):
+        assert(isinstance(from_address, Address))
+        assert(isinstance(gas_price, GasPrice))
+        assert(callable(on_receipt))
+        assert(gas_price_increase > self.MIN_REPLACEMENT_INCREASE)
+
+        self.web3 = web3
+        self.from_address = from_address
+        self.gas_price = gas_price
+        self.on_receipt = on_receipt
+        self.gas_buffer = gas_buffer
+        self.replace_after_blocks = replace_after_blocks
+        self.gas_price_increase = gas_price_increase
+        self.max_gas_price = max_gas_price if max_gas_price > 0 else None
+        self.poll_interval = poll_interval
+
+        self.next_nonce = None
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.running = True
+
+        IN_FLIGHT.set_function(lambda: len(self.pending))
+
+        self.poller = threading.Thread(target=self._run, name='receipt-poller', daemon=True)
+        self.poller.start()
+
+    def in_flight(self) -> list:
+        with self.lock:
+            return list(self.pending.values())
+
+    def in_flight_resources(self) -> set:
+        """ Balances and markets used by the transactions in flight, see :py:attr:`ArbitragePair.resources` """
+        resources = set()
+        for pending_transaction in self.in_flight():
+            resources |= pending_transaction.resources
+
+        return resources
+
+    def submit(self, opportunity, transact: Transact, block_number: Optional[int], simulation=None) -> Optional[PendingTransaction]:
+        """ Send `transact`, returns as soon as it has been accepted by the node
+
+        Returns:
+            The :py:class:`PendingTransaction`, or None if the transaction could not be sent
+        """
+        try:
+            gas = transact.estimated_gas(self.from_address)
+        except Exception as e:
+            self.logger.warning(f"Not sending the {opportunity.pair.name} transaction as its gas estimation failed: {e}")
+            return None
+
+        try:
+            gas_price = self._initial_gas_price()
+            nonce = self._reserve_nonce()
+        except Exception as e:
+            self.logger.warning(f"Not sending the {opportunity.pair.name} transaction as its nonce or gas price "
+                                f"could not be read: {e}")
+            return None
+
+        # in flight from now on, so that its balances and markets are not used by another transaction meanwhile
+        pending_transaction = PendingTransaction(opportunity, simulation, transact, nonce, gas + self.gas_buffer, block_number)
+        with self.lock:
+            self.pending[nonce] = pending_transaction
+
+        transaction_hash = self._send(pending_transaction, transact, pending_transaction.gas, gas_price)
+        with self.lock:
+            if transaction_hash is None:
+                self.pending.pop(nonce, None)
+                self.next_nonce = None
+                return None
+
+            self._sent(pending_transaction, transaction_hash, gas_price, pending_transaction.transaction_hashes)
+
+        return pending_transaction
+
+    def on_block(self, block_number: int, still_profitable: Callable):
+        """ Replace the transactions in flight stuck for too long, cancel those no longer profitable
+
+        Args:
+            block_number: The number of the new block
+            still_profitable: Tells whether the opportunity of a :py:class:`PendingTransaction` is still there
+        """
+        for pending_transaction in self.in_flight():
+            if pending_transaction.gas_price is None:
+                continue
+
+            if pending_transaction.cancelled:
+                if block_number - pending_transaction.block_number >= self.replace_after_blocks:
+                    self._replace(pending_transaction, block_number, cancel=True)
+
+            elif not still_profitable(pending_transaction):
+                self._replace(pending_transaction, block_number, cancel=True)
+
+            elif block_number - pending_transaction.block_number >= self.replace_after_blocks:
+                self._replace(pending_transaction, block_number, cancel=False)
+
+    def stop(self):
+        """ Stop collecting receipts; transactions still in flight are left to be mined """
+        self.running = False
+        self.poller.join()
+
+        for pending_transaction in self.in_flight():
+            self.logger.warning(f"Transaction {pending_transaction} still in flight at shutdown")
+
+    def _initial_gas_price(self) -> int:
+        gas_price = self.gas_price.get_gas_price(0)
+        return gas_price if gas_price is not None else self.web3.eth.gasPrice
+
+    def _reserve_nonce(self) -> int:
+        with self.lock:
+            next_nonce = self.next_nonce
+
+        if next_nonce is None:
+            next_nonce = self.web3.eth.getTransactionCount(self.from_address.address, 'pending')
+
+        with self.lock:
+            if self.next_nonce is None:
+                self.next_nonce = next_nonce
+
+            nonce = self.next_nonce
+            self.next_nonce += 1
+            return nonce
+
+    def _replace(self, pending_transaction: PendingTransaction, block_number: int, cancel: bool):
+        gas_price = int(math.ceil(pending_transaction.gas_price * self.gas_price_increase))
+        if self.max_gas_price is not None and gas_price > self.max_gas_price:
+            if not cancel:
+                return
+
+            if self.max_gas_price < pending_transaction.gas_price * self.MIN_REPLACEMENT_INCREASE:
+                self.logger.info(f"Not cancelling {pending_transaction}, as --max-gas-price {self.max_gas_price} is less than "
+                                 f"the {self.MIN_REPLACEMENT_INCREASE}x increase over {pending_transaction.gas_price} "
+                                 f"the node requires to replace it")
+                return
+
+            gas_price = self.max_gas_price
+
+        with self.lock:
+            if pending_transaction.nonce not in self.pending:
+                return
+
+        if cancel:
+            if not pending_transaction.cancelled:
+                self.logger.info(f"Cancelling {pending_transaction} as its opportunity has disappeared")
+
+            transact = Transact(self, self.web3, None, self.from_address, None, None, [])
+            transaction_hash = self._send(pending_transaction, transact, self.CANCELLATION_GAS, gas_price)
+        else:
+            self.logger.info(f"Replacing {pending_transaction}, not mined after "
+                             f"{block_number - pending_transaction.block_number} blocks, with gas price {gas_price}")
+            transaction_hash = self._send(pending_transaction, pending_transaction.transact, pending_transaction.gas, gas_price)
+
+        if transaction_hash is None:
+            return
+
+        with self.lock:
+            if cancel:
+                if not pending_transaction.cancelled:
+                    CANCELLATIONS.inc()
+                pending_transaction.cancelled = True
+                self._sent(pending_transaction, transaction_hash, gas_price, pending_transaction.cancellation_hashes)
+            else:
+                REPLACEMENTS.inc()
+                self._sent(pending_transaction, transaction_hash, gas_price, pending_transaction.transaction_hashes)
+
+            pending_transaction.block_number = block_number
+
+    def _send(self, pending_transaction: PendingTransaction, transact: Transact, gas: int, gas_price: int) -> Optional[str]:
+        """ Sign and send `transact` with the nonce of `pending_transaction`, returns its hash or None if it failed
+
+        `Transact._func` is the pymaker method sending a transaction without waiting for it to be mined, and
+        is used here as the replacement of a transaction is handled by the manager, not by pymaker.
+        """
+        try:
+            transaction_hash = transact._func(self.from_address.address, gas, gas_price, pending_transaction.nonce)
+        except Exception as e:
+            self.logger.warning(f"Failed to send {pending_transaction} with gas price {gas_price}: {e}")
+            return None
+
+        self.logger.info(f"Sent transaction {transaction_hash} with nonce {pending_transaction.nonce} "
+                         f"and gas price {gas_price}")
+        return transaction_hash
+
+    @staticmethod
+    def _sent(pending_transaction: PendingTransaction, transaction_hash: str, gas_price: int, hashes: list):
+        pending_transaction.gas_price = gas_price
+        pending_transaction.gas_prices[hash_to_hex(transaction_hash)] = gas_price
+        hashes.append(hash_to_hex(transaction_hash))
+
+    def _run(self):
+        while self.running:
+            time.sleep(self.poll_interval)
+
+            try:
+                self._poll()
+            except Exception:
+                self.logger.exception("Failed to collect transaction receipts")
+
+    def _poll(self):
+        pending_transactions = self.in_flight()
+        if not pending_transactions:
+            return
+
+        mined_nonce = None
+        for pending_transaction in pending_transactions:
+            receipt = None
+            with self.lock:
+                transaction_hashes = pending_transaction.transaction_hashes + pending_transaction.cancellation_hashes
+
+            # only one of the transactions sent with the nonce can be mined
+            for transaction_hash in transaction_hashes:
+                receipt = self.web3.eth.getTransactionReceipt(transaction_hash)
+                if receipt is not None:
+                    break
+
+            if receipt is None:
+                # The nonce may have been used by a transaction sent from outside the keeper
+                if mined_nonce is None:
+                    mined_nonce = self.web3.eth.getTransactionCount(self.from_address.address, 'latest')
+                if mined_nonce <= pending_transaction.nonce or not transaction_hashes:
+                    continue
+
+            with self.lock:
+                self.pending.pop(pending_transaction.nonce, None)
+                if receipt is None:
+                    self.next_nonce = None
+
+            EXECUTION.observe(time.time() - pending_transaction.sent_at)
+            if receipt is None:
+                self.on_receipt(pending_transaction, None, False)
+            else:
+                receipt = Receipt(receipt)
+                self.on_receipt(pending_transaction, receipt, pending_transaction.is_cancellation(receipt.transaction_hash))
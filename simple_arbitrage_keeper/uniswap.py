@@ -2,10 +2,85 @@ from pymaker import Transact, Address
 from pyexchange.uniswap import Uniswap
 
 from web3 import Web3
-from typing import List
+from typing import Callable, List
 from pymaker.token import ERC20Token
 from pymaker.numeric import Wad
 
+from simple_arbitrage_keeper.rpc_batch import ReadBatch
+
+
+
+def get_input_price(input_amount: int, input_reserve: int, output_reserve: int) -> int:
+    """ Uniswap V1 `getInputPrice`: the amount bought when selling exactly `input_amount`, net of the 0.3% fee
+
+    Uses the same integer arithmetic as the exchange contract, so the result matches it to the wei.
+    """
+    assert(input_reserve > 0 and output_reserve > 0)
+
+    input_amount_with_fee = input_amount * 997
+    numerator = input_amount_with_fee * output_reserve
+    denominator = input_reserve * 1000 + input_amount_with_fee
+    return numerator // denominator
+
+
+def get_output_price(output_amount: int, input_reserve: int, output_reserve: int) -> int:
+    """ Uniswap V1 `getOutputPrice`: the amount to sell in order to buy exactly `output_amount`, including the 0.3% fee """
+    assert(input_reserve > 0 and output_reserve > 0)
+    assert(output_amount < output_reserve)
+
+    numerator = input_reserve * output_amount * 1000
+    denominator = (output_reserve - output_amount) * 997
+    return numerator // denominator + 1
+
+
+class UniswapReserves:
+    """ Token and ETH reserves of a Uniswap V1 exchange at a given block, used to price trades locally
+
+    Attributes:
+        token_reserve: Token balance of the exchange contract
+        eth_reserve: ETH balance of the exchange contract
+    """
+    def __init__(self, token_reserve: Wad, eth_reserve: Wad):
+        assert(isinstance(token_reserve, Wad))
+        assert(isinstance(eth_reserve, Wad))
+
+        self.token_reserve = token_reserve
+        self.eth_reserve = eth_reserve
+
+    def token_to_eth_input_price(self, tokens_sold: Wad) -> Wad:
+        """ Equivalent of the exchange `getTokenToEthInputPrice` call """
+        return Wad(get_input_price(tokens_sold.value, self.token_reserve.value, self.eth_reserve.value))
+
+    def eth_to_token_input_price(self, eth_sold: Wad) -> Wad:
+        """ Equivalent of the exchange `getEthToTokenInputPrice` call """
+        return Wad(get_input_price(eth_sold.value, self.eth_reserve.value, self.token_reserve.value))
+
+    def token_to_eth_output_price(self, eth_bought: Wad) -> Wad:
+        """ Equivalent of the exchange `getTokenToEthOutputPrice` call """
+        return Wad(get_output_price(eth_bought.value, self.token_reserve.value, self.eth_reserve.value))
+
+    def eth_to_token_output_price(self, tokens_bought: Wad) -> Wad:
+        """ Equivalent of the exchange `getEthToTokenOutputPrice` call """
+        return Wad(get_output_price(tokens_bought.value, self.eth_reserve.value, self.token_reserve.value))
+
+    def eth_value_in_tokens(self, eth_amount: Wad) -> Wad:
+        """ Value of `eth_amount` in tokens at the exchange mid price, i.e. without fee or slippage """
+        return Wad(eth_amount.value * self.token_reserve.value // self.eth_reserve.value)
+
+    def __repr__(self):
+        return f"UniswapReserves(token_reserve={self.token_reserve}, eth_reserve={self.eth_reserve})"
+
+
+def queue_reserves(batch: ReadBatch, token: Address, exchange: Address) -> Callable[[], UniswapReserves]:
+    """ Queue the reads of the token and ETH reserves of `exchange` on `batch`
+
+    Returns:
+        A function returning the :py:class:`UniswapReserves` once `batch` has been executed.
+    """
+    token_reserve = batch.balance_of(token, exchange)
+    eth_reserve = batch.eth_balance(exchange)
+
+    return lambda: UniswapReserves(Wad(token_reserve.value), Wad(eth_reserve.value))
 
 
 class UniswapWrapper:
@@ -13,6 +88,7 @@ class UniswapWrapper:
     def __init__(self, web3: Web3, token: Address, exchange: Address):
 
         self.uniswap_base = Uniswap(web3, token, exchange)
+        self.token = ERC20Token(web3=web3, address=token)
         self.address = exchange
 
     def approve(self, tokens: List[ERC20Token], approval_function):
@@ -0,0 +1,149 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections.abc import Mapping
+from typing import Callable, Optional
+
+from pymaker import Address
+
+
+class LazyContracts(Mapping):
+    """ Contract objects keyed by address, each constructed the first time it is looked up
+
+    Listing the addresses, or checking whether one is registered, never constructs anything.
+    """
+
+    def __init__(self):
+        self.factories = {}
+        self.contracts = {}
+        self.lock = threading.Lock()
+
+    def register(self, address: Address, factory: Callable):
+        """ Register the `factory` building the contract at `address`, unless one is registered already """
+        self.factories.setdefault(address, factory)
+
+    def __getitem__(self, address: Address):
+        contract = self.contracts.get(address)
+        if contract is None:
+            with self.lock:
+                if address not in self.contracts:
+                    self.contracts[address] = self.factories[address]()
+                contract = self.contracts[address]
+
+        return contract
+
+    def __contains__(self, address) -> bool:
+        return address in self.factories
+
+    def __iter__(self):
+        return iter(self.factories)
+
+    def __len__(self):
+        return len(self.factories)
+
+
+class WarmState:
+    """ Ownership, approvals and balances verified by a previous run, persisted for the next one to start warm
+
+    The file holds one entry per chain and set of contracts, so the same file can be shared by keepers
+    running against different chains or configurations. An entry is only saved once the TxManager
+    ownership has been verified and the allowances read (or approved), and only loaded by a keeper with
+    exactly the same chain ID, address and contracts. The state loaded is trusted to quote the first
+    blocks only: it is expected to be revalidated in the background straight after startup.
+
+    Attributes:
+        path: The JSON file the state is kept in
+        contracts: Our address and the addresses of all the contracts we use, identifying the entry
+    """
+    logger = logging.getLogger()
+
+    VERSION = 1
+
+    def __init__(self, path: str, contracts: dict):
+        assert(isinstance(path, str))
+        assert(isinstance(contracts, dict))
+
+        self.path = path
+        self.contracts = contracts
+
+    def key(self, chain_id: int) -> str:
+        fingerprint = hashlib.sha256(json.dumps(self.contracts, sort_keys=True).encode('utf-8')).hexdigest()
+        return f"{chain_id}:{fingerprint[:16]}"
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, 'r') as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return {'version': self.VERSION, 'entries': {}}
+
+        if data.get('version') != self.VERSION:
+            return {'version': self.VERSION, 'entries': {}}
+
+        return data
+
+    def load(self, chain_id: int) -> Optional[tuple]:
+        """ The state saved for `chain_id` and our contracts
+
+        Returns:
+            A `(block_number, balances, allowances)` tuple ready for :py:meth:`BalanceLedger.restore`, or None
+            if nothing usable was saved
+        """
+        try:
+            entry = self._read()['entries'].get(self.key(chain_id))
+        except Exception as e:
+            self.logger.warning(f"Ignoring the state file {self.path} which cannot be read: {e}")
+            return None
+
+        if entry is None or entry['contracts'] != self.contracts:
+            return None
+
+        balances = {Address(token): int(balance) for token, balance in entry['balances'].items()}
+        allowances = {(Address(owner), Address(token), Address(spender)): int(allowance)
+                      for (owner, token, spender, allowance) in entry['allowances']}
+
+        return entry['block_number'], balances, allowances
+
+    def save(self, chain_id: int, block_number: int, balances: dict, allowances: dict):
+        """ Save the balances and allowances known at `block_number`, replacing the file atomically """
+        try:
+            data = self._read()
+        except Exception:
+            data = {'version': self.VERSION, 'entries': {}}
+
+        data['entries'][self.key(chain_id)] = {
+            'chain_id': chain_id,
+            'contracts': self.contracts,
+            'block_number': block_number,
+            'saved_at': time.time(),
+            'balances': {token.address: str(balance) for token, balance in balances.items()},
+            'allowances': [[owner.address, token.address, spender.address, str(allowance)]
+                           for (owner, token, spender), allowance in allowances.items()]
+        }
+
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, 'w') as file:
+            json.dump(data, file, indent=2)
+        os.replace(temporary_path, self.path)
+
+        self.logger.debug(f"Saved the state of block #{block_number} to {self.path}")
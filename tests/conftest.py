@@ -0,0 +1,26 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+
+# same module path as `bin/simple-arbitrage-keeper`
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for submodule in ['lib/pymaker', 'lib/pyexchange']:
+    path = os.path.join(root, submodule)
+    if path not in sys.path:
+        sys.path.append(path)
@@ -0,0 +1,124 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test doubles of a node and of pymaker transactions, for the code sending transactions and collecting receipts."""
+
+import itertools
+import threading
+from types import SimpleNamespace
+
+from pymaker import Address
+
+
+class FakeEth:
+    def __init__(self, node):
+        self.node = node
+
+    @property
+    def gasPrice(self) -> int:
+        return self.node.gas_price
+
+    def getTransactionCount(self, address: str, block_identifier: str) -> int:
+        self.node.calls.append(('getTransactionCount', block_identifier))
+        return self.node.pending_nonce if block_identifier == 'pending' else self.node.mined_nonce
+
+    def getTransactionReceipt(self, transaction_hash: str):
+        return self.node.receipts.get(transaction_hash)
+
+
+class FakeNode:
+    """ A web3 double keeping the transactions sent to it, and mining any of them on demand
+
+    Attributes:
+        sent: Every transaction accepted, as a dictionary with its hash
+        reject: Number of the next transactions to reject
+        on_send: Called with every transaction before it is accepted or rejected
+    """
+
+    def __init__(self, gas_price: int = 10**9, pending_nonce: int = 0):
+        self.eth = FakeEth(self)
+        self.gas_price = gas_price
+        self.pending_nonce = pending_nonce
+        self.mined_nonce = pending_nonce
+        self.receipts = {}
+        self.sent = []
+        self.calls = []
+        self.reject = 0
+        self.on_send = None
+        self.hashes = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def send(self, transaction: dict) -> str:
+        if self.on_send is not None:
+            self.on_send(transaction)
+
+        with self.lock:
+            if self.reject > 0:
+                self.reject -= 1
+                raise Exception('replacement transaction underpriced')
+
+            transaction_hash = '0x' + hex(next(self.hashes))[2:].rjust(64, '0')
+            self.sent.append(dict(transaction, hash=transaction_hash))
+            self.pending_nonce = max(self.pending_nonce, transaction['nonce'] + 1)
+            return transaction_hash
+
+    def mine(self, transaction_hash: str, gas_used: int = 21000, status: int = 1, transfers: list = None):
+        """ Mine a transaction sent before; its receipt carries its hash as bytes, as web3 returns it """
+        transaction = next(transaction for transaction in self.sent if transaction['hash'] == transaction_hash)
+        self.receipts[transaction_hash] = {'transactionHash': bytes.fromhex(transaction_hash[2:]),
+                                           'gasUsed': gas_used,
+                                           'status': status,
+                                           'logs': [],
+                                           'transfers': transfers or []}
+        self.mined_nonce = max(self.mined_nonce, transaction['nonce'] + 1)
+
+
+class FakeTransact:
+    """ A :py:class:`pymaker.Transact` double sending to a :py:class:`FakeNode`, with the same constructor """
+
+    def __init__(self, origin, web3: FakeNode, abi, address: Address, contract, function_name, parameters: list,
+                 gas: int = 150000):
+        self.web3 = web3
+        self.address = address
+        self.function_name = function_name
+        self.parameters = parameters
+        self.gas = gas
+
+    def estimated_gas(self, from_address: Address) -> int:
+        if self.gas is None:
+            raise Exception('gas required exceeds allowance or always failing transaction')
+
+        return self.gas
+
+    def _func(self, from_account: str, gas: int, gas_price: int, nonce: int) -> str:
+        return self.web3.send({'from': from_account, 'to': self.address.address, 'function': self.function_name,
+                               'gas': gas, 'gasPrice': gas_price, 'nonce': nonce})
+
+
+class FakeReceipt:
+    """ A :py:class:`pymaker.Receipt` double, taking its transfers from the fake receipt instead of its logs """
+
+    def __init__(self, receipt: dict):
+        self.raw_receipt = receipt
+        self.transaction_hash = receipt['transactionHash']
+        self.gas_used = receipt['gasUsed']
+        self.successful = receipt['status'] == 1
+        self.transfers = receipt['transfers']
+
+
+def fake_opportunity(name: str = 'MKR/DAI', resources: set = None):
+    return SimpleNamespace(pair=SimpleNamespace(name=name, resources=resources or {name}))
@@ -0,0 +1,289 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Local HTTP stand-ins of the Oasis REST API and of a node, serving synthetic markets.
+
+Shared by the tests and by `benchmarks.keeper_latency`. Every stand-in counts what it is asked, can be slowed
+down with an :py:class:`InjectedLatency`, and can be made to fail: with `status` set, every request is answered
+with that HTTP status, and every JSON-RPC call of a method in `call_errors` is answered with that error message.
+"""
+
+import collections
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import unquote
+
+
+def address(number: int) -> str:
+    """ A synthetic address made of digits only, hence already checksummed """
+    return '0x' + str(number).rjust(40, '0')
+
+
+OUR_ADDRESS = address(7000)
+OASIS_ADDRESS = address(5000)
+TX_MANAGER_ADDRESS = address(6000)
+# Kovan Dai, which the keeper names without an `entry-token-name`
+ENTRY_TOKEN = '0x4F96Fe3b7A6Cf9725f59d353F723c1bDb64CA6Aa'
+ENTRY_EXCHANGE = address(3000)
+
+ETH_PRICE = 200.0
+ETH_RESERVE = 5000 * 10**18
+OUR_BALANCE = 10**24
+GAS_PRICE = 10 * 10**9
+MAX_UINT = '0x' + 'f' * 64
+
+
+def word(value: int) -> str:
+    return '0x' + hex(value)[2:].rjust(64, '0')
+
+
+class SyntheticMarkets:
+    """ Oasis order books and Uniswap exchanges of `pairs` arb tokens, all traded against one entry token
+
+    Every block the price of each arb token follows a random walk, the Uniswap reserves are set to that price
+    shifted by a random divergence, and each Oasis book is generated again with probability `book_change_rate`.
+    """
+
+    def __init__(self, pairs: int = 1, levels: int = 10, book_change_rate: float = 0.3, volatility: float = 0.001,
+                 divergence: float = 0.002, seed: int = 1):
+        self.levels = levels
+        self.book_change_rate = book_change_rate
+        self.volatility = volatility
+        self.divergence = divergence
+        self.generator = random.Random(seed)
+        self.lock = threading.Lock()
+        self.block_number = 0
+
+        self.pairs = [{'entry-token': ENTRY_TOKEN,
+                       'entry-token-name': 'DAI',
+                       'arb-token': address(2000 + index),
+                       'arb-token-name': f"TK{index:02d}",
+                       'uniswap-entry-exchange': ENTRY_EXCHANGE,
+                       'uniswap-arb-exchange': address(4000 + index)} for index in range(pairs)]
+        self.prices = [self.generator.uniform(0.5, 500.0) for _ in self.pairs]
+        self.exchanges = {ENTRY_EXCHANGE} | {pair['uniswap-arb-exchange'] for pair in self.pairs}
+
+        self.books = {}
+        self.token_reserves = {(ENTRY_TOKEN.lower(), ENTRY_EXCHANGE): int(ETH_RESERVE * ETH_PRICE)}
+        for index, pair in enumerate(self.pairs):
+            self._generate_book(index)
+            self._move_reserves(index)
+
+    def advance(self, block_number: int):
+        """ Move the markets to `block_number` """
+        with self.lock:
+            self.block_number = block_number
+            for index in range(len(self.pairs)):
+                self.prices[index] *= math.exp(self.generator.gauss(0.0, self.volatility))
+                self._move_reserves(index)
+
+                if self.generator.random() < self.book_change_rate:
+                    self._generate_book(index)
+
+    def _move_reserves(self, index: int):
+        pair = self.pairs[index]
+        uniswap_price = self.prices[index] * math.exp(self.generator.gauss(0.0, self.divergence))
+        self.token_reserves[(pair['arb-token'], pair['uniswap-arb-exchange'])] = int(ETH_RESERVE * ETH_PRICE / uniswap_price)
+
+    def _generate_book(self, index: int):
+        pair = self.pairs[index]
+        price = self.prices[index]
+        bids = [[f"{price * (0.998 - level * 0.0005):.6f}", f"{self.generator.uniform(0.1, 50.0):.6f}"]
+                for level in range(self.levels)]
+        asks = [[f"{price * (1.002 + level * 0.0005):.6f}", f"{self.generator.uniform(0.1, 50.0):.6f}"]
+                for level in range(self.levels)]
+
+        book_key = (pair['arb-token-name'], pair['entry-token-name'])
+        version = self.books[book_key][0] + 1 if book_key in self.books else 1
+        self.books[book_key] = (version, f'"{index}-{version}"', json.dumps({'data': {'bids': bids, 'asks': asks}}).encode('utf-8'))
+
+    def book(self, arb_token_name: str, entry_token_name: str):
+        """ The `(etag, body)` of the `/v2/orders/{arb}/{entry}` response, None for an unknown market """
+        with self.lock:
+            book = self.books.get((arb_token_name, entry_token_name))
+
+        return book[1:] if book is not None else None
+
+    def rpc(self, method: str, params: list):
+        """ The result of a JSON-RPC call, raises `KeyError` for methods the stand-in does not implement """
+        if method == 'eth_blockNumber':
+            return hex(self.block_number)
+        if method == 'eth_gasPrice':
+            return hex(GAS_PRICE)
+        if method == 'eth_getBalance':
+            return hex(ETH_RESERVE if params[0].lower() in self.exchanges else OUR_BALANCE)
+        if method == 'eth_getLogs':
+            return []
+        if method == 'eth_getCode':
+            return '0x6080604052'
+        if method == 'net_version':
+            return '42'
+        if method == 'eth_chainId':
+            return '0x2a'
+        if method == 'eth_call':
+            return self._call(params[0]['to'].lower(), params[0]['data'])
+
+        raise KeyError(method)
+
+    def _call(self, to: str, data: str) -> str:
+        selector = data[:10]
+        if selector == '0x70a08231':
+            owner = '0x' + data[-40:]
+            with self.lock:
+                return word(self.token_reserves.get((to, owner), OUR_BALANCE))
+        if selector == '0xdd62ed3e':
+            return MAX_UINT
+        if selector == '0x8da5cb5b':
+            return '0x' + OUR_ADDRESS[2:].rjust(64, '0')
+
+        return '0x'
+
+
+class InjectedLatency:
+    """ Delay of every request to a stand-in: `latency` seconds, give or take `jitter` (a fraction of it), and
+    `tail_factor` times as long with probability `tail_probability` """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, tail_probability: float = 0.0, tail_factor: float = 1.0,
+                 seed: int = 1):
+        self.latency = latency
+        self.jitter = jitter
+        self.tail_probability = tail_probability
+        self.tail_factor = tail_factor
+        self.generator = random.Random(seed)
+
+    def wait(self):
+        delay = self.latency * (1 + self.generator.uniform(-self.jitter, self.jitter))
+        if self.generator.random() < self.tail_probability:
+            delay *= self.tail_factor
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+class StandIn(ThreadingHTTPServer):
+    """ Local HTTP server standing in for one Oasis REST API server or one node, counting what it is asked
+
+    Attributes:
+        status: HTTP status every request is answered with instead, with an empty body, if set
+        call_errors: Error message each JSON-RPC call of a method is answered with instead, keyed by method
+        reverse_batches: Whether the responses to a JSON-RPC batch are sent in reverse order, as nodes may reorder them
+    """
+    daemon_threads = True
+
+    def __init__(self, handler, markets: SyntheticMarkets, latency: Optional[InjectedLatency] = None):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.markets = markets
+        self.latency = latency if latency is not None else InjectedLatency()
+        self.status = None
+        self.call_errors = {}
+        self.reverse_batches = False
+        self.counts = collections.Counter()
+        self.counts_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        self.thread.start()
+
+    @property
+    def uri(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, *keys):
+        with self.counts_lock:
+            self.counts.update(keys)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def respond(self, status: int, body: bytes = b'', headers: dict = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class OasisHandler(StandInHandler):
+    """ Serves `/v2/orders/{arb}/{entry}`, answering `If-None-Match` with a 304 while the book is unchanged """
+
+    def do_GET(self):
+        self.server.latency.wait()
+        if self.server.status is not None:
+            self.server.count('requests', 'failed')
+            self.respond(self.server.status)
+            return
+
+        parts = [unquote(part) for part in self.path.strip('/').split('/')]
+        book = self.server.markets.book(parts[2], parts[3]) if len(parts) == 4 and parts[:2] == ['v2', 'orders'] else None
+
+        if book is None:
+            self.server.count('requests', 'not_found')
+            self.respond(404)
+        elif self.headers.get('If-None-Match') == book[0]:
+            self.server.count('requests', 'not_modified')
+            self.respond(304, headers={'ETag': book[0]})
+        else:
+            self.server.count('requests', 'orders')
+            self.respond(200, book[1], {'Content-Type': 'application/json', 'ETag': book[0]})
+
+
+class RpcHandler(StandInHandler):
+    """ Answers JSON-RPC requests and batches with the state of the synthetic markets """
+
+    def do_POST(self):
+        self.server.latency.wait()
+        if self.server.status is not None:
+            self.server.count('requests', 'failed')
+            self.respond(self.server.status)
+            return
+
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        calls = payload if isinstance(payload, list) else [payload]
+
+        responses = []
+        for call in calls:
+            self.server.count('calls', call['method'])
+            if call['method'] in self.server.call_errors:
+                responses.append({'jsonrpc': '2.0', 'id': call.get('id'),
+                                  'error': {'code': -32000, 'message': self.server.call_errors[call['method']]}})
+                continue
+
+            try:
+                responses.append({'jsonrpc': '2.0', 'id': call.get('id'),
+                                  'result': self.server.markets.rpc(call['method'], call.get('params', []))})
+            except KeyError:
+                responses.append({'jsonrpc': '2.0', 'id': call.get('id'),
+                                  'error': {'code': -32601, 'message': f"Method {call['method']} not available"}})
+
+        if self.server.reverse_batches:
+            responses.reverse()
+
+        self.server.count('requests')
+        body = json.dumps(responses if isinstance(payload, list) else responses[0]).encode('utf-8')
+        self.respond(200, body, {'Content-Type': 'application/json'})
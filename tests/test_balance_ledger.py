@@ -0,0 +1,175 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from types import SimpleNamespace
+
+import pytest
+
+from pymaker import Address, Transfer
+from pymaker.numeric import Wad
+
+from simple_arbitrage_keeper.balance_ledger import TRANSFER, BalanceLedger
+from simple_arbitrage_keeper.rpc_batch import BatchReader, encode_address
+from tests.stand_ins import ENTRY_TOKEN, MAX_UINT, OUR_ADDRESS, OUR_BALANCE, TX_MANAGER_ADDRESS, RpcHandler, StandIn, \
+    SyntheticMarkets, address
+
+DAI = Address(ENTRY_TOKEN)
+US = Address(OUR_ADDRESS)
+TX_MANAGER = Address(TX_MANAGER_ADDRESS)
+SOMEONE = Address(address(8000))
+
+
+class ChainWithTransfers(SyntheticMarkets):
+    """ Synthetic markets whose node also serves `eth_getLogs` of the `Transfer` events added to `logs` """
+
+    def __init__(self):
+        super().__init__()
+        self.logs = []
+
+    def transfer(self, transaction_hash: str, block_number: int, from_address: Address, to_address: Address, value: int):
+        self.logs.append({'address': ENTRY_TOKEN,
+                          'topics': [TRANSFER, '0x' + encode_address(from_address), '0x' + encode_address(to_address)],
+                          'data': hex(value),
+                          'blockNumber': hex(block_number),
+                          'transactionHash': transaction_hash})
+
+    def rpc(self, method: str, params: list):
+        if method != 'eth_getLogs':
+            return super().rpc(method, params)
+
+        log_filter = params[0]
+        return [log for log in self.logs
+                if int(log_filter['fromBlock'], 16) <= int(log['blockNumber'], 16) <= int(log_filter['toBlock'], 16)
+                and all(topic is None or log['topics'][index] == topic for index, topic in enumerate(log_filter['topics']))]
+
+
+def receipt(transaction_hash: str, block_number: int, transfers: list):
+    return SimpleNamespace(transaction_hash=bytes.fromhex(transaction_hash[2:]), raw_receipt={'blockNumber': block_number},
+                           transfers=transfers)
+
+
+def transaction_hash(number: int) -> str:
+    return '0x' + hex(number)[2:].rjust(64, '0')
+
+
+class TestBalanceLedger:
+    @pytest.fixture
+    def chain(self) -> ChainWithTransfers:
+        return ChainWithTransfers()
+
+    @pytest.fixture
+    def ledger(self, chain) -> BalanceLedger:
+        node = StandIn(RpcHandler, chain)
+        ledger = BalanceLedger(BatchReader(node.uri, timeout=5.0), US, [DAI], reconcile_blocks=0)
+        ledger.restore(10, {DAI: 100}, {(US, DAI, TX_MANAGER): 1000})
+        yield ledger
+        node.stop()
+
+    def test_should_apply_our_receipts(self, ledger):
+        # when
+        ledger.apply_receipt(receipt(transaction_hash(1), 11, [Transfer(DAI, US, TX_MANAGER, Wad(30)),
+                                                               Transfer(DAI, TX_MANAGER, US, Wad(35))]))
+
+        # then
+        assert ledger.balance(DAI) == Wad(105)
+
+    def test_should_apply_a_receipt_only_once(self, ledger):
+        # given
+        mined = receipt(transaction_hash(1), 11, [Transfer(DAI, US, TX_MANAGER, Wad(30))])
+
+        # when
+        ledger.apply_receipt(mined)
+        ledger.apply_receipt(mined)
+
+        # then
+        assert ledger.balance(DAI) == Wad(70)
+
+    def test_should_skip_the_events_of_receipts_already_applied(self, ledger, chain):
+        # given
+        ledger.apply_receipt(receipt(transaction_hash(1), 11, [Transfer(DAI, US, TX_MANAGER, Wad(30))]))
+        chain.transfer(transaction_hash(1), 11, US, TX_MANAGER, 30)
+
+        # when
+        ledger.update(11)
+
+        # then
+        assert ledger.balance(DAI) == Wad(70)
+        assert ledger.block_number == 11
+
+    def test_should_skip_receipts_of_blocks_whose_events_were_applied(self, ledger, chain):
+        # given
+        chain.transfer(transaction_hash(2), 11, US, TX_MANAGER, 30)
+        ledger.update(11)
+
+        # when
+        ledger.apply_receipt(receipt(transaction_hash(2), 11, [Transfer(DAI, US, TX_MANAGER, Wad(30))]))
+
+        # then
+        assert ledger.balance(DAI) == Wad(70)
+
+    def test_should_apply_external_transfers(self, ledger, chain):
+        # given
+        chain.transfer(transaction_hash(3), 11, SOMEONE, US, 50)
+        chain.transfer(transaction_hash(4), 12, US, SOMEONE, 20)
+        chain.transfer(transaction_hash(5), 12, SOMEONE, TX_MANAGER, 1000)
+
+        # when
+        ledger.update(11)
+        ledger.update(12)
+
+        # then
+        assert ledger.balance(DAI) == Wad(130)
+
+    def test_should_reconcile_with_the_chain(self, ledger, chain):
+        # given
+        ledger.reconcile_blocks = 2
+        ledger.apply_receipt(receipt(transaction_hash(1), 13, [Transfer(DAI, TX_MANAGER, US, Wad(5))]))
+
+        # when
+        ledger.update(11)
+
+        # then
+        assert ledger.balance(DAI) == Wad(105)
+
+        # when
+        ledger.update(12)
+
+        # then
+        assert ledger.balance(DAI) == Wad(OUR_BALANCE + 5)
+        assert ledger.allowance(US, DAI, TX_MANAGER) == Wad(int(MAX_UINT, 16))
+        assert ledger.reconciled_at == 12
+
+    def test_should_not_spend_allowances_from_transfers(self, ledger):
+        # when
+        # an Oasis take through the TxManager pays the maker directly, the market being the spender
+        ledger.apply_receipt(receipt(transaction_hash(1), 11, [Transfer(DAI, US, TX_MANAGER, Wad(30)),
+                                                               Transfer(DAI, TX_MANAGER, SOMEONE, Wad(30))]))
+
+        # then
+        assert ledger.state()[2] == {(US, DAI, TX_MANAGER): 1000}
+
+    def test_should_apply_later_receipts_again_when_restored(self, ledger):
+        # given
+        ledger.apply_receipt(receipt(transaction_hash(1), 11, [Transfer(DAI, US, TX_MANAGER, Wad(30))]))
+        ledger.apply_receipt(receipt(transaction_hash(2), 13, [Transfer(DAI, US, TX_MANAGER, Wad(20))]))
+
+        # when
+        ledger.restore(12, {DAI: 500}, {})
+
+        # then
+        assert ledger.balance(DAI) == Wad(480)
+        assert ledger.state() == (12, {DAI: 480}, {})
@@ -0,0 +1,118 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from simple_arbitrage_keeper.block_scheduler import BlockScheduler, StaleBlock, submit_logged
+
+
+class TestBlockScheduler:
+    def test_should_evaluate_only_the_latest_block(self):
+        # given
+        evaluated = []
+        started = threading.Event()
+        release = threading.Event()
+        done = threading.Event()
+
+        def evaluate(block_number: int):
+            evaluated.append(block_number)
+            started.set()
+            release.wait()
+            if block_number == 3:
+                done.set()
+
+        scheduler = BlockScheduler(evaluate)
+
+        # when
+        scheduler.on_block(1)
+        started.wait()
+        scheduler.on_block(2)
+        scheduler.on_block(3)
+        scheduler.on_block(3)
+        release.set()
+        done.wait(5)
+        scheduler.stop()
+
+        # then
+        assert evaluated == [1, 3]
+        assert scheduler.skipped == 1
+
+    def test_should_tell_stale_blocks(self):
+        # given
+        scheduler = BlockScheduler(lambda block_number: None)
+        scheduler.on_block(5)
+        scheduler.stop()
+
+        # expect
+        assert scheduler.is_stale(4)
+        assert not scheduler.is_stale(5)
+        assert not scheduler.is_stale(None)
+        with pytest.raises(StaleBlock):
+            scheduler.check(4)
+
+    def test_should_log_exceptions_of_submitted_functions(self, caplog):
+        # given
+        scheduler = BlockScheduler(lambda block_number: None)
+
+        def execute_opportunities():
+            raise Exception('nonce too low')
+
+        # when
+        with caplog.at_level(logging.ERROR):
+            future = scheduler.submit(execute_opportunities)
+            scheduler.stop()
+
+        # then
+        assert str(future.exception()) == 'nonce too low'
+        assert len(caplog.records) == 1
+        assert caplog.records[0].getMessage() == 'execute_opportunities failed in the background'
+        assert caplog.records[0].exc_info[1] is future.exception()
+
+    def test_should_not_log_functions_which_succeed(self, caplog):
+        # given
+        scheduler = BlockScheduler(lambda block_number: None)
+
+        # when
+        with caplog.at_level(logging.ERROR):
+            future = scheduler.submit(lambda a, b: a + b, 1, 2)
+            scheduler.stop()
+
+        # then
+        assert future.result() == 3
+        assert caplog.records == []
+
+
+class TestSubmitLogged:
+    def test_should_log_exceptions_of_background_functions(self, caplog):
+        # given
+        executor = ThreadPoolExecutor(max_workers=1)
+
+        def checkpoint():
+            raise OSError('disk full')
+
+        # when
+        with caplog.at_level(logging.ERROR):
+            future = submit_logged(executor, checkpoint)
+            executor.shutdown(wait=True)
+
+        # then
+        assert isinstance(future.exception(), OSError)
+        assert [record.getMessage() for record in caplog.records] == ['checkpoint failed in the background']
@@ -0,0 +1,256 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from pymaker import Address
+from pymaker.numeric import Wad
+from pymaker.oasis import MatchingMarket
+
+from simple_arbitrage_keeper.chain_order_book import ChainOrderBook, LOG_KILL, LOG_MAKE, LOG_TAKE, OFFERS
+from simple_arbitrage_keeper.rpc_batch import BatchReader, encode_address
+from tests.stand_ins import OASIS_ADDRESS, RpcHandler, StandIn, SyntheticMarkets, address, word
+
+WAD = 10**18
+DAI = Address(address(1000))
+TK00 = Address(address(2000))
+TK01 = Address(address(2001))
+MAKER = Address(address(8000))
+
+
+class OasisChain(SyntheticMarkets):
+    """ Synthetic markets whose node also serves the orders of an OasisDEX market and their events """
+
+    def __init__(self):
+        super().__init__()
+        self.offers = {}
+        self.logs = []
+
+    def make(self, block_number: int, order_id: int, pay_token: Address, pay_amount: int, buy_token: Address,
+             buy_amount: int):
+        self.offers[order_id] = (pay_token, pay_amount, buy_token, buy_amount)
+        self._log(block_number, [LOG_MAKE, word(order_id)], [pay_token, buy_token])
+
+    def take(self, block_number: int, order_id: int, take_amount: int):
+        """ Take `take_amount` of what the order pays """
+        (pay_token, pay_amount, buy_token, buy_amount) = self.offers[order_id]
+        self.offers[order_id] = (pay_token, pay_amount - take_amount, buy_token,
+                                 buy_amount - take_amount * buy_amount // pay_amount)
+        if self.offers[order_id][1] == 0:
+            del self.offers[order_id]
+        self._log(block_number, [LOG_TAKE], [order_id, pay_token, buy_token])
+
+    def kill(self, block_number: int, order_id: int):
+        (pay_token, _, buy_token, _) = self.offers.pop(order_id)
+        self._log(block_number, [LOG_KILL, word(order_id)], [pay_token, buy_token])
+
+    def _log(self, block_number: int, topics: list, data: list):
+        words = [encode_address(item) if isinstance(item, Address) else word(item)[2:] for item in data]
+        self.logs.append({'address': OASIS_ADDRESS, 'topics': topics, 'data': '0x' + ''.join(words),
+                          'blockNumber': hex(block_number)})
+
+    def rpc(self, method: str, params: list):
+        if method == 'eth_getLogs':
+            log_filter = params[0]
+            return [log for log in self.logs
+                    if int(log_filter['fromBlock'], 16) <= int(log['blockNumber'], 16) <= int(log_filter['toBlock'], 16)
+                    and log['topics'][0] in log_filter['topics'][0]]
+
+        if method == 'eth_call' and params[0]['data'].startswith(OFFERS):
+            offer = self.offers.get(int(params[0]['data'][10:], 16))
+            if offer is None:
+                return '0x' + '0' * 64 * 6
+
+            (pay_token, pay_amount, buy_token, buy_amount) = offer
+            return '0x' + ''.join([word(pay_amount)[2:], encode_address(pay_token), word(buy_amount)[2:],
+                                   encode_address(buy_token), encode_address(MAKER), word(1)[2:]])
+
+        return super().rpc(method, params)
+
+
+class FakeMarket(MatchingMarket):
+    """ A `MatchingMarket` whose full reads of the orders are served from an :py:class:`OasisChain` """
+
+    def __init__(self, chain: OasisChain):
+        self.address = Address(OASIS_ADDRESS)
+        self.chain = chain
+        self.full_reads = 0
+        self.reading = threading.Event()
+        self.release = None
+
+    def get_orders(self, pay_token: Address, buy_token: Address) -> list:
+        self.full_reads += 1
+        orders = [SimpleNamespace(order_id=order_id, pay_token=offer[0], pay_amount=Wad(offer[1]),
+                                  buy_token=offer[2], buy_amount=Wad(offer[3]))
+                  for order_id, offer in self.chain.offers.items() if (offer[0], offer[2]) == (pay_token, buy_token)]
+
+        # lets a test hold the read back while the chain moves on
+        self.reading.set()
+        if self.release is not None:
+            assert self.release.wait(5.0)
+
+        return orders
+
+
+def wait_for_resync(book: ChainOrderBook):
+    deadline = time.time() + 5.0
+    while book.resync_thread is not None:
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+class TestChainOrderBook:
+    @pytest.fixture
+    def chain(self) -> OasisChain:
+        chain = OasisChain()
+        # a bid of 2 TK00 at 100 DAI and an ask of 1 TK00 at 110 DAI
+        chain.make(1, 1, DAI, 200 * WAD, TK00, 2 * WAD)
+        chain.make(1, 2, TK00, 1 * WAD, DAI, 110 * WAD)
+        return chain
+
+    @pytest.fixture
+    def node(self, chain):
+        node = StandIn(RpcHandler, chain)
+        yield node
+        node.stop()
+
+    @pytest.fixture
+    def book(self, chain, node) -> ChainOrderBook:
+        book = ChainOrderBook(FakeMarket(chain), BatchReader(node.uri, timeout=5.0), DAI, TK00, 'DAI', 'TK00',
+                              resync_blocks=0)
+        book.get_snapshot(10)
+        return book
+
+    def test_should_bootstrap_from_a_full_read(self, book):
+        # expect
+        assert book.get_orders(10) == ([[100.0, 2.0]], [[110.0, 1.0]])
+        assert book.market.full_reads == 2
+
+    def test_should_apply_a_partial_take(self, book, chain, node):
+        # given
+        chain.take(11, 1, 50 * WAD)
+
+        # when
+        snapshot = book.get_snapshot(11)
+
+        # then
+        assert snapshot.bids == [[100.0, 1.5]]
+        assert snapshot.block_number == 11
+        assert node.counts['eth_call'] == 1
+        assert book.market.full_reads == 2
+
+    def test_should_apply_a_full_take(self, book, chain):
+        # given
+        chain.take(11, 2, 1 * WAD)
+
+        # expect
+        assert book.get_orders(11) == ([[100.0, 2.0]], [])
+
+    def test_should_apply_makes_and_kills(self, book, chain):
+        # given
+        chain.make(11, 3, TK00, 3 * WAD, DAI, 345 * WAD)
+        chain.kill(12, 1)
+
+        # when
+        (bids, asks) = book.get_orders(12)
+
+        # then
+        assert bids == []
+        assert asks == [[110.0, 1.0], [115.0, 3.0]]
+        assert set(book.orders) == {2, 3}
+
+    def test_should_ignore_the_events_of_other_markets(self, book, chain, node):
+        # given
+        chain.make(11, 4, TK01, 1 * WAD, DAI, 50 * WAD)
+
+        # when
+        snapshot = book.get_snapshot(11)
+
+        # then
+        assert node.counts['eth_call'] == 0
+        assert snapshot.asks == [[110.0, 1.0]]
+
+    def test_should_reuse_an_unchanged_book(self, book, node):
+        # given
+        previous = book.get_snapshot(10)
+
+        # when
+        snapshot = book.get_snapshot(11)
+
+        # then
+        assert snapshot.block_number == 11
+        assert snapshot.ask_index is previous.ask_index
+        assert node.counts['eth_getLogs'] == 1
+        assert node.counts['eth_call'] == 0
+
+    def test_should_repair_drift_on_resync(self, book, chain, caplog):
+        # given
+        book.resync_blocks = 5
+        # order 1 changes without an event the book would have seen, order 2 through one it does see
+        chain.offers[1] = (DAI, 300 * WAD, TK00, 3 * WAD)
+        chain.take(14, 2, WAD // 2)
+
+        # when
+        with caplog.at_level(logging.WARNING):
+            book.get_snapshot(15)
+            wait_for_resync(book)
+
+        # then
+        assert book.drift == 1
+        assert book.get_orders(15) == ([[100.0, 3.0]], [[110.0, 0.5]])
+        assert book.market.full_reads == 4
+        assert [record.getMessage() for record in caplog.records] == \
+               ["Repaired 1 drifted orders in the TK00/DAI Oasis book (1 so far)"]
+
+    def test_should_not_resync_without_drift(self, book, caplog):
+        # given
+        book.resync_blocks = 5
+
+        # when
+        with caplog.at_level(logging.WARNING):
+            book.get_snapshot(15)
+            wait_for_resync(book)
+
+        # then
+        assert book.drift == 0
+        assert caplog.records == []
+
+    def test_should_not_count_orders_touched_during_resync_as_drift(self, book, chain, caplog):
+        # given
+        book.resync_blocks = 5
+        book.market.release = threading.Event()
+        book.market.reading.clear()
+
+        # when
+        with caplog.at_level(logging.WARNING):
+            book.get_snapshot(15)
+            assert book.market.reading.wait(5.0)
+            # the resync has read order 1 whole, then it gets taken before the resync compares
+            chain.take(16, 1, 50 * WAD)
+            book.get_snapshot(16)
+            book.market.release.set()
+            wait_for_resync(book)
+
+        # then
+        assert book.drift == 0
+        assert book.get_orders(16) == ([[100.0, 1.5]], [[110.0, 1.0]])
+        assert caplog.records == []
@@ -0,0 +1,240 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+import pytest
+
+from pymaker import Address
+
+from simple_arbitrage_keeper.endpoint_pool import EndpointPool
+from simple_arbitrage_keeper.rpc_batch import BatchReader
+from tests.stand_ins import GAS_PRICE, OUR_ADDRESS, OUR_BALANCE, RpcHandler, StandIn, SyntheticMarkets
+
+
+def pool_with_latencies(latencies: dict) -> EndpointPool:
+    pool = EndpointPool('test', list(latencies.keys()), max_failures=2)
+    for endpoint in pool.endpoints:
+        endpoint.latency = latencies[endpoint.uri]
+    return pool
+
+
+def pool_failures(reader: BatchReader) -> dict:
+    return {endpoint.uri: endpoint.failures for endpoint in reader.pool.endpoints}
+
+
+class SlowEndpoints:
+    """ Answers with the URI of the endpoint after the delay of that endpoint, recording when each was called """
+
+    def __init__(self, delays: dict):
+        self.delays = delays
+        self.started = time.perf_counter()
+        self.called_at = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, uri: str):
+        with self.lock:
+            self.called_at[uri] = time.perf_counter() - self.started
+
+        if isinstance(self.delays[uri], Exception):
+            raise self.delays[uri]
+
+        time.sleep(self.delays[uri])
+        return uri
+
+
+class TestEndpointPool:
+    def test_should_rank_endpoints_by_latency(self):
+        # given
+        pool = pool_with_latencies({'a': 0.3, 'b': 0.1, 'c': 0.2})
+
+        # expect
+        assert [endpoint.uri for endpoint in pool.ranked()] == ['b', 'c', 'a']
+
+    def test_should_call_a_single_endpoint_directly(self):
+        # given
+        pool = EndpointPool('test', ['a'])
+
+        # expect
+        assert pool.executor is None
+        assert pool.request(lambda uri: uri * 2) == 'aa'
+
+    def test_should_return_the_fastest_endpoint_answer(self):
+        # given
+        pool = pool_with_latencies({'a': 0.01, 'b': 0.02})
+
+        # expect
+        assert pool.request(SlowEndpoints({'a': 0.0, 'b': 0.0})) == 'a'
+
+    def test_should_hedge_to_the_next_endpoint_after_the_hedge_delay(self):
+        # given
+        pool = pool_with_latencies({'a': 0.01, 'b': 0.02})
+        endpoints = SlowEndpoints({'a': 1.0, 'b': 0.0})
+
+        # when
+        result = pool.request(endpoints)
+
+        # then
+        assert result == 'b'
+        assert endpoints.called_at['b'] < 0.5
+
+    def test_should_wait_for_the_hedge_delay_of_each_endpoint_tried(self):
+        # given
+        pool = pool_with_latencies({'a': 0.01, 'b': 0.2, 'c': 0.3})
+        endpoints = SlowEndpoints({'a': 2.0, 'b': 2.0, 'c': 0.0})
+
+        # when
+        result = pool.request(endpoints)
+
+        # then
+        assert result == 'c'
+        # 0.02s for 'a' (twice its latency), then 0.4s for 'b'
+        assert endpoints.called_at['b'] < 0.2
+        assert 0.35 < endpoints.called_at['c'] < 1.5
+
+    def test_should_fail_over_at_once(self):
+        # given
+        pool = pool_with_latencies({'a': 0.5, 'b': 0.6})
+        endpoints = SlowEndpoints({'a': Exception('a failed'), 'b': 0.0})
+
+        # when
+        result = pool.request(endpoints)
+
+        # then
+        assert result == 'b'
+        assert endpoints.called_at['b'] < 0.5
+
+    def test_should_raise_if_every_endpoint_fails(self):
+        # given
+        pool = pool_with_latencies({'a': 0.01, 'b': 0.02})
+
+        # expect
+        with pytest.raises(Exception, match='failed'):
+            pool.request(SlowEndpoints({'a': Exception('a failed'), 'b': Exception('b failed')}))
+
+    def test_should_eject_failing_endpoints_until_they_recover(self):
+        # given
+        pool = pool_with_latencies({'a': 0.01, 'b': 0.02})
+        failing = SlowEndpoints({'a': Exception('a failed'), 'b': 0.0})
+
+        # when
+        pool.request(failing)
+        pool.request(failing)
+
+        # then
+        assert [endpoint.uri for endpoint in pool.ranked()] == ['b', 'a']
+
+        # when
+        pool.endpoints[0].ejected_until = 0.0
+        pool.request(SlowEndpoints({'a': 0.0, 'b': 0.0}))
+
+        # then
+        assert pool.endpoints[0].failures == 0
+
+    def test_should_not_hedge_to_an_ejected_endpoint(self):
+        # given
+        pool = pool_with_latencies({'a': 0.01, 'b': 0.02})
+        pool.endpoints[1].ejected_until = time.time() + 30
+        endpoints = SlowEndpoints({'a': 0.3, 'b': 0.0})
+
+        # when
+        result = pool.request(endpoints)
+
+        # then
+        assert result == 'a'
+        assert 'b' not in endpoints.called_at
+
+    def test_should_try_an_ejected_endpoint_only_once_all_the_others_have_failed(self):
+        # given
+        pool = pool_with_latencies({'a': 0.01, 'b': 0.02, 'c': 0.03})
+        pool.endpoints[2].ejected_until = time.time() + 30
+
+        # when
+        # 'b' fails while 'a' is still outstanding, which then answers
+        slow = SlowEndpoints({'a': 0.3, 'b': Exception('b failed'), 'c': 0.0})
+        result = pool.request(slow)
+
+        # then
+        assert result == 'a'
+        assert 'c' not in slow.called_at
+
+        # when
+        failing = SlowEndpoints({'a': Exception('a failed'), 'b': Exception('b failed'), 'c': 0.0})
+        result = pool.request(failing)
+
+        # then
+        assert result == 'c'
+
+
+class TestBatchReaderFailover:
+    @pytest.fixture
+    def nodes(self):
+        markets = SyntheticMarkets()
+        nodes = [StandIn(RpcHandler, markets), StandIn(RpcHandler, markets)]
+        yield nodes
+        for node in nodes:
+            node.stop()
+
+    def read(self, reader: BatchReader) -> tuple:
+        batch = reader.batch(1000)
+        results = (batch.gas_price(), batch.eth_balance(Address(OUR_ADDRESS)))
+        batch.execute()
+        return results
+
+    def test_should_fail_over_from_a_node_answering_with_call_errors(self, nodes):
+        # given
+        nodes[0].call_errors['eth_getBalance'] = 'header not found'
+        reader = BatchReader([nodes[0].uri, nodes[1].uri], timeout=5.0)
+
+        # when
+        (gas_price, balance) = self.read(reader)
+
+        # then
+        assert (gas_price.value, balance.value) == (GAS_PRICE, OUR_BALANCE)
+        assert nodes[0].counts['requests'] == 1
+        assert nodes[1].counts['requests'] == 1
+        assert pool_failures(reader) == {nodes[0].uri: 1, nodes[1].uri: 0}
+
+    def test_should_resolve_call_errors_if_every_node_answers_with_them(self, nodes):
+        # given
+        nodes[0].call_errors['eth_getBalance'] = 'header not found'
+        nodes[1].call_errors['eth_getBalance'] = 'header not found'
+        reader = BatchReader([nodes[0].uri, nodes[1].uri], timeout=5.0)
+
+        # when
+        (gas_price, balance) = self.read(reader)
+
+        # then
+        assert gas_price.value == GAS_PRICE
+        with pytest.raises(Exception, match='header not found'):
+            balance.value
+
+    def test_should_resolve_call_errors_if_the_last_node_fails_otherwise(self, nodes):
+        # given
+        nodes[0].call_errors['eth_getBalance'] = 'header not found'
+        nodes[1].status = 500
+        reader = BatchReader([nodes[0].uri, nodes[1].uri], timeout=5.0)
+
+        # when
+        (gas_price, balance) = self.read(reader)
+
+        # then
+        assert nodes[1].counts['failed'] == 1
+        assert gas_price.value == GAS_PRICE
+        with pytest.raises(Exception, match='header not found'):
+            balance.value
@@ -0,0 +1,152 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+import pytest
+
+from simple_arbitrage_keeper.endpoint_pool import EndpointPool
+from simple_arbitrage_keeper.oasis_api import OasisAPI
+from tests.stand_ins import OasisHandler, StandIn, SyntheticMarkets
+
+
+def change_book(markets: SyntheticMarkets, index: int):
+    markets._generate_book(index)
+
+
+def served_bids(markets: SyntheticMarkets, arb_token_name: str) -> list:
+    (_, body) = markets.book(arb_token_name, 'DAI')
+    return [[float(item) for item in bid] for bid in json.loads(body)['data']['bids']]
+
+
+class TestOasisAPI:
+    @pytest.fixture
+    def markets(self) -> SyntheticMarkets:
+        return SyntheticMarkets(pairs=2, book_change_rate=0.0)
+
+    @pytest.fixture
+    def oasis_api(self, markets):
+        oasis_api = StandIn(OasisHandler, markets)
+        yield oasis_api
+        oasis_api.stop()
+
+    def test_should_read_the_book(self, markets, oasis_api):
+        # given
+        api = OasisAPI(oasis_api.uri, 'DAI', 'TK00')
+
+        # when
+        (bids, asks) = api.get_orders(1)
+
+        # then
+        assert bids == served_bids(markets, 'TK00')
+        assert len(asks) == markets.levels
+        assert api.get_snapshot(1).etag == '"0-1"'
+
+    def test_should_read_the_book_once_per_block(self, oasis_api):
+        # given
+        api = OasisAPI(oasis_api.uri, 'DAI', 'TK00')
+
+        # when
+        first = api.get_snapshot(1)
+        second = api.get_snapshot(1)
+
+        # then
+        assert second is first
+        assert oasis_api.counts['requests'] == 1
+
+    def test_should_reuse_an_unchanged_book(self, oasis_api):
+        # given
+        api = OasisAPI(oasis_api.uri, 'DAI', 'TK00')
+        first = api.get_snapshot(1)
+
+        # when
+        second = api.get_snapshot(2)
+
+        # then
+        assert oasis_api.counts['orders'] == 1
+        assert oasis_api.counts['not_modified'] == 1
+        assert second.block_number == 2
+        assert second.bids is first.bids
+        assert second.bid_index is first.bid_index
+        assert second.ask_index is first.ask_index
+
+    def test_should_fetch_a_changed_book(self, markets, oasis_api):
+        # given
+        api = OasisAPI(oasis_api.uri, 'DAI', 'TK00')
+        first = api.get_snapshot(1)
+
+        # when
+        change_book(markets, 0)
+        second = api.get_snapshot(2)
+
+        # then
+        assert oasis_api.counts['orders'] == 2
+        assert oasis_api.counts['not_modified'] == 0
+        assert second.etag == '"0-2"'
+        assert second.bids == served_bids(markets, 'TK00')
+        assert second.bids != first.bids
+
+    def test_should_only_fetch_the_changed_books(self, markets, oasis_api):
+        # given
+        pool = EndpointPool('oasis-api', [oasis_api.uri])
+        apis = [OasisAPI(pool, 'DAI', 'TK00'), OasisAPI(pool, 'DAI', 'TK01')]
+        (_, unchanged) = [api.get_snapshot(1) for api in apis]
+
+        # when
+        change_book(markets, 0)
+        snapshots = [api.get_snapshot(block_number) for block_number in [2, 3] for api in apis]
+
+        # then
+        assert oasis_api.counts['orders'] == 3
+        assert oasis_api.counts['not_modified'] == 3
+        assert snapshots[0].bids == served_bids(markets, 'TK00')
+        assert all(snapshot.bid_index is unchanged.bid_index for snapshot in snapshots[1::2])
+
+    def test_should_not_revalidate_a_book_younger_than_max_staleness(self, oasis_api):
+        # given
+        api = OasisAPI(oasis_api.uri, 'DAI', 'TK00', max_staleness=60.0)
+        first = api.get_snapshot(1)
+
+        # when
+        second = api.get_snapshot(2)
+
+        # then
+        assert second is first
+        assert oasis_api.counts['requests'] == 1
+
+    def test_should_revalidate_a_book_older_than_max_staleness(self, markets, oasis_api):
+        # given
+        api = OasisAPI(oasis_api.uri, 'DAI', 'TK00', max_staleness=60.0)
+        api.get_snapshot(1).fetched_at -= 61.0
+
+        # when
+        change_book(markets, 0)
+        snapshot = api.get_snapshot(2)
+
+        # then
+        assert oasis_api.counts['orders'] == 2
+        assert snapshot.bids == served_bids(markets, 'TK00')
+        assert snapshot.block_number == 2
+
+    def test_should_fail_on_an_error_response(self, oasis_api):
+        # given
+        api = OasisAPI(oasis_api.uri, 'DAI', 'TK00')
+        oasis_api.status = 503
+
+        # expect
+        with pytest.raises(Exception, match="Failed to fetch Oasis orders"):
+            api.get_orders(1)
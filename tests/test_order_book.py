@@ -0,0 +1,98 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from simple_arbitrage_keeper.order_book import DepthIndex, to_wad_value
+
+WAD = 10**18
+
+
+class TestToWadValue:
+    def test_should_convert_exactly(self):
+        assert to_wad_value("0.1") == 10**17
+        assert to_wad_value(0.1) == 10**17
+        assert to_wad_value("123.000000000000000001") == 123 * WAD + 1
+        assert to_wad_value(7) == 7 * WAD
+
+
+class TestDepthIndex:
+    # asks of 1 base at 100 quote, then 2 base at 110 quote
+    asks = DepthIndex([["100", "1"], ["110", "2"]])
+    # bids of 1 base at 100 quote, then 2 base at 90 quote
+    bids = DepthIndex([[100, 1], [90, 2]])
+
+    def test_should_accumulate_the_levels(self):
+        assert len(self.asks) == 2
+        assert self.asks.prices == [100 * WAD, 110 * WAD]
+        assert self.asks.cumulative_base == [1 * WAD, 3 * WAD]
+        assert self.asks.cumulative_quote == [100 * WAD, 320 * WAD]
+
+    def test_should_walk_the_asks(self):
+        assert self.asks.base_for_quote(0) == 0
+        assert self.asks.base_for_quote(50 * WAD) == WAD // 2
+        assert self.asks.base_for_quote(100 * WAD) == WAD
+        assert self.asks.base_for_quote(210 * WAD) == 2 * WAD
+        assert self.asks.base_for_quote(320 * WAD) == 3 * WAD
+
+    def test_should_round_fills_down_to_the_wei(self):
+        # 1 wei of quote at 110 buys nothing more
+        assert self.asks.base_for_quote(100 * WAD + 1) == WAD
+        assert self.asks.base_for_quote(100 * WAD + 110) == WAD + 1
+
+    def test_should_walk_the_bids(self):
+        assert self.bids.quote_for_base(0) == 0
+        assert self.bids.quote_for_base(WAD) == 100 * WAD
+        assert self.bids.quote_for_base(2 * WAD) == 190 * WAD
+        assert self.bids.quote_for_base(3 * WAD) == 280 * WAD
+
+    def test_should_return_none_beyond_the_depth_of_the_book(self):
+        assert self.asks.base_for_quote(320 * WAD + 1) is None
+        assert self.bids.quote_for_base(3 * WAD + 1) is None
+
+    def test_should_handle_an_empty_book(self):
+        # given
+        empty = DepthIndex([])
+
+        # expect
+        assert len(empty) == 0
+        assert empty.base_for_quote(0) is None
+        assert empty.quote_for_base(1) is None
+
+    def test_should_batch(self):
+        amounts = [0, WAD, 150 * WAD, 320 * WAD, 400 * WAD]
+
+        assert self.asks.base_for_quotes(amounts) == [self.asks.base_for_quote(amount) for amount in amounts]
+        assert self.bids.quote_for_bases(amounts) == [self.bids.quote_for_base(amount) for amount in amounts]
+
+    def test_should_match_walking_the_book_level_by_level(self):
+        # given
+        levels = [["0.0051", "12.5"], ["0.0052", "0.003"], ["0.00525", "400"]]
+        index = DepthIndex(levels)
+
+        # when
+        def walk(quote_amount: int):
+            base = 0
+            for price, amount in levels:
+                level_quote = to_wad_value(amount) * to_wad_value(price) // WAD
+                if quote_amount <= level_quote:
+                    return base + quote_amount * WAD // to_wad_value(price)
+                base += to_wad_value(amount)
+                quote_amount -= level_quote
+            return None
+
+        # then
+        for quote_amount in [1, 10**15, 6 * 10**16, 637 * 10**14, 2 * WAD, 2 * WAD + 1, 3 * WAD]:
+            assert index.base_for_quote(quote_amount) == walk(quote_amount)
@@ -0,0 +1,224 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from pymaker import Address, Transfer
+from pymaker.gas import FixedGasPrice
+from pymaker.numeric import Wad
+
+from simple_arbitrage_keeper import pnl_ledger, submission_manager
+from simple_arbitrage_keeper.pnl_ledger import CANCELLATION, FAILURE, PnLLedger, TRADE, outcome
+from simple_arbitrage_keeper.submission_manager import SubmissionManager
+from tests.fakes import FakeNode, FakeReceipt, FakeTransact, fake_opportunity
+
+OUR_ADDRESS = Address('0x0000000000000000000000000000000000007000')
+TX_MANAGER = Address('0x0000000000000000000000000000000000006000')
+DAI = Address('0x0000000000000000000000000000000000001000')
+MKR = Address('0x0000000000000000000000000000000000002000')
+
+
+def trade(sent: int, received: int, token: Address = DAI) -> list:
+    """ Transfers of a trade sending `sent` and receiving `received` of `token`, in whole tokens """
+    return [Transfer(token, OUR_ADDRESS, TX_MANAGER, Wad(sent * 10**18)),
+            Transfer(MKR, TX_MANAGER, OUR_ADDRESS, Wad(10**18)),
+            Transfer(MKR, OUR_ADDRESS, TX_MANAGER, Wad(10**18)),
+            Transfer(token, TX_MANAGER, OUR_ADDRESS, Wad(received * 10**18))]
+
+
+def receipt(transfers: list, successful: bool = True):
+    return SimpleNamespace(transfers=transfers, successful=successful)
+
+
+class Clock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+class TestPnLLedger:
+    @pytest.fixture
+    def clock(self, monkeypatch) -> Clock:
+        clock = Clock(1000000.0)
+        monkeypatch.setattr(pnl_ledger, 'time', clock)
+        return clock
+
+    def test_should_net_our_transfers(self, clock):
+        # given
+        ledger = PnLLedger(OUR_ADDRESS)
+
+        # when
+        nets = ledger.record(receipt(trade(100, 103) + [Transfer(DAI, TX_MANAGER, MKR, Wad(10**18))]), DAI,
+                             gas_spent=0, gas_cost=Wad(0), outcome=TRADE)
+
+        # then
+        assert nets == {DAI: 3 * 10**18}
+        assert ledger.profit(DAI) == Wad(3 * 10**18)
+        assert ledger.profit(MKR) == Wad(0)
+
+    def test_should_charge_gas_to_the_entry_token(self, clock):
+        # given
+        ledger = PnLLedger(OUR_ADDRESS)
+
+        # when
+        ledger.record(receipt(trade(100, 103)), DAI, gas_spent=3 * 10**15, gas_cost=Wad(6 * 10**17), outcome=TRADE)
+        ledger.record(receipt([], successful=False), DAI, gas_spent=10**15, gas_cost=Wad(2 * 10**17), outcome=FAILURE)
+
+        # then
+        assert ledger.profit(DAI) == Wad(22 * 10**17)
+        assert ledger.totals.gas_spent == 4 * 10**15
+        assert ledger.totals.counts == {TRADE: 1, FAILURE: 1, CANCELLATION: 0}
+
+    def test_should_track_the_drawdown_from_the_highest_profit(self, clock):
+        # given
+        ledger = PnLLedger(OUR_ADDRESS)
+
+        # when
+        ledger.record(receipt(trade(100, 105)), DAI, 0, Wad(0), TRADE)
+        ledger.record(receipt(trade(100, 98)), DAI, 0, Wad(0), TRADE)
+        ledger.record(receipt(trade(100, 99)), DAI, 0, Wad(0), TRADE)
+
+        # then
+        assert ledger.profit(DAI) == Wad(2 * 10**18)
+        assert ledger.drawdown(DAI) == Wad(3 * 10**18)
+
+    def test_should_measure_the_drawdown_from_zero_before_any_profit(self, clock):
+        # given
+        ledger = PnLLedger(OUR_ADDRESS)
+
+        # when
+        ledger.record(receipt(trade(100, 98)), DAI, 0, Wad(0), TRADE)
+
+        # then
+        assert ledger.drawdown(DAI) == Wad(2 * 10**18)
+
+    def test_should_expire_entries_from_the_windows(self, clock):
+        # given
+        ledger = PnLLedger(OUR_ADDRESS)
+        ledger.record(receipt(trade(100, 101)), DAI, 0, Wad(0), TRADE)
+        clock.now += 1800
+        ledger.record(receipt(trade(100, 104)), DAI, 0, Wad(0), TRADE)
+
+        # when
+        clock.now += 1800
+
+        # then
+        assert ledger.window('hour').profit(DAI) == Wad(4 * 10**18)
+        assert ledger.window('hour').counts[TRADE] == 1
+        assert ledger.window('day').profit(DAI) == Wad(5 * 10**18)
+
+        # when
+        clock.now += 86400
+
+        # then
+        assert ledger.window('day').profit(DAI) == Wad(0)
+        assert ledger.profit(DAI) == Wad(5 * 10**18)
+
+    def test_should_restore_a_checkpoint(self, clock, tmpdir):
+        # given
+        path = str(tmpdir.join('pnl.json'))
+        ledger = PnLLedger(OUR_ADDRESS, path, checkpoint_seconds=60)
+        ledger.record(receipt(trade(100, 105)), DAI, 10**15, Wad(2 * 10**17), TRADE)
+        clock.now += 7200
+        ledger.record(receipt(trade(100, 99)), DAI, 10**15, Wad(2 * 10**17), TRADE)
+
+        # when
+        assert ledger.checkpoint_due()
+        ledger.checkpoint()
+        restored = PnLLedger(OUR_ADDRESS, path)
+
+        # then
+        assert not ledger.checkpoint_due()
+        assert restored.profit(DAI) == ledger.profit(DAI) == Wad(36 * 10**17)
+        assert restored.drawdown(DAI) == ledger.drawdown(DAI)
+        assert restored.totals.counts == ledger.totals.counts
+        assert restored.window('hour').profit(DAI) == Wad(-12 * 10**17)
+        assert restored.window('day').profit(DAI) == Wad(36 * 10**17)
+
+    def test_should_not_checkpoint_before_it_is_due(self, clock, tmpdir):
+        # given
+        ledger = PnLLedger(OUR_ADDRESS, str(tmpdir.join('pnl.json')), checkpoint_seconds=60)
+
+        # expect
+        assert not ledger.checkpoint_due()
+        ledger.record(receipt(trade(100, 105)), DAI, 0, Wad(0), TRADE)
+        assert not ledger.checkpoint_due()
+        clock.now += 60
+        assert ledger.checkpoint_due()
+
+    def test_should_ignore_an_unreadable_checkpoint(self, clock, tmpdir):
+        # given
+        path = tmpdir.join('pnl.json')
+        path.write('{"version": 1, "tot')
+
+        # expect
+        assert PnLLedger(OUR_ADDRESS, str(path)).profit(DAI) == Wad(0)
+
+    def test_should_ignore_a_checkpoint_of_another_version(self, clock, tmpdir):
+        # given
+        path = tmpdir.join('pnl.json')
+        path.write(json.dumps({'version': 0}))
+
+        # expect
+        assert PnLLedger(OUR_ADDRESS, str(path)).totals.counts[TRADE] == 0
+
+
+class TestOutcome:
+    def test_should_tell_trades_from_failures(self):
+        assert outcome(receipt([]), cancellation=False) == TRADE
+        assert outcome(receipt([], successful=False), cancellation=False) == FAILURE
+
+    def test_should_count_cancellations_without_logs_as_cancellations(self):
+        assert outcome(receipt([], successful=False), cancellation=True) == CANCELLATION
+
+
+class TestTradeMinedAfterItsCancellation:
+    def test_should_record_the_trade(self, monkeypatch):
+        # given
+        monkeypatch.setattr(submission_manager, 'Transact', FakeTransact)
+        monkeypatch.setattr(submission_manager, 'Receipt', FakeReceipt)
+
+        node = FakeNode()
+        ledger = PnLLedger(OUR_ADDRESS)
+
+        def on_receipt(pending_transaction, receipt, cancellation: bool):
+            gas_spent = receipt.gas_used * pending_transaction.gas_price_of(receipt.transaction_hash)
+            ledger.record(receipt, DAI, gas_spent, Wad(gas_spent * 200), outcome(receipt, cancellation))
+
+        manager = SubmissionManager(node, OUR_ADDRESS, FixedGasPrice(10 * 10**9), on_receipt, poll_interval=3600)
+        try:
+            transact = FakeTransact(None, node, None, TX_MANAGER, None, 'execute', [])
+            pending_transaction = manager.submit(fake_opportunity(), transact, 100)
+            manager.on_block(101, lambda pending_transaction: False)
+            assert pending_transaction.cancelled
+
+            # when
+            node.mine(pending_transaction.transaction_hashes[0], gas_used=150000, transfers=trade(100, 103))
+            manager._poll()
+        finally:
+            manager.running = False
+
+        # then
+        assert ledger.totals.counts == {TRADE: 1, FAILURE: 0, CANCELLATION: 0}
+        # gas at the price of the trade, not of its cancellation
+        assert ledger.totals.gas_spent == 150000 * 10 * 10**9
+        assert ledger.profit(DAI) == Wad(3 * 10**18 - 150000 * 10 * 10**9 * 200)
@@ -0,0 +1,117 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+
+import pytest
+
+from pymaker.numeric import Wad
+
+from simple_arbitrage_keeper.replay import SimpleArbitrageReplay
+from simple_arbitrage_keeper.simple_arbitrage_keeper import SimpleArbitrageKeeper
+from simple_arbitrage_keeper.snapshot_recorder import SnapshotFile
+from tests.stand_ins import OASIS_ADDRESS, OUR_ADDRESS, TX_MANAGER_ADDRESS, OasisHandler, RpcHandler, StandIn, \
+    SyntheticMarkets
+
+FIRST_BLOCK = 1000
+BLOCKS = 5
+
+
+@pytest.fixture
+def recording(tmpdir) -> tuple:
+    """ `(config, recording)` paths of blocks recorded by the keeper, configured like the README example,
+    i.e. without `entry-token-name` """
+    markets = SyntheticMarkets(pairs=2)
+    oasis_api = StandIn(OasisHandler, markets)
+    node = StandIn(RpcHandler, markets)
+
+    config = tmpdir.join('pairs.json')
+    config.write(json.dumps({'pairs': [{key: value for key, value in pair.items() if key != 'entry-token-name'}
+                                       for pair in markets.pairs]}))
+    recording = tmpdir.join('snapshots.bin')
+
+    keeper = SimpleArbitrageKeeper(['--rpc-host', node.uri, '--oasis-api-endpoint', oasis_api.uri,
+                                    '--eth-from', OUR_ADDRESS, '--eth-key',
+                                    '--oasis-address', OASIS_ADDRESS, '--tx-manager', TX_MANAGER_ADDRESS,
+                                    '--config', str(config), '--min-profit', str(10**12), '--max-engagement', '10',
+                                    '--record-snapshots', str(recording)])
+    try:
+        keeper.startup()
+        for block_number in range(FIRST_BLOCK, FIRST_BLOCK + BLOCKS):
+            markets.advance(block_number)
+            keeper.find_best_opportunity_available(block_number)
+    finally:
+        keeper.shutdown()
+        oasis_api.stop()
+        node.stop()
+
+    yield str(config), str(recording)
+
+
+def replay(config: str, recording: str, output: str):
+    SimpleArbitrageReplay(['--snapshots', recording, '--config', config,
+                           '--min-profit', str(10**12), '--max-engagement', '10', '--output', output]).main()
+
+    with open(output, 'r') as file:
+        return [json.loads(line) for line in file]
+
+
+class TestReplayRoundTrip:
+    def test_should_name_the_recorded_books_like_the_keeper(self, recording):
+        # when
+        with SnapshotFile(recording[1]) as file:
+            records = list(file)
+
+        # then
+        assert [record['block_number'] for record in records] == list(range(FIRST_BLOCK, FIRST_BLOCK + BLOCKS))
+        assert all(sorted((book['arb_token_name'], book['entry_token_name']) for book in record['books']) ==
+                   [('TK00', 'DAI'), ('TK01', 'DAI')] for record in records)
+
+    def test_should_replay_the_decisions_of_the_keeper(self, recording, tmpdir):
+        # given
+        with SnapshotFile(recording[1]) as file:
+            recorded = [record['opportunities'] for record in file]
+
+        # when
+        decisions = replay(*recording, str(tmpdir.join('decisions.jsonl')))
+
+        # then
+        assert len(decisions) == BLOCKS
+        for decision, opportunities in zip(decisions, recorded):
+            assert len(opportunities) == 2
+            assert [(opportunity['pair'], opportunity['route'], opportunity['profit'], opportunity['executed'])
+                    for opportunity in decision['opportunities']] == \
+                   [(opportunity['pair'], opportunity['route'], str(Wad(int(opportunity['profit']))), opportunity['executed'])
+                    for opportunity in opportunities]
+
+    def test_should_warn_of_books_missing_from_the_recording(self, recording, tmpdir, caplog):
+        # given
+        config = json.loads(open(recording[0]).read())
+        config['pairs'][1]['arb-token-name'] = 'MISSING'
+        tmpdir.join('missing.json').write(json.dumps(config))
+
+        # when
+        with caplog.at_level(logging.WARNING):
+            decisions = replay(str(tmpdir.join('missing.json')), recording[1], str(tmpdir.join('decisions.jsonl')))
+
+        # then
+        assert all([opportunity['pair'] for opportunity in decision['opportunities']] == ['TK00/DAI']
+                   for decision in decisions)
+        assert [record.getMessage() for record in caplog.records if record.levelno == logging.WARNING] == \
+               [f"No MISSING/DAI order book recorded in block #{FIRST_BLOCK}, the pair is not evaluated in blocks "
+                f"without it (recorded books: TK00/DAI, TK01/DAI)"]
@@ -0,0 +1,218 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from pymaker import Address
+from pymaker.numeric import Wad
+
+from simple_arbitrage_keeper.arbitrage_pair import ArbitragePair
+from simple_arbitrage_keeper.gas_model import GasModel
+from simple_arbitrage_keeper.market_snapshot import MarketSnapshot
+from simple_arbitrage_keeper.oasis_api import OrderBookSnapshot
+from simple_arbitrage_keeper.route_search import Cycle, OasisLeg, RouteSearch, UniswapLeg
+from simple_arbitrage_keeper.sizing import ProfitCurveSearch
+from simple_arbitrage_keeper.uniswap import UniswapReserves
+from tests.stand_ins import address
+
+DAI = Address(address(1000))
+TKA = Address(address(2000))
+TKB = Address(address(2001))
+DAI_EXCHANGE = Address(address(3000))
+TKA_EXCHANGE = Address(address(4000))
+TKB_EXCHANGE = Address(address(4001))
+
+TOKEN_NAMES = {DAI: 'DAI', TKA: 'TKA', TKB: 'TKB'}
+GAS_PRICE = 10 * 10**9
+
+
+def pair(arb_token: Address, uniswap_arb_exchange: Address, min_profit: float = 1.0, max_engagement: float = 10000.0):
+    return ArbitragePair(entry_token=DAI, arb_token=arb_token, entry_token_name='DAI', arb_token_name=TOKEN_NAMES[arb_token],
+                         uniswap_entry_exchange=DAI_EXCHANGE, uniswap_arb_exchange=uniswap_arb_exchange,
+                         min_profit=Wad.from_number(min_profit), max_engagement=Wad.from_number(max_engagement))
+
+
+def snapshot(tka_book: tuple, tkb_book: tuple, balance: float = 1000.0) -> MarketSnapshot:
+    """ Uniswap prices TKA at 10 DAI and TKB at 20 DAI, each Oasis book has one `(bid, ask)` level of 100 tokens """
+    return MarketSnapshot(block_number=1,
+                          balances={DAI: Wad.from_number(balance)},
+                          books={('TKA', 'DAI'): OrderBookSnapshot(1, [[tka_book[0], 100]], [[tka_book[1], 100]], None, 0.0),
+                                 ('TKB', 'DAI'): OrderBookSnapshot(1, [[tkb_book[0], 100]], [[tkb_book[1], 100]], None, 0.0)},
+                          reserves={DAI_EXCHANGE: UniswapReserves(Wad.from_number(200000), Wad.from_number(1000)),
+                                    TKA_EXCHANGE: UniswapReserves(Wad.from_number(20000), Wad.from_number(1000)),
+                                    TKB_EXCHANGE: UniswapReserves(Wad.from_number(10000), Wad.from_number(1000))},
+                          gas_price=GAS_PRICE,
+                          timestamp=0.0)
+
+
+# TKA is cheap on Oasis and TKB is rich, so buying TKA on Oasis, swapping it for TKB on Uniswap
+# and selling TKB on Oasis is the most profitable cycle
+MISPRICED = snapshot(tka_book=(9.4, 9.5), tkb_book=(20.5, 20.7))
+CONSISTENT = snapshot(tka_book=(9.9, 10.1), tkb_book=(19.8, 20.2))
+
+
+class TestRouteSearch:
+    pairs = [pair(TKA, TKA_EXCHANGE), pair(TKB, TKB_EXCHANGE)]
+
+    @staticmethod
+    def search(route_search: RouteSearch, market: MarketSnapshot):
+        return route_search.search(market, ProfitCurveSearch(), GasModel())
+
+    def test_should_build_every_leg_once(self):
+        # when
+        route_search = RouteSearch(self.pairs, TOKEN_NAMES)
+
+        # then
+        assert route_search.nodes == [DAI, TKA, TKB]
+        assert len([leg for leg in route_search.legs if isinstance(leg, OasisLeg)]) == 4
+        assert len([leg for leg in route_search.legs if isinstance(leg, UniswapLeg)]) == 6
+        assert sum(len(adjacent) for adjacent in route_search.adjacency) == 10
+
+    def test_should_find_the_three_leg_cycle(self):
+        # when
+        opportunity = self.search(RouteSearch(self.pairs, TOKEN_NAMES), MISPRICED)
+
+        # then
+        assert opportunity.pair.name == 'DAI -Oasis-> TKA -Uniswap-> TKB -Oasis-> DAI'
+        assert opportunity.route == ('Oasis', 'Uniswap', 'Oasis')
+        assert opportunity.net_profit > Wad(0)
+        assert opportunity.is_profitable()
+
+    def test_should_size_the_trade_within_the_books_and_balance(self):
+        # when
+        opportunity = self.search(RouteSearch(self.pairs, TOKEN_NAMES), MISPRICED)
+
+        # then
+        # 100 TKA at 9.5 DAI is all the asks can fill
+        assert Wad(0) < opportunity.entry_amount <= Wad.from_number(950)
+        assert len(opportunity.buy_amounts) == 3
+        assert opportunity.buy_amounts[-1] > opportunity.entry_amount
+        assert opportunity.profit == opportunity.pair.route_profit(opportunity.route, opportunity.entry_amount, MISPRICED)
+
+    def test_should_only_find_two_leg_cycles_up_to_two_hops(self):
+        # when
+        opportunity = self.search(RouteSearch(self.pairs, TOKEN_NAMES, min_hops=2, max_hops=2), MISPRICED)
+
+        # then
+        assert len(opportunity.pair.legs) == 2
+
+    def test_should_skip_the_two_leg_cycles_of_the_pairs(self):
+        # given
+        route_search = RouteSearch(self.pairs, TOKEN_NAMES)
+        weights = route_search.weights(MISPRICED)
+
+        # when
+        cycles = route_search.negative_cycles(0, weights)
+
+        # then
+        assert cycles
+        assert all(weight < 0 for (weight, _) in cycles)
+        assert all(3 <= len(legs) <= 4 for (_, legs) in cycles)
+
+    def test_should_drop_cycles_visiting_a_token_twice(self):
+        # given
+        route_search = RouteSearch(self.pairs, TOKEN_NAMES, min_hops=4, max_hops=4)
+
+        # expect
+        # with three tokens, every four leg cycle goes through one of them twice
+        assert route_search.negative_cycles(0, route_search.weights(MISPRICED)) == []
+
+    def test_should_find_nothing_in_consistent_markets(self):
+        assert self.search(RouteSearch(self.pairs, TOKEN_NAMES), CONSISTENT) is None
+
+    def test_should_skip_entry_tokens_without_balance(self):
+        assert self.search(RouteSearch(self.pairs, TOKEN_NAMES), snapshot((9.4, 9.5), (20.5, 20.7), balance=0)) is None
+
+    def test_should_ignore_an_empty_book(self):
+        # given
+        market = snapshot((9.4, 9.5), (20.5, 20.7))
+        market.books[('TKA', 'DAI')] = OrderBookSnapshot(1, [], [], None, 0.0)
+
+        # when
+        opportunity = self.search(RouteSearch(self.pairs, TOKEN_NAMES), market)
+
+        # then
+        assert ('oasis', ('TKA', 'DAI')) not in opportunity.pair.resources
+
+    def test_should_use_the_most_conservative_settings_of_the_pairs(self):
+        # given
+        pairs = [pair(TKA, TKA_EXCHANGE, min_profit=1.0, max_engagement=500.0),
+                 pair(TKB, TKB_EXCHANGE, min_profit=5.0, max_engagement=800.0)]
+        route_search = RouteSearch(pairs, TOKEN_NAMES)
+
+        # expect
+        assert route_search.sources() == {0: (Wad.from_number(5), Wad.from_number(500))}
+
+        # when
+        pairs[1].max_engagement = Wad.from_number(100)
+
+        # then
+        assert route_search.sources() == {0: (Wad.from_number(5), Wad.from_number(100))}
+
+    def test_should_cap_the_trade_at_the_max_engagement(self):
+        # given
+        pairs = [pair(TKA, TKA_EXCHANGE, max_engagement=200.0), pair(TKB, TKB_EXCHANGE, max_engagement=200.0)]
+
+        # when
+        opportunity = self.search(RouteSearch(pairs, TOKEN_NAMES), MISPRICED)
+
+        # then
+        assert opportunity.entry_amount <= Wad.from_number(200)
+
+    def test_should_reject_invalid_hop_limits(self):
+        with pytest.raises(AssertionError):
+            RouteSearch(self.pairs, TOKEN_NAMES, min_hops=1)
+        with pytest.raises(AssertionError):
+            RouteSearch(self.pairs, TOKEN_NAMES, min_hops=4, max_hops=3)
+
+
+class TestCycle:
+    legs = (OasisLeg(DAI, TKA, ('TKA', 'DAI'), buys_base=True),
+            UniswapLeg(TKA, TKB, TKA_EXCHANGE, TKB_EXCHANGE),
+            OasisLeg(TKB, DAI, ('TKB', 'DAI'), buys_base=False))
+
+    def cycle(self) -> Cycle:
+        return Cycle(self.legs, DAI_EXCHANGE, Wad.from_number(1), Wad.from_number(1000), TOKEN_NAMES)
+
+    def test_should_be_recognized_when_found_again(self):
+        assert self.cycle() == self.cycle()
+        assert len({self.cycle(), self.cycle()}) == 1
+
+    def test_should_stand_in_for_a_pair(self):
+        # when
+        cycle = self.cycle()
+
+        # then
+        assert cycle.entry_token == DAI
+        assert cycle.tokens == [DAI, TKA, TKB]
+        assert cycle.route == ('Oasis', 'Uniswap', 'Oasis')
+        assert cycle.resources == {('balance', DAI), ('oasis', ('TKA', 'DAI')), ('oasis', ('TKB', 'DAI')),
+                                   ('uniswap', TKA_EXCHANGE), ('uniswap', TKB_EXCHANGE)}
+        assert cycle.uniswap_markets == [(DAI, DAI_EXCHANGE), (TKA, TKA_EXCHANGE), (TKB, TKB_EXCHANGE)]
+
+    def test_should_chain_the_fills_of_its_legs(self):
+        # when
+        amounts = self.cycle().amounts(Wad.from_number(95), MISPRICED)
+
+        # then
+        assert amounts[0] == 10 * 10**18
+        assert amounts[1] == UniswapLeg(TKA, TKB, TKA_EXCHANGE, TKB_EXCHANGE).fill(10 * 10**18, MISPRICED)
+        assert amounts[2] == amounts[1] * 205 // 10
+
+    def test_should_not_be_filled_beyond_the_depth_of_a_book(self):
+        assert self.cycle().amounts(Wad.from_number(951), MISPRICED) is None
+        assert self.cycle().route_profit(self.cycle().route, Wad.from_number(951), MISPRICED) is None
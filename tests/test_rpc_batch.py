@@ -0,0 +1,154 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from pymaker import Address
+
+from simple_arbitrage_keeper.rpc_batch import BatchReader
+from tests.stand_ins import ENTRY_EXCHANGE, ENTRY_TOKEN, ETH_RESERVE, ETH_PRICE, GAS_PRICE, OUR_ADDRESS, OUR_BALANCE, \
+    RpcHandler, StandIn, SyntheticMarkets
+
+
+@pytest.fixture
+def markets() -> SyntheticMarkets:
+    markets = SyntheticMarkets()
+    markets.advance(1000)
+    return markets
+
+
+@pytest.fixture
+def nodes(markets):
+    nodes = [StandIn(RpcHandler, markets), StandIn(RpcHandler, markets)]
+    yield nodes
+    for node in nodes:
+        node.stop()
+
+
+def read_all(reader: BatchReader) -> tuple:
+    batch = reader.batch(1000)
+    results = (batch.balance_of(Address(ENTRY_TOKEN), Address(ENTRY_EXCHANGE)),
+               batch.balance_of(Address(ENTRY_TOKEN), Address(OUR_ADDRESS)),
+               batch.eth_balance(Address(ENTRY_EXCHANGE)),
+               batch.gas_price(),
+               batch.allowance(Address(ENTRY_TOKEN), Address(OUR_ADDRESS), Address(ENTRY_EXCHANGE)),
+               batch.owner(Address(ENTRY_EXCHANGE)),
+               batch.logs(Address(ENTRY_EXCHANGE), 990, 1000, []))
+    batch.execute()
+    return results
+
+
+class TestBatchReader:
+    def test_should_send_all_calls_in_one_request(self, nodes):
+        # given
+        reader = BatchReader(nodes[0].uri, timeout=5.0)
+
+        # when
+        results = read_all(reader)
+
+        # then
+        assert [result.value for result in results] == [int(ETH_RESERVE * ETH_PRICE), OUR_BALANCE, ETH_RESERVE,
+                                                         GAS_PRICE, 2**256 - 1, Address(OUR_ADDRESS), []]
+        assert nodes[0].counts['requests'] == 1
+        assert nodes[0].counts['calls'] == 7
+        assert nodes[0].counts['eth_call'] == 4
+
+    def test_should_match_responses_to_calls_by_id(self, nodes):
+        # given
+        nodes[0].reverse_batches = True
+        reader = BatchReader(nodes[0].uri, timeout=5.0)
+
+        # when
+        results = read_all(reader)
+
+        # then
+        assert results[0].value == int(ETH_RESERVE * ETH_PRICE)
+        assert results[1].value == OUR_BALANCE
+        assert results[3].value == GAS_PRICE
+
+    def test_should_use_fresh_ids_for_every_batch(self, nodes):
+        # given
+        reader = BatchReader(nodes[0].uri, timeout=5.0)
+
+        # when
+        first = reader.batch()
+        first.gas_price()
+        second = reader.batch()
+        second.gas_price()
+
+        first.execute()
+        second.execute()
+
+        # then
+        assert first.calls[0].value == second.calls[0].value == GAS_PRICE
+        assert next(reader.request_ids) == 3
+
+    def test_should_fail_only_the_calls_which_failed(self, nodes):
+        # given
+        nodes[0].call_errors['eth_gasPrice'] = 'no gas price here'
+        reader = BatchReader(nodes[0].uri, timeout=5.0)
+
+        # when
+        results = read_all(reader)
+
+        # then
+        assert results[0].value == int(ETH_RESERVE * ETH_PRICE)
+        assert results[2].value == ETH_RESERVE
+        with pytest.raises(Exception, match='no gas price here'):
+            results[3].value
+
+    def test_should_not_return_results_before_executing(self, nodes):
+        # given
+        batch = BatchReader(nodes[0].uri, timeout=5.0).batch()
+
+        # when
+        result = batch.gas_price()
+
+        # then
+        with pytest.raises(Exception, match='not been executed'):
+            result.value
+        assert len(batch) == 1
+
+    def test_should_not_send_empty_batches(self, nodes):
+        # when
+        BatchReader(nodes[0].uri, timeout=5.0).batch().execute()
+
+        # then
+        assert nodes[0].counts['requests'] == 0
+
+    def test_should_fail_over_to_the_next_node(self, nodes):
+        # given
+        reader = BatchReader([nodes[0].uri, nodes[1].uri], timeout=5.0)
+        nodes[0].status = 500
+
+        # when
+        results = read_all(reader)
+
+        # then
+        assert results[1].value == OUR_BALANCE
+        assert nodes[0].counts['failed'] == 1
+        assert nodes[1].counts['requests'] == 1
+
+    def test_should_fail_if_every_node_fails(self, nodes):
+        # given
+        reader = BatchReader([nodes[0].uri, nodes[1].uri], timeout=5.0)
+        nodes[0].status = 500
+        nodes[1].status = 502
+
+        # expect
+        with pytest.raises(Exception, match='Failed to execute JSON-RPC batch'):
+            read_all(reader)
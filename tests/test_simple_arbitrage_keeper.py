@@ -0,0 +1,66 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+import pytest
+
+from pymaker import Address
+
+from simple_arbitrage_keeper.simple_arbitrage_keeper import SimpleArbitrageKeeper
+from tests.stand_ins import OASIS_ADDRESS, OUR_ADDRESS, TX_MANAGER_ADDRESS, OasisHandler, RpcHandler, StandIn, \
+    SyntheticMarkets
+
+
+@pytest.fixture
+def keeper(tmpdir):
+    markets = SyntheticMarkets(pairs=2)
+    oasis_api = StandIn(OasisHandler, markets)
+    node = StandIn(RpcHandler, markets)
+
+    config = tmpdir.join('config.json')
+    config.write(json.dumps({'pairs': markets.pairs}))
+
+    yield SimpleArbitrageKeeper(['--rpc-host', node.uri, '--oasis-api-endpoint', oasis_api.uri,
+                                 '--eth-from', OUR_ADDRESS, '--eth-key',
+                                 '--oasis-address', OASIS_ADDRESS, '--tx-manager', TX_MANAGER_ADDRESS,
+                                 '--config', str(config), '--min-profit', '1', '--max-engagement', '10'])
+
+    oasis_api.stop()
+    node.stop()
+
+
+class TestSimpleArbitrageKeeper:
+    def test_should_not_construct_contracts_before_they_are_used(self, keeper):
+        # expect
+        assert keeper.contracts.contracts == {}
+        assert keeper.tokens.contracts == {}
+        assert keeper.uniswap_exchanges.contracts == {}
+        assert set(keeper.contracts) == {Address(OASIS_ADDRESS), Address(TX_MANAGER_ADDRESS)}
+        assert len(keeper.tokens) == 3
+
+    def test_should_construct_contracts_once_on_first_use(self, keeper):
+        # when
+        tx_manager = keeper.tx_manager
+
+        # then
+        assert keeper.tx_manager is tx_manager
+        assert list(keeper.contracts.contracts) == [Address(TX_MANAGER_ADDRESS)]
+
+    def test_should_name_tokens(self, keeper):
+        assert keeper.token_name(Address('0x4F96Fe3b7A6Cf9725f59d353F723c1bDb64CA6Aa')) == 'DAI'
+        assert keeper.token_name(keeper.pairs[1].arb_token) == 'TK01'
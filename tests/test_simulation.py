@@ -0,0 +1,147 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from types import SimpleNamespace
+
+import pytest
+
+from pymaker import Address
+from pymaker.numeric import Wad
+
+from simple_arbitrage_keeper.arbitrage_pair import ArbitragePair
+from simple_arbitrage_keeper.gas_model import GasModel
+from simple_arbitrage_keeper.market_snapshot import MarketSnapshot
+from simple_arbitrage_keeper.oasis_api import OrderBookSnapshot
+from simple_arbitrage_keeper.rpc_batch import BatchReader
+from simple_arbitrage_keeper.simulation import BundleSimulator
+from simple_arbitrage_keeper.sizing import ProfitCurveSearch
+from simple_arbitrage_keeper.uniswap import queue_reserves
+from tests.stand_ins import GAS_PRICE, OUR_ADDRESS, TX_MANAGER_ADDRESS, RpcHandler, StandIn, SyntheticMarkets
+
+EXECUTE = '0xfeedbeef'
+
+
+class RecordingMarkets(SyntheticMarkets):
+    """ Synthetic markets recording the `eth_call` parameters sent to the transaction manager """
+
+    def __init__(self):
+        super().__init__(pairs=1)
+        self.calls = []
+
+    def rpc(self, method: str, params: list):
+        if method == 'eth_call' and params[0]['to'].lower() == TX_MANAGER_ADDRESS.lower():
+            self.calls.append(params)
+            return '0x'
+
+        return super().rpc(method, params)
+
+
+def arbitrage_transaction() -> SimpleNamespace:
+    """ A :py:class:`pymaker.Transact` double, only what the simulator encodes and calls """
+    return SimpleNamespace(address=Address(TX_MANAGER_ADDRESS), function_name='execute', parameters=[],
+                           contract=SimpleNamespace(encodeABI=lambda fn_name, args: EXECUTE))
+
+
+class TestBundleSimulator:
+    @pytest.fixture
+    def markets(self) -> RecordingMarkets:
+        return RecordingMarkets()
+
+    @pytest.fixture
+    def node(self, markets):
+        node = StandIn(RpcHandler, markets)
+        yield node
+        node.stop()
+
+    @pytest.fixture
+    def pair(self, markets) -> ArbitragePair:
+        config = markets.pairs[0]
+        return ArbitragePair(Address(config['entry-token']), Address(config['arb-token']), config['entry-token-name'],
+                             config['arb-token-name'], Address(config['uniswap-entry-exchange']),
+                             Address(config['uniswap-arb-exchange']), Wad.from_number(1), Wad.from_number(1000))
+
+    @pytest.fixture
+    def simulator(self, node) -> BundleSimulator:
+        return BundleSimulator(BatchReader(node.uri, timeout=5.0), GasModel(), Address(OUR_ADDRESS))
+
+    @pytest.fixture
+    def snapshot(self, pair, simulator) -> MarketSnapshot:
+        """ The latest reserves, and an Oasis book asking 5% below the Uniswap price of the arb token """
+        batch = simulator.batch_reader.batch()
+        reserves_results = {exchange: queue_reserves(batch, token, exchange) for (token, exchange) in pair.uniswap_markets}
+        batch.execute()
+        reserves = {exchange: reserves_result() for exchange, reserves_result in reserves_results.items()}
+
+        uniswap_price = float(reserves[pair.uniswap_entry_exchange].token_reserve) / \
+                        float(reserves[pair.uniswap_arb_exchange].token_reserve)
+        book = OrderBookSnapshot(1, [[uniswap_price * 0.94, 100.0]], [[uniswap_price * 0.95, 100.0]], None, 0.0)
+
+        return MarketSnapshot(1, {pair.entry_token: Wad.from_number(1000)}, {pair.book_key: book}, reserves,
+                              GAS_PRICE, 0.0)
+
+    @pytest.fixture
+    def opportunity(self, pair, snapshot):
+        opportunity = pair.evaluate(snapshot, ProfitCurveSearch(), GasModel())
+        assert opportunity.is_profitable()
+        return opportunity
+
+    def test_should_accept_a_bundle_still_profitable_at_the_pending_block(self, simulator, opportunity, snapshot,
+                                                                          markets, node):
+        # given
+        requests = node.counts['requests']
+
+        # when
+        simulation = simulator.simulate(opportunity, arbitrage_transaction(), snapshot, GAS_PRICE)
+
+        # then
+        assert simulation.succeeded
+        assert simulation.error is None
+        assert simulation.profit == opportunity.profit
+        assert simulation.net_profit == opportunity.net_profit
+        assert simulation.is_profitable()
+
+        # and
+        assert markets.calls == [[{'to': TX_MANAGER_ADDRESS, 'data': EXECUTE, 'from': OUR_ADDRESS}, 'pending']]
+        assert node.counts['requests'] == requests + 1
+
+    def test_should_reject_a_bundle_which_would_revert(self, simulator, opportunity, snapshot, node):
+        # given
+        node.call_errors['eth_call'] = 'execution reverted'
+
+        # when
+        simulation = simulator.simulate(opportunity, arbitrage_transaction(), snapshot, GAS_PRICE)
+
+        # then
+        assert not simulation.succeeded
+        assert 'execution reverted' in simulation.error
+        assert simulation.net_profit is None
+        assert not simulation.is_profitable()
+
+    def test_should_reject_a_bundle_no_longer_profitable_at_the_pending_block(self, simulator, opportunity, snapshot,
+                                                                              markets):
+        # given
+        # the pending block moves the Uniswap price of the arb token down to the Oasis ask
+        key = (markets.pairs[0]['arb-token'], markets.pairs[0]['uniswap-arb-exchange'])
+        markets.token_reserves[key] = int(markets.token_reserves[key] / 0.95)
+
+        # when
+        simulation = simulator.simulate(opportunity, arbitrage_transaction(), snapshot, GAS_PRICE)
+
+        # then
+        assert simulation.succeeded
+        assert simulation.profit < opportunity.profit
+        assert not simulation.is_profitable()
@@ -0,0 +1,111 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from simple_arbitrage_keeper.sizing import ProfitCurveSearch
+
+
+class TestProfitCurveSearch:
+    search = ProfitCurveSearch()
+
+    def test_should_find_the_top_of_a_concave_curve(self):
+        # when
+        size, profit = self.search.search(lambda size: size * (10**6 - size), 0, 10**6)
+
+        # then
+        assert abs(size - 500000) <= 1
+        assert profit == size * (10**6 - size)
+
+    def test_should_find_the_top_of_a_curve_peaking_at_a_bound(self):
+        assert self.search.search(lambda size: size, 0, 10**18) == (10**18, 10**18)
+        assert self.search.search(lambda size: -size, 10, 10**18) == (10, -10)
+
+    def test_should_not_be_trapped_by_a_local_maximum(self):
+        # given
+        def profit_function(size: int):
+            return max(50000 - abs(size - 150000), 200000 - abs(size - 800000), 0)
+
+        # when
+        size, profit = self.search.search(profit_function, 0, 10**6)
+
+        # then
+        assert abs(size - 800000) <= 1
+        assert profit == profit_function(size)
+
+    def test_should_stay_below_the_depth_of_the_book(self):
+        # given
+        def profit_function(size: int):
+            return None if size > 600 else size
+
+        # when
+        size, profit = self.search.search(profit_function, 0, 1000)
+
+        # then
+        assert 600 - size <= 1
+        assert profit == size
+
+    def test_should_return_none_if_nothing_can_be_filled(self):
+        assert self.search.search(lambda size: None, 0, 1000)[1] is None
+
+    def test_should_return_the_smallest_loss_if_every_size_loses(self):
+        # given
+        def profit_function(size: int):
+            return -abs(size - 600000) - 10
+
+        # when
+        size, profit = self.search.search(profit_function, 0, 10**6)
+
+        # then
+        assert abs(size - 600000) <= 1
+        assert profit == profit_function(size) < 0
+
+    def test_should_not_return_a_size_of_zero_if_every_size_loses(self):
+        assert self.search.search(lambda size: -10 - size, 0, 10**6) == (1, -11)
+        assert self.search.search(lambda size: 0 if size == 0 else -10, 0, 1000) == (1, -10)
+
+    def test_should_only_return_a_size_of_zero_for_an_empty_range(self):
+        assert self.search.search(lambda size: -size, 0, 0) == (0, 0)
+
+    def test_should_prefer_the_smallest_size_of_equal_profit(self):
+        assert self.search.search(lambda size: 7, 3, 1000) == (3, 7)
+
+    def test_should_evaluate_only_low_for_an_empty_range(self):
+        # given
+        evaluated = []
+
+        def profit_function(size: int):
+            evaluated.append(size)
+            return size
+
+        # expect
+        assert self.search.search(profit_function, 5, 5) == (5, 5)
+        assert self.search.search(profit_function, 5, 4) == (5, 5)
+        assert evaluated == [5, 5]
+
+    def test_should_evaluate_each_size_once(self):
+        # given
+        evaluated = []
+
+        def profit_function(size: int):
+            evaluated.append(size)
+            return size * (10**18 - size)
+
+        # when
+        ProfitCurveSearch(grid_points=8).search(profit_function, 0, 10**18)
+
+        # then
+        assert len(evaluated) == len(set(evaluated))
+        assert len(evaluated) < 100
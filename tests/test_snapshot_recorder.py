@@ -0,0 +1,165 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from pymaker import Address
+from pymaker.numeric import Wad
+
+from simple_arbitrage_keeper.market_snapshot import MarketSnapshot
+from simple_arbitrage_keeper.oasis_api import OrderBookSnapshot
+from simple_arbitrage_keeper.snapshot_recorder import MAGIC, SnapshotFile, SnapshotRecorder, encode_record, \
+    is_snapshot_recording
+from simple_arbitrage_keeper.uniswap import UniswapReserves
+
+TOKEN = Address('0x0000000000000000000000000000000000001000')
+EXCHANGE = Address('0x0000000000000000000000000000000000003000')
+
+
+def snapshot(block_number: int) -> MarketSnapshot:
+    return MarketSnapshot(block_number=block_number,
+                          balances={TOKEN: Wad(block_number * 10**18)},
+                          books={('MKR', 'DAI'): OrderBookSnapshot(block_number,
+                                                                   [[500.25, 1.5], [499.0, 0.125]],
+                                                                   [[501.5, 2.0]], None, 1000.0)},
+                          reserves={EXCHANGE: UniswapReserves(Wad(7 * 10**18), Wad(3 * 10**18 + block_number))},
+                          gas_price=10**9,
+                          timestamp=1000.0 + block_number)
+
+
+def opportunity(profit: int):
+    return SimpleNamespace(pair=SimpleNamespace(name='MKR/DAI'), route=['oasis', 'uniswap'],
+                           entry_amount=Wad(10**18), profit=Wad(profit), net_profit=Wad(profit - 1),
+                           profit_oasis_to_uniswap=Wad(profit), profit_uniswap_to_oasis=None)
+
+
+def record(path: str, block_numbers: list):
+    recorder = SnapshotRecorder(path)
+    for block_number in block_numbers:
+        executed = opportunity(block_number)
+        recorder.record(snapshot(block_number), [executed, opportunity(-block_number)], [executed])
+    recorder.close()
+
+
+def recorded_blocks(path: str) -> list:
+    with SnapshotFile(path) as recording:
+        return [data['block_number'] for data in recording]
+
+
+class TestSnapshotRecorder:
+    def test_should_round_trip_snapshots(self, tmpdir):
+        # given
+        path = str(tmpdir.join('recording'))
+
+        # when
+        record(path, [1, 2, 3])
+
+        # then
+        assert is_snapshot_recording(path)
+        with SnapshotFile(path) as recording:
+            assert [block_number for block_number, _ in recording.offsets()] == [1, 2, 3]
+            data = list(recording)
+
+        restored = MarketSnapshot.from_dict(data[1])
+        assert restored.to_dict() == snapshot(2).to_dict()
+        assert restored.book(('MKR', 'DAI')).bid_index.cumulative_base == [15 * 10**17, 1625 * 10**15]
+        assert data[1]['opportunities'] == [
+            {'pair': 'MKR/DAI', 'route': 'oasis/uniswap', 'entry_amount': str(10**18), 'profit': '2',
+             'net_profit': '1', 'profit_oasis_to_uniswap': '2', 'profit_uniswap_to_oasis': None, 'executed': True},
+            {'pair': 'MKR/DAI', 'route': 'oasis/uniswap', 'entry_amount': str(10**18), 'profit': '-2',
+             'net_profit': '-3', 'profit_oasis_to_uniswap': '-2', 'profit_uniswap_to_oasis': None, 'executed': False}]
+
+    def test_should_append_to_an_existing_recording(self, tmpdir):
+        # given
+        path = str(tmpdir.join('recording'))
+        record(path, [1, 2])
+
+        # when
+        record(path, [3])
+
+        # then
+        assert recorded_blocks(path) == [1, 2, 3]
+
+    def test_should_truncate_a_torn_record_before_appending(self, tmpdir):
+        # given
+        path = str(tmpdir.join('recording'))
+        record(path, [1, 2])
+        with open(path, 'ab') as file:
+            file.write(encode_record(snapshot(3), [], [])[:-5])
+
+        # when
+        record(path, [4])
+
+        # then
+        assert recorded_blocks(path) == [1, 2, 4]
+
+    def test_should_truncate_a_torn_record_header_before_appending(self, tmpdir):
+        # given
+        path = str(tmpdir.join('recording'))
+        record(path, [1])
+        with open(path, 'ab') as file:
+            file.write(encode_record(snapshot(2), [], [])[:3])
+
+        # when
+        record(path, [3])
+
+        # then
+        assert recorded_blocks(path) == [1, 3]
+
+    def test_should_truncate_a_corrupted_record_and_everything_after_it(self, tmpdir):
+        # given
+        path = str(tmpdir.join('recording'))
+        record(path, [1, 2, 3])
+        with SnapshotFile(path) as recording:
+            offset = dict(recording.offsets())[2]
+        with open(path, 'r+b') as file:
+            file.seek(offset + 20)
+            byte = file.read(1)
+            file.seek(offset + 20)
+            file.write(bytes([byte[0] ^ 0xff]))
+
+        # when
+        record(path, [4])
+
+        # then
+        assert recorded_blocks(path) == [1, 4]
+
+    def test_should_start_over_after_a_torn_magic(self, tmpdir):
+        # given
+        path = str(tmpdir.join('recording'))
+        with open(path, 'wb') as file:
+            file.write(MAGIC[:3])
+
+        # when
+        record(path, [1])
+
+        # then
+        assert recorded_blocks(path) == [1]
+
+    def test_should_not_append_to_other_files(self, tmpdir):
+        # given
+        path = str(tmpdir.join('recording'))
+        with open(path, 'wb') as file:
+            file.write(b'something else entirely')
+
+        # expect
+        with pytest.raises(Exception):
+            SnapshotRecorder(path)
+        assert os.path.getsize(path) == len(b'something else entirely')
@@ -0,0 +1,266 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from pymaker import Address
+from pymaker.gas import FixedGasPrice
+
+from simple_arbitrage_keeper import submission_manager
+from simple_arbitrage_keeper.submission_manager import SubmissionManager
+from tests.fakes import FakeNode, FakeReceipt, FakeTransact, fake_opportunity
+
+OUR_ADDRESS = Address('0x0000000000000000000000000000000000007000')
+TX_MANAGER = Address('0x0000000000000000000000000000000000006000')
+GAS_PRICE = 10 * 10**9
+
+
+class TestSubmissionManager:
+    @pytest.fixture
+    def node(self) -> FakeNode:
+        return FakeNode(pending_nonce=5)
+
+    @pytest.fixture
+    def receipts(self) -> list:
+        return []
+
+    @pytest.fixture
+    def manager(self, node, receipts, monkeypatch) -> SubmissionManager:
+        monkeypatch.setattr(submission_manager, 'Transact', FakeTransact)
+        monkeypatch.setattr(submission_manager, 'Receipt', FakeReceipt)
+
+        manager = SubmissionManager(node, OUR_ADDRESS, FixedGasPrice(GAS_PRICE),
+                                    lambda *args: receipts.append(args),
+                                    gas_buffer=1000, replace_after_blocks=2, gas_price_increase=1.125,
+                                    poll_interval=3600)
+        yield manager
+        manager.running = False
+
+    @staticmethod
+    def transact(node: FakeNode, gas: int = 150000) -> FakeTransact:
+        return FakeTransact(None, node, None, TX_MANAGER, None, 'execute', [], gas=gas)
+
+    @staticmethod
+    def profitable(pending_transaction) -> bool:
+        return True
+
+    @staticmethod
+    def unprofitable(pending_transaction) -> bool:
+        return False
+
+    def test_should_send_through_the_transact(self, manager, node):
+        # when
+        pending_transaction = manager.submit(fake_opportunity(), self.transact(node), 100)
+
+        # then
+        assert node.sent == [{'from': OUR_ADDRESS.address, 'to': TX_MANAGER.address, 'function': 'execute',
+                              'gas': 151000, 'gasPrice': GAS_PRICE, 'nonce': 5, 'hash': node.sent[0]['hash']}]
+        assert pending_transaction.transaction_hashes == [node.sent[0]['hash']]
+        assert manager.in_flight() == [pending_transaction]
+        assert manager.in_flight_resources() == {'MKR/DAI'}
+
+    def test_should_allocate_nonces_locally(self, manager, node):
+        # when
+        first = manager.submit(fake_opportunity('MKR/DAI'), self.transact(node), 100)
+        second = manager.submit(fake_opportunity('ZRX/DAI'), self.transact(node), 100)
+
+        # then
+        assert (first.nonce, second.nonce) == (5, 6)
+        assert node.calls == [('getTransactionCount', 'pending')]
+
+    def test_should_not_send_if_the_gas_estimation_fails(self, manager, node):
+        # expect
+        assert manager.submit(fake_opportunity(), self.transact(node, gas=None), 100) is None
+        assert node.sent == []
+
+    def test_should_release_the_nonce_if_the_node_rejects_the_transaction(self, manager, node):
+        # given
+        node.reject = 1
+
+        # when
+        assert manager.submit(fake_opportunity(), self.transact(node), 100) is None
+        pending_transaction = manager.submit(fake_opportunity(), self.transact(node), 100)
+
+        # then
+        assert pending_transaction.nonce == 5
+        assert manager.in_flight() == [pending_transaction]
+
+    def test_should_not_hold_the_lock_while_sending(self, manager, node):
+        # given
+        in_flight_while_sending = []
+        node.on_send = lambda transaction: in_flight_while_sending.append(manager.in_flight())
+
+        # when
+        pending_transaction = manager.submit(fake_opportunity(), self.transact(node), 100)
+
+        # then
+        assert in_flight_while_sending == [[pending_transaction]]
+
+    def test_should_replace_transactions_stuck_for_too_long(self, manager, node):
+        # given
+        pending_transaction = manager.submit(fake_opportunity(), self.transact(node), 100)
+
+        # when
+        manager.on_block(101, self.profitable)
+        manager.on_block(102, self.profitable)
+
+        # then
+        assert [transaction['gasPrice'] for transaction in node.sent] == [GAS_PRICE, 11250000000]
+        assert node.sent[1]['function'] == 'execute'
+        assert node.sent[1]['nonce'] == 5
+        assert pending_transaction.transaction_hashes == [node.sent[0]['hash'], node.sent[1]['hash']]
+        assert pending_transaction.block_number == 102
+
+    def test_should_cancel_transactions_no_longer_profitable(self, manager, node):
+        # given
+        pending_transaction = manager.submit(fake_opportunity(), self.transact(node), 100)
+
+        # when
+        manager.on_block(101, self.unprofitable)
+
+        # then
+        assert node.sent[1] == {'from': OUR_ADDRESS.address, 'to': OUR_ADDRESS.address, 'function': None,
+                                'gas': 21000, 'gasPrice': 11250000000, 'nonce': 5, 'hash': node.sent[1]['hash']}
+        assert pending_transaction.cancelled
+        assert pending_transaction.cancellation_hashes == [node.sent[1]['hash']]
+        assert pending_transaction.transaction_hashes == [node.sent[0]['hash']]
+        assert pending_transaction.transact.function_name == 'execute'
+        assert pending_transaction.gas == 151000
+
+    def test_should_retry_a_cancellation_the_node_rejected(self, manager, node):
+        # given
+        pending_transaction = manager.submit(fake_opportunity(), self.transact(node), 100)
+        node.reject = 1
+
+        # when
+        manager.on_block(101, self.unprofitable)
+
+        # then
+        assert not pending_transaction.cancelled
+        assert pending_transaction.cancellation_hashes == []
+        assert pending_transaction.gas_price == GAS_PRICE
+
+        # when
+        manager.on_block(102, self.unprofitable)
+
+        # then
+        assert pending_transaction.cancelled
+        assert [transaction['to'] for transaction in node.sent] == [TX_MANAGER.address, OUR_ADDRESS.address]
+
+    def test_should_cap_cancellations_at_the_max_gas_price(self, manager, node):
+        # given
+        manager.max_gas_price = 11 * 10**9 + 10**8
+        pending_transaction = manager.submit(fake_opportunity(), self.transact(node), 100)
+
+        # when
+        manager.on_block(101, self.unprofitable)
+
+        # then
+        assert pending_transaction.cancelled
+        assert node.sent[1]['gasPrice'] == 11 * 10**9 + 10**8
+
+    def test_should_not_cancel_below_the_increase_required_by_the_node(self, manager, node):
+        # given
+        manager.max_gas_price = 11 * 10**9 - 1
+        pending_transaction = manager.submit(fake_opportunity(), self.transact(node), 100)
+
+        # when
+        manager.on_block(101, self.unprofitable)
+
+        # then
+        assert not pending_transaction.cancelled
+        assert len(node.sent) == 1
+
+    def test_should_not_replace_beyond_the_max_gas_price(self, manager, node):
+        # given
+        manager.max_gas_price = GAS_PRICE
+        manager.submit(fake_opportunity(), self.transact(node), 100)
+
+        # when
+        manager.on_block(105, self.profitable)
+
+        # then
+        assert len(node.sent) == 1
+
+    def test_should_hand_over_the_receipt_of_the_trade(self, manager, node, receipts):
+        # given
+        pending_transaction = manager.submit(fake_opportunity(), self.transact(node), 100)
+        node.mine(pending_transaction.transaction_hashes[0], gas_used=120000)
+
+        # when
+        manager._poll()
+
+        # then
+        assert len(receipts) == 1
+        (received, receipt, cancellation) = receipts[0]
+        assert received is pending_transaction
+        assert receipt.gas_used == 120000
+        assert not cancellation
+        assert pending_transaction.gas_price_of(receipt.transaction_hash) == GAS_PRICE
+        assert manager.in_flight() == []
+
+    def test_should_hand_over_the_receipt_of_the_cancellation(self, manager, node, receipts):
+        # given
+        pending_transaction = manager.submit(fake_opportunity(), self.transact(node), 100)
+        manager.on_block(101, self.unprofitable)
+        node.mine(pending_transaction.cancellation_hashes[0])
+
+        # when
+        manager._poll()
+
+        # then
+        (_, receipt, cancellation) = receipts[0]
+        assert cancellation
+        assert pending_transaction.gas_price_of(receipt.transaction_hash) == 11250000000
+
+    def test_should_tell_a_trade_mined_after_its_cancellation_was_sent(self, manager, node, receipts):
+        # given
+        pending_transaction = manager.submit(fake_opportunity(), self.transact(node), 100)
+        manager.on_block(101, self.unprofitable)
+        node.mine(pending_transaction.transaction_hashes[0], gas_used=120000)
+
+        # when
+        manager._poll()
+
+        # then
+        (_, receipt, cancellation) = receipts[0]
+        assert pending_transaction.cancelled
+        assert not cancellation
+        assert pending_transaction.gas_price_of(receipt.transaction_hash) == GAS_PRICE
+
+    def test_should_wait_for_receipts(self, manager, node, receipts):
+        # given
+        manager.submit(fake_opportunity(), self.transact(node), 100)
+
+        # when
+        manager._poll()
+
+        # then
+        assert receipts == []
+        assert len(manager.in_flight()) == 1
+
+    def test_should_give_up_on_a_nonce_used_by_another_transaction(self, manager, node, receipts):
+        # given
+        pending_transaction = manager.submit(fake_opportunity(), self.transact(node), 100)
+        node.mined_nonce = 6
+
+        # when
+        manager._poll()
+
+        # then
+        assert receipts == [(pending_transaction, None, False)]
+        assert manager.next_nonce is None
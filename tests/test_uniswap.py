@@ -0,0 +1,168 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus, kentonprescott
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+
+import pytest
+
+from pymaker import Address
+from pymaker.numeric import Wad
+
+from simple_arbitrage_keeper.rpc_batch import BatchReader
+from simple_arbitrage_keeper.uniswap import UniswapReserves, get_input_price, get_output_price, queue_reserves
+from tests.stand_ins import ENTRY_EXCHANGE, ENTRY_TOKEN, ETH_PRICE, ETH_RESERVE, RpcHandler, StandIn, SyntheticMarkets
+
+
+def contract_input_price(input_amount: int, input_reserve: int, output_reserve: int) -> int:
+    """ `getInputPrice` of the Uniswap V1 exchange contract, transcribed from its Vyper source """
+    input_amount_with_fee = input_amount * 997
+    numerator = input_amount_with_fee * output_reserve
+    denominator = (input_reserve * 1000) + input_amount_with_fee
+    return numerator // denominator
+
+
+def contract_output_price(output_amount: int, input_reserve: int, output_reserve: int) -> int:
+    """ `getOutputPrice` of the Uniswap V1 exchange contract, transcribed from its Vyper source """
+    numerator = input_reserve * output_amount * 1000
+    denominator = (output_reserve - output_amount) * 997
+    return numerator // denominator + 1
+
+
+class TestGetInputPrice:
+    def test_should_charge_the_fee(self):
+        # 999 without the fee
+        assert get_input_price(1000, 10**6, 10**6) == 996
+
+    def test_should_round_down_at_the_fee_boundary(self):
+        # 1 * 997 * 1000 / (1000 * 1000 + 997) = 0.996
+        assert get_input_price(1, 1000, 1000) == 0
+        # 2 * 997 * 1000 / (1000 * 1000 + 1994) = 1.99
+        assert get_input_price(2, 1000, 1000) == 1
+
+    def test_should_be_exact_when_the_division_is(self):
+        # 1000 * 997 * 2 / (997 * 1000 + 997000) = 1 exactly
+        assert get_input_price(1000, 997, 2) == 1
+        assert get_input_price(999, 997, 2) == 0
+
+    def test_should_price_tiny_reserves(self):
+        assert get_input_price(2, 1, 2) == 1
+        assert get_input_price(1, 1, 1) == 0
+        assert get_input_price(10**30, 1, 1) == 0
+
+    def test_should_never_drain_the_output_reserve(self):
+        assert get_input_price(10**40, 10**18, 10**18) == 10**18 - 1
+
+    def test_should_reject_empty_reserves(self):
+        with pytest.raises(AssertionError):
+            get_input_price(1, 0, 10**18)
+        with pytest.raises(AssertionError):
+            get_input_price(1, 10**18, 0)
+
+    def test_should_match_the_contract(self):
+        generator = random.Random(1)
+        for _ in range(1000):
+            (input_amount, input_reserve, output_reserve) = (generator.randint(0, 10**24),
+                                                             generator.randint(1, 10**24),
+                                                             generator.randint(1, 10**24))
+            assert get_input_price(input_amount, input_reserve, output_reserve) == \
+                contract_input_price(input_amount, input_reserve, output_reserve)
+
+
+class TestGetOutputPrice:
+    def test_should_charge_the_fee(self):
+        # 1000 * 1000 / (999 * 997) = 1.004, rounded down, plus one
+        assert get_output_price(1, 1000, 1000) == 2
+
+    def test_should_overcharge_by_one_when_the_division_is_exact(self):
+        # 997 * 1 * 1000 / ((2 - 1) * 997) = 1000 exactly, the contract still adds one
+        assert get_output_price(1, 997, 2) == 1001
+
+    def test_should_price_tiny_reserves(self):
+        assert get_output_price(1, 1, 2) == 2
+        assert get_output_price(0, 1, 1) == 1
+
+    def test_should_reject_buying_the_whole_reserve(self):
+        with pytest.raises(AssertionError):
+            get_output_price(10**18, 10**18, 10**18)
+        with pytest.raises(AssertionError):
+            get_output_price(10**18 + 1, 10**18, 10**18)
+
+    def test_should_reject_empty_reserves(self):
+        with pytest.raises(AssertionError):
+            get_output_price(1, 0, 10**18)
+
+    def test_should_match_the_contract(self):
+        generator = random.Random(2)
+        for _ in range(1000):
+            output_reserve = generator.randint(2, 10**24)
+            (output_amount, input_reserve) = (generator.randint(0, output_reserve - 1), generator.randint(1, 10**24))
+            assert get_output_price(output_amount, input_reserve, output_reserve) == \
+                contract_output_price(output_amount, input_reserve, output_reserve)
+
+    def test_should_buy_at_least_the_output_amount_when_sold(self):
+        generator = random.Random(3)
+        for _ in range(1000):
+            output_reserve = generator.randint(2, 10**24)
+            (output_amount, input_reserve) = (generator.randint(1, output_reserve - 1), generator.randint(1, 10**24))
+            input_amount = get_output_price(output_amount, input_reserve, output_reserve)
+
+            assert get_input_price(input_amount, input_reserve, output_reserve) >= output_amount
+
+
+class TestUniswapReserves:
+    reserves = UniswapReserves(token_reserve=Wad(200 * 10**18), eth_reserve=Wad(10**18))
+
+    def test_should_sell_tokens_for_eth(self):
+        assert self.reserves.token_to_eth_input_price(Wad(10**18)) == \
+            Wad(contract_input_price(10**18, 200 * 10**18, 10**18))
+
+    def test_should_sell_eth_for_tokens(self):
+        assert self.reserves.eth_to_token_input_price(Wad(10**16)) == \
+            Wad(contract_input_price(10**16, 10**18, 200 * 10**18))
+
+    def test_should_buy_eth_with_tokens(self):
+        assert self.reserves.token_to_eth_output_price(Wad(10**16)) == \
+            Wad(contract_output_price(10**16, 200 * 10**18, 10**18))
+
+    def test_should_buy_tokens_with_eth(self):
+        assert self.reserves.eth_to_token_output_price(Wad(10**18)) == \
+            Wad(contract_output_price(10**18, 10**18, 200 * 10**18))
+
+    def test_should_value_eth_at_the_mid_price(self):
+        assert self.reserves.eth_value_in_tokens(Wad(3 * 10**15)) == Wad(6 * 10**17)
+
+
+class TestQueueReserves:
+    @pytest.fixture
+    def node(self):
+        node = StandIn(RpcHandler, SyntheticMarkets())
+        yield node
+        node.stop()
+
+    def test_should_read_both_reserves_in_one_request(self, node):
+        # given
+        batch = BatchReader(node.uri, timeout=5.0).batch()
+
+        # when
+        reserves = queue_reserves(batch, Address(ENTRY_TOKEN), Address(ENTRY_EXCHANGE))
+        batch.execute()
+
+        # then
+        assert reserves().token_reserve == Wad(int(ETH_RESERVE * ETH_PRICE))
+        assert reserves().eth_reserve == Wad(ETH_RESERVE)
+        assert node.counts['requests'] == 1
+        assert node.counts['calls'] == 2